@@ -1,9 +1,14 @@
 import boto3
 import os
-import botocore
 import logging
 
 from agief_experiment import utils
+from agief_experiment import deltasync
+from agief_experiment.deltasync import DeltaSync
+from agief_experiment.envresolver import EnvResolver
+from agief_experiment.experimentutils import ExperimentUtils
+from agief_experiment.s3uploader import S3Uploader
+from agief_experiment.tracing import Tracer
 
 
 class Cloud:
@@ -33,20 +38,22 @@ class Cloud:
     network_interface_id = 'eni - b2acd4d4'
 
     def __init__(self):
-        pass
+        # one S3 client and bucket check for the whole session
+        self.s3_uploader = S3Uploader()
 
+    @Tracer.traced('cloud.sync')
     def sync_experiment(self, remote):
         """
         Sync experiment from this machine to remote machine
         """
 
-        print("\n....... Use remote-sync-experiment.sh to "
-              "rsync relevant folders.")
+        print("\n....... Sync code, experiment and variables folders "
+              "(changed files only).")
 
-        cmd = ("../remote/remote-sync-experiment.sh " +
-               remote.host_key_user_variables())
-        utils.run_bashscript_repeat(cmd, 15, 6)
+        env = EnvResolver.for_file(ExperimentUtils("").variables_filepath())
+        DeltaSync(remote).sync(deltasync.experiment_trees(env))
 
+    @Tracer.traced('cloud.download')
     def remote_download_output(self, prefix, host_node):
         """ Download /output/prefix folder from remote storage (s3) to remote machine.
         :param host_node:
@@ -62,6 +69,7 @@ class Cloud:
                " " + host_node.host_key_user_variables())
         utils.run_bashscript_repeat(cmd, 15, 6)
 
+    @Tracer.traced('cloud.docker-launch')
     def remote_docker_launch_compute(self, host_node):
         """
         Assumes there exists a private key for the given
@@ -80,6 +88,7 @@ class Cloud:
 
         return utils.remote_run(host_node, commands)
 
+    @Tracer.traced('cloud.ecs-run')
     def ecs_run_task(self, task_name):
         """ Run task 'task_name' and return the Task ARN """
 
@@ -110,6 +119,7 @@ class Cloud:
         task_arn = response['tasks'][0]['taskArn']
         return task_arn
 
+    @Tracer.traced('cloud.ecs-stop')
     def ecs_stop_task(self, task_arn):
 
         print("\n....... Stopping task on ecs ")
@@ -123,6 +133,7 @@ class Cloud:
 
         logging.debug("LOG: " + response)
 
+    @Tracer.traced('cloud.ec2-start')
     def ec2_start_from_instanceid(self, instance_id):
         """
         Run the chosen instance specified by instance_id
@@ -141,6 +152,7 @@ class Cloud:
         ips = self.ec2_wait_till_running(instance_id)
         return ips
 
+    @Tracer.traced('cloud.ec2-start')
     def ec2_start_from_ami(self, name, ami_id, min_ram):
         """
         :param name:
@@ -256,6 +268,7 @@ class Cloud:
 
         return {'ip_public': ip_public, 'ip_private': ip_private}
 
+    @Tracer.traced('cloud.ec2-stop')
     def ec2_stop(self, instance_id):
         print("\n...... Closing ec2 instance (instance id " +
               str(instance_id) + ")")
@@ -268,6 +281,7 @@ class Cloud:
 
         print("stop ec2: ", response)
 
+    @Tracer.traced('cloud.upload')
     def remote_upload_runfilename_s3(self, host_node, prefix, dest_name):
         cmd = ("../remote/remote-upload-runfilename.sh " + " " + prefix +
                " " + dest_name +
@@ -278,6 +292,7 @@ class Cloud:
             logging.error("Remote Upload Failed for this file")
             logging.error("Exception: %s", e)
 
+    @Tracer.traced('cloud.upload')
     def remote_upload_output_s3(self, host_node, prefix, no_compress,
                                 csv_output):
         cmd = "../remote/remote-upload-output.sh " + prefix + " "
@@ -285,61 +300,15 @@ class Cloud:
         cmd += str(no_compress) + " " + str(csv_output)
         utils.run_bashscript_repeat(cmd, 3, 3)
 
+    @Tracer.traced('cloud.upload')
     def upload_folder_s3(self, bucket_name, key, source_folderpath):
+        """ Upload a folder (recursively), uploading files concurrently """
+        self.s3_uploader.upload_folder(bucket_name, key, source_folderpath)
 
-        if not os.path.exists(source_folderpath):
-            logging.warning("folder does not exist, cannot upload: " +
-                            source_folderpath)
-            return
-
-        if not os.path.isdir(source_folderpath):
-            logging.warning("path is not a folder, cannot upload: " +
-                            source_folderpath)
-            return
-
-        for root, dirs, files in os.walk(source_folderpath):
-            for f in files:
-                filepath = os.path.join(source_folderpath, f)
-                filekey = os.path.join(key, f)
-
-                self.upload_file_s3(bucket_name, filekey, filepath)
-
-    @staticmethod
-    def upload_file_s3(bucket_name, key, source_filepath):
-
-        try:
-            if os.stat(source_filepath).st_size == 0:
-                logging.warning("file is empty, cannot upload: " +
-                                source_filepath)
-                return
-        except OSError:
-            logging.warning("file does not exist, cannot upload: " +
-                            source_filepath)
-            return
-
-        s3 = boto3.resource('s3')
-
-        exists = True
-        try:
-            s3.meta.client.head_bucket(Bucket=bucket_name)
-        except botocore.exceptions.ClientError as e:
-            # If a client error is thrown, then check that it was a 404 error.
-            # If it was a 404 error, then the bucket does not exist.
-            error_code = int(e.response['Error']['Code'])
-            if error_code == 404:
-                exists = False
-
-        if not exists:
-            logging.warning("s3 bucket " + bucket_name +
-                            " does not exist, creating it now.")
-            s3.create_bucket(Bucket=bucket_name)
-
-        print(" ... file = " + source_filepath + ", to bucket = " +
-              bucket_name + ", key = " + key)
-        response = s3.Object(bucket_name=bucket_name,
-                             key=key).put(Body=open(source_filepath, 'rb'))
-
-        logging.debug("Response = : ", response)
+    @Tracer.traced('cloud.upload')
+    def upload_file_s3(self, bucket_name, key, source_filepath):
+        """ Upload a file, in parts if it is large """
+        self.s3_uploader.upload_file(bucket_name, key, source_filepath)
 
     @staticmethod
     def print_ec2_info(instance):
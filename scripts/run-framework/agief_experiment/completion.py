@@ -0,0 +1,114 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""CompletionEstimator class."""
+
+import time
+import collections
+
+
+class CompletionEstimator:
+  """
+  Choose the period between polls of a running experiment.
+
+  The rate of progress (age per second) is measured from successive polls of
+  the experiment entity, or from its own 'runTime' before there are enough
+  polls. With 'terminationAge' known, the next poll is scheduled a little
+  before the estimated termination, so the period tightens towards the end
+  of the run. Otherwise, the period grows geometrically up to max_period.
+  """
+
+  def __init__(self, min_period=0.2, max_period=10.0, initial_period=0.5,
+               growth=1.5, headroom=0.8, window=10):
+    """
+    :param min_period: shortest period between polls (seconds)
+    :param max_period: longest period between polls (seconds)
+    :param initial_period: period used before there is any estimate
+    :param growth: factor to grow the period by, when there is no estimate
+    :param headroom: fraction of the estimated remaining time to sleep
+    :param window: number of recent polls used to measure the rate
+    """
+    self.min_period = min_period
+    self.max_period = max_period
+    self.growth = growth
+    self.headroom = headroom
+
+    self.period = initial_period
+    self.samples = collections.deque(maxlen=window)
+    self.runtime_rate = None
+    self.age = None
+    self.termination_age = None
+
+  def update(self, age, runtime=None, termination_age=None, now=None):
+    """
+    Record a poll of the experiment entity.
+
+    :param age: the entity 'age'
+    :param runtime: the entity 'runTime' (milliseconds), if available
+    :param termination_age: the entity 'terminationAge', if available
+    :param now: time of the poll, defaults to the current time
+    """
+    if now is None:
+      now = time.time()
+
+    try:
+      age = float(age)
+      runtime = float(runtime) if runtime is not None else None
+      termination_age = (float(termination_age)
+                         if termination_age is not None else None)
+    except (TypeError, ValueError):
+      return
+
+    self.age = age
+    self.termination_age = termination_age
+    self.samples.append((now, age))
+
+    if runtime and runtime > 0:
+      self.runtime_rate = age / (runtime / 1000.0)
+
+  def rate(self):
+    """Age per second, or None if it cannot be measured yet."""
+    if len(self.samples) >= 2:
+      (t_first, age_first), (t_last, age_last) = self.samples[0], self.samples[-1]
+      if t_last > t_first and age_last > age_first:
+        return (age_last - age_first) / (t_last - t_first)
+
+    if self.runtime_rate:
+      return self.runtime_rate
+
+    return None
+
+  def remaining(self):
+    """Estimated seconds until termination, or None if unknown."""
+    if self.termination_age is None or self.termination_age < 0:
+      return None
+
+    rate = self.rate()
+    if not rate:
+      return None
+
+    return max(self.termination_age - self.age, 0) / rate
+
+  def next_period(self):
+    """Return the number of seconds to sleep before the next poll."""
+    remaining = self.remaining()
+
+    if remaining is None:
+      period = self.period * self.growth
+    else:
+      period = remaining * self.headroom
+
+    self.period = min(max(period, self.min_period), self.max_period)
+    return self.period
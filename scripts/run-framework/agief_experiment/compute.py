@@ -1,38 +1,115 @@
 import os
+import gzip
 import time
+import fnmatch
+import filecmp
+import collections
 import json
 import logging
 import requests
 import dpath.util
+import threading
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
+
 from agief_experiment import utils
 from agief_experiment.experiment import Experiment
+from agief_experiment.httpsession import HttpSession
+from agief_experiment.httpsession import MultipartFileStream
+from agief_experiment.completion import CompletionEstimator
+from agief_experiment.retry import Retry, RetryPolicy
+from agief_experiment.readiness import ReadinessProbe
+from agief_experiment.entityfile import EntityFile
+from agief_experiment.tracing import Tracer
+from agief_experiment.metrics import Metrics
+from agief_experiment.stall import StallError
 
 
 class Compute:
+
+    # local Docker containers are identified as the last-run container, so
+    # local launches in Docker are serialized
+    local_docker_lock = threading.Lock()
+
+    # consecutive connection errors while polling a running experiment
+    CONNECTION_ERROR_POLICY = RetryPolicy(initial=1, maximum=10,
+                                          max_attempts=6, deadline=120)
+
+    # maximum number of data files uploaded to /import at the same time
+    MAX_IMPORT_WORKERS = 4
+
+    # maximum number of entities configured with /config at the same time
+    MAX_CONFIG_WORKERS = HttpSession.POOL_MAXSIZE
+
     def __init__(self,
                  host_node,
-                 port=8491):
+                 port=8491,
+                 run_folder=None):
 
         """
         If remote_node is unspecified, then assumes use of a local Compute node
+
+        If run_folder is specified, a local Compute is launched from that
+        folder (used as AGI_RUN_HOME) and writes its logs there. This allows
+        several local Compute nodes to run side by side on distinct ports.
         """
 
         self.port = port
         self.host_node = host_node
+        self.run_folder = run_folder
         self.container_id = ''
         self.runtime = 0
 
+        # set by launch, if Compute runs on this machine outside of Docker,
+        # so that input files can be loaded directly with /import-local
+        self.local_filesystem = False
+
+        # gzip compress uploads to /import, unless Compute rejects it
+        self.import_gzip = False
+        self.import_gzip_rejected = False
+
+        # regular expression of the line in run_stdout.log that shows a
+        # local Compute has started, if None the log is not used
+        self.started_marker = None
+
+        # if set (warm reuse), data files already loaded since launch are
+        # not imported again: local files are matched by content, files on
+        # the Compute machine by path. Only files whose name matches one of
+        # the patterns of read_only_data are reused, as a run may write to
+        # the data it imported
+        self.reuse_data = False
+        self.read_only_data = []
+        self.loaded_data = {}
+        self.loaded_compute_data = set()
+
+        # parameter sets run since launch, and whether one of them failed
+        # (so that the state of Compute is unknown)
+        self.warm_runs = 0
+        self.warm_dirty = False
+        self.last_experiment_entity = None
+
+        # if set (a StallPolicy), runs whose age stops advancing are aborted,
+        # and the age rate of the last completed run is kept in age_rate
+        self.stall_policy = None
+        self.age_rate = None
+
     def remote(self):
         return self.host_node.remote()
 
     def base_url(self):
         return utils.getbaseurl(self.host_node.host, self.port)
 
+    def http(self):
+        """
+        The pooled keep-alive session for this Compute node. It is looked up
+        per call, as host and port can be changed after construction.
+        """
+        return HttpSession.for_url(self.base_url())
+
     def get_entity_config(self, entity_name):
         param_dic = {'entity': entity_name}
-        r = requests.get(self.base_url() + '/config', params=param_dic)
+        r = self.http().get('/config', params=param_dic)
 
         logging.debug("Get config: /config with params " +
                       json.dumps(param_dic))
@@ -42,26 +119,114 @@ class Compute:
         config = r.json()
         return config
 
-    def wait_till_param(self, entity_name, param_path, value, max_tries=-1):
+    def entity_exists(self, entity_name):
+        """True if Compute has an entity called 'entity_name'."""
+        try:
+            config = self.get_entity_config(entity_name)
+        except ValueError:
+            # not JSON, i.e. an error response
+            return False
+        return isinstance(config, dict) and 'value' in config
+
+    def is_clean(self, prefix_entity):
+        """
+        True if Compute is in a clean state to import the next parameter set:
+        the previous one did not fail, its experiment entity (if any) has
+        terminated, and no entity of the next one ('prefix_entity') exists.
+        """
+        if self.warm_dirty:
+            logging.info("Previous parameter set failed on %s",
+                         self.base_url())
+            return False
+
+        previous_entity = self.last_experiment_entity
+        if previous_entity is not None:
+            config = self.get_entity_config(previous_entity)
+            try:
+                terminated = dpath.util.get(config, 'value.terminated', '.')
+            except (KeyError, TypeError):
+                terminated = True
+            if not terminated:
+                logging.info("%s is still running on %s", previous_entity,
+                             self.base_url())
+                return False
+
+        if self.entity_exists(prefix_entity):
+            logging.info("%s already exists on %s", prefix_entity,
+                         self.base_url())
+            return False
+
+        return True
+
+    def forget_loaded_data(self):
+        self.loaded_data = {}
+        self.loaded_compute_data = set()
+        self.warm_runs = 0
+        self.warm_dirty = False
+        self.last_experiment_entity = None
+
+    def is_read_only_data(self, filepath):
+        """True if the name of data file 'filepath' is in read_only_data."""
+        filename = os.path.basename(filepath)
+        return any(fnmatch.fnmatch(filename, pattern)
+                   for pattern in self.read_only_data)
+
+    def is_data_loaded(self, filepath):
+        """
+        True if a read only data file with the same content as 'filepath'
+        has been loaded. Files are matched by size and mtime (linked or
+        copied input files keep the mtime of the base file), then by inode
+        or content.
+        """
+        if not self.is_read_only_data(filepath):
+            return False
+
+        stat = os.stat(filepath)
+        loaded_filepath = self.loaded_data.get((stat.st_size,
+                                                stat.st_mtime_ns))
+        if loaded_filepath is None:
+            return False
+
+        try:
+            return (os.path.samefile(loaded_filepath, filepath) or
+                    filecmp.cmp(loaded_filepath, filepath, shallow=False))
+        except OSError:
+            return False
+
+    def remember_loaded_data(self, filepaths):
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            self.loaded_data[(stat.st_size, stat.st_mtime_ns)] = filepath
+
+    def wait_till_param(self, entity_name, param_path, value,
+                        max_wait_seconds=-1, watchdog=None):
         """
         Return when the the config parameter has achieved the value specified
         entity = name of entity, param_path = path to parameter,
         delimited by '.'
 
+        If the value is not reached within 'max_wait_seconds' (if > 0),
+        AGIEF is considered hung and an exception is raised. It is a time
+        budget rather than a number of polls, as the poll period adapts
+        (see CompletionEstimator).
         If there are too many connection errors, exit the whole program.
+        If 'watchdog' (a StallWatchdog) finds that the age of the entity has
+        stalled, Compute is stopped and StallError is raised.
         """
 
-        max_connection_error = 5
-
-        wait_period = 10
+        estimator = CompletionEstimator()
+        start = time.time()
         age = None
         i = 0
         param_runtime = 0
-        connection_error_count = 0
 
-        print("... Waiting for param to achieve value (try every " +
-              str(wait_period) + "s): " + entity_name +
-              "." + param_path + " = " + str(value))
+        # consecutive connection errors are retried with backoff, until the
+        # policy runs out
+        connection_retry = None
+
+        print("... Waiting for param to achieve value (adaptive poll every " +
+              str(estimator.min_period) + "-" + str(estimator.max_period) +
+              "s): " + entity_name + "." + param_path + " = " + str(value))
 
         def print_age(idx, age_str):
             #     utils.restart_line()
@@ -75,15 +240,11 @@ class Compute:
             if age is not None:
                 age_string = ", " + entity_name + ".age = " + str(age)
 
-            if 0 < max_tries < i:
+            if 0 < max_wait_seconds < time.time() - start:
                 print_age(i, age_string)
-                msg = "ERROR: Tried " + str(max_tries) + " times, without " \
-                      "success, AGIEF is considered hung."
-                raise Exception(msg)
-
-            if connection_error_count > max_connection_error:
-                msg = "ERROR: too many connection errors: " + \
-                      str(max_connection_error)
+                msg = "ERROR: Waited " + str(max_wait_seconds) + "s (" + \
+                      str(i - 1) + " tries), without success, AGIEF is " \
+                      "considered hung."
                 raise Exception(msg)
 
             if i % 5 == 0:
@@ -91,6 +252,7 @@ class Compute:
 
             try:
                 config = self.get_entity_config(entity_name)
+                connection_retry = None
 
                 if 'value' in config:
                     age = dpath.util.get(config, 'value.age', '.')
@@ -104,17 +266,37 @@ class Compute:
                             param_path + ", has achieved value: " + str(
                                 value) + ".")
                         break
+
+                    # estimate time to termination, to choose the next poll
+                    estimator.update(age, param_runtime,
+                                     config['value'].get('terminationAge'))
+                    self.publish_progress(age, estimator)
+
+                    if watchdog is not None:
+                        watchdog.update(age)
+                        reason = watchdog.stalled()
+                        if reason:
+                            self.abort_stalled(entity_name, reason)
             except KeyError:
                 logging.warning("KeyError Exception: Trying to access a " +
                                 "keypath in config object, that DOES NOT " +
                                 "exist!")
             except requests.exceptions.ConnectionError:
                 logging.error("Oops, ConnectionError exception")
-                connection_error_count += 1
+                self.check_responding(entity_name, watchdog)
+                if connection_retry is None:
+                    connection_retry = Retry(self.CONNECTION_ERROR_POLICY,
+                                             'compute-poll-connection')
+                if not connection_retry.backoff():
+                    msg = "ERROR: too many connection errors: " + \
+                          str(connection_retry.attempt)
+                    raise Exception(msg)
+                continue
             except requests.exceptions.RequestException:
                 logging.error("Oops, request exception")
+                self.check_responding(entity_name, watchdog)
 
-            time.sleep(wait_period)  # sleep for n seconds
+            time.sleep(estimator.next_period())
 
         # successfully reached value
         print_age(i, age_string)
@@ -124,11 +306,61 @@ class Compute:
         if param_runtime > 0:
             self.runtime = utils.format_runtime(param_runtime)
 
+    def check_responding(self, entity_name, watchdog):
+        """
+        After a failed poll of 'entity_name', abort the run if 'watchdog' (if
+        any) finds that no poll has succeeded for its window.
+        """
+        if watchdog is None:
+            return
+
+        reason = watchdog.stalled()
+        if reason:
+            self.abort_stalled(entity_name, reason)
+
+    def abort_stalled(self, entity_name, reason):
+        """Stop Compute, as the run of 'entity_name' has stalled."""
+        msg = "ERROR: " + entity_name + " has stalled (" + reason + \
+              "), abort the run."
+        logging.error(msg)
+        Metrics.inc('agief_stalls')
+        try:
+            self.terminate()
+        except requests.exceptions.RequestException as e:
+            # e.g. a hung Compute does not answer /stop either
+            logging.warning("Could not stop Compute at %s: %s",
+                            self.base_url(), e)
+        raise StallError(msg)
+
+    def publish_progress(self, age, estimator):
+        """Publish the age and age rate of the polled entity as metrics."""
+        if not Metrics.enabled:
+            return
+
+        labels = {'node': self.base_url()}
+        try:
+            Metrics.set('agief_entity_age', float(age), **labels)
+        except (TypeError, ValueError):
+            pass
+        Metrics.set('agief_entity_age_rate', estimator.rate() or 0.0,
+                    **labels)
+        Metrics.set('agief_entity_poll_timestamp_seconds', time.time(),
+                    **labels)
+
+    @Tracer.traced('compute.import')
     def import_experiment(self, entity_filepath=None, data_filepaths=None):
-        """setup the running instance of AGIEF with the input files"""
+        """
+        setup the running instance of AGIEF with the input files
+
+        Files are streamed to /import in chunks (gzip compressed on the fly,
+        if import_gzip is set and Compute accepts it), with the data files
+        uploaded concurrently once the entities are imported. If Compute
+        shares this machine's filesystem, it is asked to load the files
+        itself with /import-local instead.
+        """
 
         is_entity_file = entity_filepath is not None
-        is_data_files = data_filepaths is not None or len(data_filepaths) != 0
+        is_data_files = bool(data_filepaths)
 
         print("\n....... Import experiment")
 
@@ -143,35 +375,96 @@ class Compute:
         if is_data_files:
             print("        Data: " + json.dumps(data_filepaths))
 
-        if is_entity_file:
-            if not os.path.isfile(entity_filepath):
-                raise Exception("ERROR: entity file does not exist.")
-
-            with open(entity_filepath, 'rb') as entity_data_file:
-                files = {'entity-file': entity_data_file}
-                response = requests.post(self.base_url() + '/import',
-                                         files=files)
-
-                logging.debug("Import entity file")
-                logging.debug("  response text = " + response.text)
-                logging.debug("  url: " + response.url)
-                logging.debug("  post body = " + str(files))
+        if is_entity_file and not os.path.isfile(entity_filepath):
+            raise Exception("ERROR: entity file does not exist.")
 
         if is_data_files:
             for data_filepath in data_filepaths:
                 if not os.path.isfile(data_filepath):
                     raise Exception("ERROR: data file does not exist.")
 
-                with open(data_filepath, 'rb') as data_data_file:
-                    files = {'data-file': data_data_file}
-                    response = requests.post(self.base_url() + '/import',
-                                             files=files)
+        if is_data_files and self.reuse_data:
+            loaded = [data_filepath for data_filepath in data_filepaths
+                      if self.is_data_loaded(data_filepath)]
+            if loaded:
+                print("        Already loaded: " + json.dumps(loaded))
+                data_filepaths = [data_filepath
+                                  for data_filepath in data_filepaths
+                                  if data_filepath not in loaded]
+                is_data_files = bool(data_filepaths)
+
+        if self.local_filesystem:
+            logging.debug("Compute shares the local filesystem, "
+                          "using /import-local")
+            if is_entity_file:
+                self.import_compute_experiment([entity_filepath],
+                                               is_data=False)
+            if is_data_files:
+                self.import_compute_experiment(data_filepaths, is_data=True)
+                self.remember_loaded_data(data_filepaths)
+            return
 
-                    logging.debug("Import data file")
-                    logging.debug("  response text = " + response.text)
-                    logging.debug("  url: " + response.url)
-                    logging.debug("  post body = " + str(files))
+        if is_entity_file:
+            self._import_file('entity-file', entity_filepath)
+
+        if is_data_files:
+            workers = min(len(data_filepaths), self.MAX_IMPORT_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() to raise any exception from the uploads
+                list(executor.map(
+                    lambda data_filepath: self._import_file('data-file',
+                                                            data_filepath),
+                    data_filepaths))
+            self.remember_loaded_data(data_filepaths)
+
+    @staticmethod
+    def is_gzip_rejected(response):
+        """
+        True if an /import response rejects the gzip content encoding: a 415,
+        or a 400 that names the encoding (other 400s are import errors, e.g.
+        an invalid entity or data file).
+        """
+        if response.status_code == 415:
+            return True
+        if response.status_code != 400:
+            return False
+
+        text = response.text.lower()
+        return 'gzip' in text or 'encoding' in text
+
+    def _import_file(self, field_name, filepath):
+        """Stream one file to /import, as multipart form field 'field_name'."""
+        body = MultipartFileStream(field_name, filepath)
+        headers = {'Content-Type': body.content_type}
+
+        compress = self.import_gzip and not self.import_gzip_rejected
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+            data = body.gzipped()
+        else:
+            data = body
 
+        start = time.time()
+        response = self.http().post('/import', data=data, headers=headers)
+
+        if compress and self.is_gzip_rejected(response):
+            logging.warning("Compute did not accept a gzip compressed import, "
+                            "sending uncompressed from now on")
+            self.import_gzip_rejected = True
+            return self._import_file(field_name, filepath)
+
+        if response.status_code == 400:
+            logging.error("Compute error response from /import, for " +
+                          filepath)
+
+        elapsed = max(time.time() - start, 1e-6)
+        size = os.path.getsize(filepath)
+        logging.debug("Import %s: %s (%d bytes, %.1f MB/s)", field_name,
+                      filepath, size, size / elapsed / (1024 * 1024))
+        logging.debug("  response text = " + response.text)
+        logging.debug("  url: " + response.url)
+
+    @Tracer.traced('compute.import-local')
     def import_compute_experiment(self, filepaths, is_data):
         """
         Load data files into AGIEF compute node, by requesting it to load a
@@ -188,7 +481,16 @@ class Compute:
         if is_data:
             import_type = 'data'
 
-        is_data_files = filepaths is not None or len(filepaths) != 0
+        if is_data and self.reuse_data and filepaths:
+            loaded = [filepath for filepath in filepaths
+                      if filepath in self.loaded_compute_data and
+                      self.is_read_only_data(filepath)]
+            if loaded:
+                print("      Already loaded: " + json.dumps(loaded))
+                filepaths = [filepath for filepath in filepaths
+                             if filepath not in loaded]
+
+        is_data_files = bool(filepaths)
 
         if is_data_files:
             print("     Input files: ")
@@ -199,8 +501,7 @@ class Compute:
 
         for filepath in filepaths:
             payload = {'type': import_type, 'file': filepath}
-            response = requests.get(self.base_url() + '/import-local',
-                                    params=payload)
+            response = self.http().get('/import-local', params=payload)
 
             if response.status_code == 400:
                 msg = "Compute error response from /import-local - import " \
@@ -211,12 +512,24 @@ class Compute:
             logging.debug("  response text = " + response.text)
             logging.debug("  url: " + response.url)
 
-    def run_experiment(self, experiment_entity):
+            if is_data:
+                self.loaded_compute_data.add(filepath)
+
+    @Tracer.traced('compute.run')
+    def run_experiment(self, experiment_entity, baseline_rate=None):
+        """
+        Run the experiment, and wait for it to terminate. If stall detection
+        is on, 'baseline_rate' is the age rate of previous runs of the same
+        experiment, if known.
+        """
 
         print("\n....... Run experiment")
 
+        self.last_experiment_entity = experiment_entity
+        self.age_rate = None
+
         payload = {'entity': experiment_entity, 'event': 'update'}
-        response = requests.get(self.base_url() + '/update', params=payload)
+        response = self.http().get('/update', params=payload)
 
         if response.status_code == 400:
             msg = "Compute error response from /update"
@@ -224,14 +537,26 @@ class Compute:
 
         logging.debug("Start experiment, response text = " + response.text)
 
+        watchdog = None
+        if self.stall_policy is not None:
+            watchdog = self.stall_policy.watchdog(baseline_rate)
+
         # wait for the task to finish (poll API for 'Terminated' config param)
-        self.wait_till_param(experiment_entity, 'terminated', True)
+        self.wait_till_param(experiment_entity, 'terminated', True,
+                             watchdog=watchdog)
+
+        if watchdog is not None:
+            self.age_rate = watchdog.mean_rate()
+
+    EXPORT_CHUNK_SIZE = 1024 * 1024
 
     def export_root_entity(self, filepath, root_entity, export_type,
-                           is_compute_save=False):
+                           is_compute_save=False, compress=False):
         """
         Export the subtree specified by root entity - either we save locally,
         or specify the Compute node to save it itself
+        When saved locally, the response is streamed to the file in chunks as
+        it arrives, so memory use does not depend on the size of the export.
         :param filepath: if specified, then receive a string
         :param root_entity:
         :param export_type: 'entity' for the entity tree or 'data' for the
@@ -241,7 +566,9 @@ class Compute:
                                 if true then 'Compute' saves the file, using
                                 the path to a folder (for the compute machine)
                                 specified by filepath
-        :return:
+        :param compress: if true (and saved locally), gzip the file as it is
+                         written, to filepath + '.gz'
+        :return: the number of bytes written locally
         """
 
         if not is_compute_save:
@@ -253,28 +580,72 @@ class Compute:
                 'export-location': filepath
             }
 
-        response = requests.get(self.base_url() + '/export', params=payload)
+        response = self.http().get('/export', params=payload,
+                                   stream=not is_compute_save)
 
         if response.status_code == 400:
             logging.error("Could not export type '%s' for the entity tree " +
                           "with root node '%s'", export_type, root_entity)
-            return
+            response.close()
+            return 0
+
+        if not response.ok:
+            # e.g. a server error or a proxy error page, not an export
+            response.close()
+            response.raise_for_status()
+
+        logging.debug("  Response url = " + response.url)
 
         if is_compute_save:
             print("Saved file response: ", response.text)
+            logging.debug("  Response text = " + response.text)
+            return 0
 
-        logging.debug("  Response text = " + response.text)
-        logging.debug("  Response url = " + response.url)
+        # write back to file
+        if compress:
+            filepath += ".gz"
+        return self._stream_to_file(response, filepath, compress)
 
-        if not is_compute_save:
-            # write back to file
-            output_json = response.json()
-            utils.create_folder(filepath)
-            with open(filepath, 'w') as data_file:
-                data_file.write(json.dumps(output_json, indent=4))
+    def _stream_to_file(self, response, filepath, compress):
+        """
+        Write the body of a streamed response to 'filepath', and report the
+        bytes written and the throughput. The file is written under a
+        temporary name and renamed when complete.
+        """
 
+        utils.create_folder(filepath)
+        part_filepath = filepath + ".part"
+
+        start_time = time.time()
+        num_bytes = 0
+        try:
+            if compress:
+                out_file = gzip.open(part_filepath, 'wb', compresslevel=6)
+            else:
+                out_file = open(part_filepath, 'wb')
+
+            with out_file:
+                for chunk in response.iter_content(self.EXPORT_CHUNK_SIZE):
+                    out_file.write(chunk)
+                    num_bytes += len(chunk)
+        except BaseException:
+            utils.remove_file(part_filepath, silent=True)
+            raise
+        finally:
+            response.close()
+
+        os.replace(part_filepath, filepath)
+        Metrics.inc('agief_exported_bytes', num_bytes)
+
+        elapsed = max(time.time() - start_time, 1e-6)
+        print("  Exported %d bytes to %s in %.1fs (%.2f MB/s)" %
+              (num_bytes, filepath, elapsed, num_bytes / elapsed / 1e6))
+
+        return num_bytes
+
+    @Tracer.traced('compute.export')
     def export_subtree(self, root_entity, entity_filepath, data_filepath,
-                       is_export_compute=False):
+                       is_export_compute=False, compress=False):
         """
         Export the full state of a subtree from the running instance of AGIEF
         that consists of entity graph and the data
@@ -284,37 +655,34 @@ class Compute:
         logging.debug("Exporting data for root entity: %s", root_entity)
 
         self.export_root_entity(entity_filepath, root_entity, 'entity',
-                                is_export_compute)
+                                is_export_compute, compress)
         self.export_root_entity(data_filepath, root_entity, 'data',
-                                is_export_compute)
+                                is_export_compute, compress)
 
-    def _wait_up(self):
-        wait_period = 3
-
-        print("\n....... Wait till framework has started (try every {} "
-              "seconds),   at = {}".format(str(wait_period), self.base_url()))
-
-        i = 0
-        while True:
-            i += 1
-            if i > 120:
-                raise Exception("Error: could not start framework.")
-
-            version = self.version(True)
+    @Tracer.traced('compute.wait-up')
+    def _wait_up(self, launch_time=None, log_filepath=None):
+        """
+        Wait until Compute is ready (see ReadinessProbe). If 'log_filepath'
+        is given and started_marker is set, also wait for the marker in the
+        log.
+        """
+        print("\n....... Wait till framework has started,   at = " +
+              self.base_url())
 
-            if version is None:
-                # utils.restart_line()
-                # add comma at the end to remove newline
-                print("Try = [%d / 120]" % i)
-                time.sleep(wait_period)
-            else:
-                break
+        probe = ReadinessProbe(self, log_filepath, self.started_marker)
+        version = probe.wait(launch_time)
 
         print("\n  - framework is up, running version: " + version)
 
+    @Tracer.traced('compute.terminate')
     def terminate(self):
         print("\n...... Terminate framework")
-        response = requests.get(self.base_url() + '/stop')
+        self.forget_loaded_data()
+        try:
+            response = self.http().get('/stop')
+        except requests.ConnectionError:
+            logging.warning("Compute at %s is not running", self.base_url())
+            return
 
         logging.debug("Response text = " + response.text)
 
@@ -325,15 +693,40 @@ class Compute:
         """
 
         payload = {'entity': entity_name, 'path': param_path, 'value': value}
-        response = requests.post(self.base_url() + '/config', params=payload)
+        response = self.http().post('/config', params=payload)
 
         if response.status_code == 400:
             raise Exception(response.text)
 
         logging.debug("set_parameter_db: entity_name = " + entity_name +
-                      ", param_path = " + param_path + ', value = ' + value)
+                      ", param_path = " + param_path + ', value = ' +
+                      str(value))
         logging.debug("response = " + response.text)
 
+    @Tracer.traced('compute.set-params')
+    def set_parameters_db(self, params):
+        """
+        Set several parameters in the DB, each a tuple of (entity_name,
+        param_path, value). Entities are configured concurrently, and the
+        parameters of one entity in order (each /config updates the whole
+        config of the entity).
+        """
+        by_entity = collections.OrderedDict()
+        for entity_name, param_path, value in params:
+            by_entity.setdefault(entity_name, []).append((param_path, value))
+
+        if not by_entity:
+            return
+
+        def set_entity_parameters(entity_name):
+            for param_path, value in by_entity[entity_name]:
+                self.set_parameter_db(entity_name, param_path, value)
+
+        workers = min(len(by_entity), self.MAX_CONFIG_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() to raise any exception from the requests
+            list(executor.map(set_entity_parameters, by_entity))
+
     @staticmethod
     def set_parameter_inputfile(entity_filepath, entity_name, param_path,
                                 value):
@@ -348,51 +741,11 @@ class Compute:
         :return:
         """
 
-        set_param = entity_name + "." + param_path + " = " + str(value)
-
         logging.debug("in file: " + entity_filepath)
 
-        # open the entity input file
-        with open(entity_filepath) as data_file:
-            data = json.load(data_file)
-
-        # get the first element in the array with dictionary field
-        # "entity-name" = entity_name
-        entity = dict()
-        for entity_i in data:
-            if not entity_i["name"] == entity_name:
-                continue
-            entity = entity_i
-            break
-
-        if not entity:
-            msg = "\nERROR: Could not find an entity in the input file " \
-                  "matching the entity name specified in the " \
-                  "experiment file in field 'file-entities'.\n"
-            msg += "\tEntity input file: " + entity_filepath + "\n"
-            msg += "\tEntity name: " + entity_name
-            raise Exception(msg)
-
-        config = utils.get_entityfile_config(entity)
-
-        logging.debug("config(t)   = " + json.dumps(config, indent=4))
-
-        changed = dpath.util.set(config, param_path, value, '.')
-
-        if changed == 0:
-            msg = "\nERROR: Could not set the config in entity at param " \
-                  "path.\n"
-            msg += "\tEntity = " + entity_name + "\n"
-            msg += "\tParam_path = " + param_path
-            raise Exception(msg)
-
-        logging.debug("config(t+1) = " + json.dumps(config, indent=4))
-
-        utils.set_entityfile_config(entity, config)
-
-        # write back to file
-        with open(entity_filepath, 'w') as data_file:
-            data_file.write(json.dumps(data, indent=4))
+        with EntityFile(entity_filepath) as entity_file:
+            set_param = entity_file.set_parameter(entity_name, param_path,
+                                                  value)
 
         return set_param
 
@@ -404,14 +757,14 @@ class Compute:
 
         version = None
         try:
-            response = requests.get(self.base_url() + '/version')
+            response = self.http().get('/version')
             logging.debug("response = " + response.text)
 
             response_json = response.json()
             if 'version' in response_json:
                 version = response_json['version']
 
-        except requests.ConnectionError:
+        except (requests.ConnectionError, requests.Timeout):
             version = None
 
             if not is_suppress_console_output:
@@ -420,6 +773,7 @@ class Compute:
 
         return version
 
+    @Tracer.traced('compute.launch')
     def launch(self, experiment, cloud=None, use_ecs=False, ecs_task_name=None,
                main_class=None, no_local_docker=False):
         """
@@ -446,6 +800,8 @@ class Compute:
 
         print("\n....... Launch Compute")
 
+        self.forget_loaded_data()
+
         task_arn = None
         if cloud and self.remote():
             if use_ecs:
@@ -466,7 +822,7 @@ class Compute:
         else:
             print("Launching Compute locally")
             print("NOTE: Generating run_stdout.log and run_stderr.log " +
-                  "(in the current folder)")
+                  "(in " + (self.run_folder or "the current folder") + ")")
 
             if main_class:
                 cmd = "%s node.properties %s %s" % (
@@ -486,10 +842,38 @@ class Compute:
 
             logging.debug("Running: " + cmd)
 
-            # we can't hold on to the stdout and stderr streams for logging,
-            # because it will hang on this line instead, logging to a file
-            subprocess.Popen("%s > run_stdout.log 2> run_stderr.log" % cmd,
-                             shell=True, executable="/bin/bash")
+            env = None
+            if self.run_folder:
+                env = dict(os.environ, AGI_RUN_HOME=self.run_folder)
+
+            is_docker = not main_class and not no_local_docker
+            self.local_filesystem = not is_docker
+            if is_docker:
+                Compute.local_docker_lock.acquire()
+
+            try:
+                # we can't hold on to the stdout and stderr streams for
+                # logging, because it will hang on this line instead, logging
+                # to a file
+                launch_time = time.time()
+                subprocess.Popen("%s > run_stdout.log 2> run_stderr.log" % cmd,
+                                 shell=True, executable="/bin/bash",
+                                 cwd=self.run_folder, env=env)
+
+                # the log of a Docker launch is only the container id
+                log_filepath = None
+                if not is_docker:
+                    log_filepath = os.path.join(self.run_folder or os.getcwd(),
+                                                "run_stdout.log")
+                self._wait_up(launch_time, log_filepath)
+
+                if is_docker:
+                    self.container_id = utils.docker_id()
+            finally:
+                if is_docker:
+                    Compute.local_docker_lock.release()
+
+            return task_arn
 
         # TODO: fail if there are hard errors?
 
@@ -525,4 +909,5 @@ class Compute:
                                 "locate container id")
         elif not args.no_docker:
             # stops local docker
-                utils.docker_stop()
+            utils.docker_stop(self.container_id or None)
+            self.container_id = ''
@@ -0,0 +1,449 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""ComputeEmulator class, a local stand-in for the Compute REST API."""
+
+import os
+import json
+import time
+import gzip
+import email
+import logging
+import threading
+import collections
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import dpath.util
+
+from agief_experiment import utils
+
+STATS_PATH = '/emulator/stats'
+
+
+class ComputeEmulator:
+  """
+  Emulates the REST API of a Compute node, without the Java framework, so
+  that run-framework can be exercised (and its own overhead measured) on
+  machines without Compute:
+
+    /version, /config (GET and POST), /import, /import-local, /update,
+    /export, /stop
+
+  Entities and data are held in memory. An experiment entity started with
+  /update ages at 'age_rate' ages per second until its 'terminationAge' (it
+  runs forever if that is not positive), or stops ageing at 'stall_age' to
+  emulate a hung run. Every request is delayed by 'latency' seconds, and
+  exports are padded to at least 'export_size' bytes.
+
+  Calls and bytes per endpoint, and the emulated compute time, are
+  available from stats(), or as JSON from /emulator/stats.
+  """
+
+  VERSION = 'emulator'
+
+  def __init__(self, port=8491, host='localhost', latency=0.0, age_rate=100.0,
+               stall_age=None, export_size=0, accept_gzip=True):
+    self.host = host
+    self.port = int(port)
+    self.latency = latency
+    self.age_rate = age_rate
+    self.stall_age = stall_age
+    self.export_size = export_size
+    self.accept_gzip = accept_gzip
+
+    self.lock = threading.Lock()
+    self.entities = collections.OrderedDict()
+    self.data = collections.OrderedDict()
+    # entity name -> time /update started it
+    self.runs = {}
+
+    self.calls = collections.Counter()
+    self.bytes_in = collections.Counter()
+    self.bytes_out = collections.Counter()
+    self.compute_seconds = 0.0
+    self.stops = 0
+
+    self.server = None
+    self.thread = None
+
+  def base_url(self):
+    return utils.getbaseurl(self.host, str(self.port))
+
+  def start(self):
+    """Serve in a background thread, and return self."""
+    self.server = ThreadingHTTPServer((self.host, self.port),
+                                      self._handler_class())
+    self.server.daemon_threads = True
+    # the port may have been chosen by the OS (port 0)
+    self.port = self.server.server_address[1]
+    self.thread = threading.Thread(target=self.server.serve_forever,
+                                   name='compute-emulator', daemon=True)
+    self.thread.start()
+    logging.info("Compute emulator listening at %s", self.base_url())
+    return self
+
+  def serve_forever(self):
+    self.server = ThreadingHTTPServer((self.host, self.port),
+                                      self._handler_class())
+    self.server.daemon_threads = True
+    logging.info("Compute emulator listening at %s", self.base_url())
+    try:
+      self.server.serve_forever()
+    finally:
+      self.server.server_close()
+
+  def stop(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+  def stats(self):
+    with self.lock:
+      # runs still going count up to now
+      now = time.time()
+      running = sum(now - start for start in self.runs.values())
+      return {
+          'calls': dict(self.calls),
+          'bytes_in': dict(self.bytes_in),
+          'bytes_out': dict(self.bytes_out),
+          'compute_seconds': self.compute_seconds + running,
+          'entities': len(self.entities),
+          'data': len(self.data),
+          'stops': self.stops,
+      }
+
+  # ---------------------------------------------------------------------------
+  # the state of Compute
+
+  def import_entities(self, entities):
+    with self.lock:
+      for entity in entities:
+        entity = dict(entity)
+        entity['config'] = decode_config(entity.get('config'))
+        self.entities[entity['name']] = entity
+
+  def import_data(self, data):
+    with self.lock:
+      for item in data:
+        self.data[item['name']] = item
+
+  def entity_config(self, entity_name):
+    with self.lock:
+      entity = self.entities.get(entity_name)
+      if entity is None:
+        return None
+      self._advance(entity_name, entity['config'])
+      return entity['config']
+
+  def set_config(self, entity_name, param_path, value):
+    with self.lock:
+      entity = self.entities.get(entity_name)
+      if entity is None:
+        return None
+      dpath.util.new(entity['config'], param_path, value, '.')
+      return entity['config']
+
+  def update(self, entity_name):
+    with self.lock:
+      entity = self.entities.get(entity_name)
+      if entity is None:
+        return False
+      config = entity['config']
+      config['age'] = 0
+      config['terminated'] = False
+      self.runs[entity_name] = time.time()
+      return True
+
+  def _advance(self, entity_name, config):
+    """Bring the age of a running experiment entity up to date."""
+    start = self.runs.get(entity_name)
+    if start is None:
+      return
+
+    now = time.time()
+    age = int((now - start) * self.age_rate)
+    if self.stall_age is not None:
+      age = min(age, self.stall_age)
+
+    termination_age = config.get('terminationAge', -1)
+    try:
+      termination_age = int(termination_age)
+    except (TypeError, ValueError):
+      termination_age = -1
+
+    if 0 < termination_age <= age:
+      age = termination_age
+      config['terminated'] = True
+      del self.runs[entity_name]
+      # the compute time, as if polled the moment the run terminated
+      self.compute_seconds += termination_age / float(self.age_rate)
+
+    config['age'] = age
+    config['runTime'] = int((now - start) * 1000)
+
+  def subtree(self, root_entity):
+    """The entities of the subtree of 'root_entity', root first."""
+    with self.lock:
+      names = {root_entity}
+      subtree = []
+      for name, entity in self.entities.items():
+        if name == root_entity or entity.get('parent') in names:
+          names.add(name)
+          subtree.append(entity)
+      return subtree
+
+  def export(self, root_entity, export_type):
+    """The entity or data export of a subtree, as JSON text."""
+    subtree = self.subtree(root_entity)
+    if not subtree:
+      return None
+
+    if export_type == 'entity':
+      exported = []
+      for entity in subtree:
+        entity = dict(entity)
+        entity['config'] = json.dumps(entity['config'])
+        exported.append(entity)
+      return json.dumps(exported)
+
+    names = [entity['name'] for entity in subtree]
+    with self.lock:
+      exported = [item for item in self.data.values()
+                  if any(item['name'].startswith(name) for name in names)]
+
+    text = json.dumps(exported)
+    if len(text) < self.export_size:
+      # pad with a synthetic data item, to emulate large exports
+      padding = self.export_size - len(text)
+      exported.append({'name': root_entity + '-emulated', 'sizes': 'null',
+                       'elements': 'x' * padding, 'refKeys': 'null'})
+      text = json.dumps(exported)
+    return text
+
+  def terminate(self):
+    """As for /stop: the framework state is discarded."""
+    with self.lock:
+      self.entities.clear()
+      self.data.clear()
+      self.runs.clear()
+      self.stops += 1
+
+  # ---------------------------------------------------------------------------
+  # HTTP
+
+  def _handler_class(self):
+    emulator = self
+
+    class Handler(EmulatorRequestHandler):
+      pass
+
+    Handler.emulator = emulator
+    return Handler
+
+
+class EmulatorRequestHandler(BaseHTTPRequestHandler):
+  """Routes the requests of the Compute REST API to a ComputeEmulator."""
+
+  protocol_version = 'HTTP/1.1'
+  emulator = None
+
+  def log_message(self, format, *args):  # pylint: disable=W0622
+    logging.debug("emulator: " + format, *args)
+
+  def do_GET(self):  # pylint: disable=C0103
+    self._dispatch('GET')
+
+  def do_POST(self):  # pylint: disable=C0103
+    self._dispatch('POST')
+
+  def _dispatch(self, method):
+    url = urlsplit(self.path)
+    params = {key: values[-1]
+              for key, values in parse_qs(url.query).items()}
+    body = self._read_body()
+
+    emulator = self.emulator
+    endpoint = url.path
+    with emulator.lock:
+      emulator.calls[endpoint] += 1
+      emulator.bytes_in[endpoint] += len(body)
+
+    if emulator.latency > 0 and endpoint != STATS_PATH:
+      time.sleep(emulator.latency)
+
+    route = {
+        ('GET', '/version'): self.version,
+        ('GET', '/config'): self.get_config,
+        ('POST', '/config'): self.post_config,
+        ('POST', '/import'): self.import_files,
+        ('GET', '/import-local'): self.import_local,
+        ('GET', '/update'): self.update,
+        ('GET', '/export'): self.export,
+        ('GET', '/stop'): self.stop,
+        ('GET', STATS_PATH): self.stats,
+    }.get((method, endpoint))
+
+    if route is None:
+      self._send(404, {'error': 'no such endpoint: ' + endpoint})
+      return
+
+    try:
+      route(params, body)
+    except Exception as e:  # pylint: disable=W0703
+      logging.exception("emulator: %s %s failed", method, self.path)
+      self._send(400, {'error': str(e)})
+
+  def _read_body(self):
+    if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+      chunks = []
+      while True:
+        size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+        if size == 0:
+          # trailers, up to the blank line
+          while self.rfile.readline().strip():
+            pass
+          break
+        chunks.append(self.rfile.read(size))
+        self.rfile.readline()
+      return b''.join(chunks)
+
+    length = int(self.headers.get('Content-Length') or 0)
+    return self.rfile.read(length) if length else b''
+
+  def _send(self, status, payload):
+    if not isinstance(payload, (bytes, str)):
+      payload = json.dumps(payload)
+    if isinstance(payload, str):
+      payload = payload.encode('utf-8')
+
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+    with self.emulator.lock:
+      self.emulator.bytes_out[urlsplit(self.path).path] += len(payload)
+
+  # ---------------------------------------------------------------------------
+  # endpoints
+
+  def version(self, params, body):
+    self._send(200, {'version': self.emulator.VERSION})
+
+  def get_config(self, params, body):
+    entity_name = params.get('entity')
+    config = self.emulator.entity_config(entity_name)
+    if config is None:
+      self._send(200, {'entity': entity_name})
+    else:
+      self._send(200, {'entity': entity_name, 'value': config})
+
+  def post_config(self, params, body):
+    value = params.get('value')
+    try:
+      value = json.loads(value)
+    except (TypeError, ValueError):
+      pass
+
+    config = self.emulator.set_config(params.get('entity'),
+                                      params.get('path'), value)
+    if config is None:
+      self._send(400, {'error': 'no such entity: ' + str(params.get('entity'))})
+    else:
+      self._send(200, {'entity': params.get('entity'), 'value': config})
+
+  def import_files(self, params, body):
+    if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+      if not self.emulator.accept_gzip:
+        self._send(415, {'error': 'gzip content encoding not supported'})
+        return
+      body = gzip.decompress(body)
+
+    message = email.message_from_bytes(
+        b'Content-Type: ' + self.headers['Content-Type'].encode('latin-1') +
+        b'\r\n\r\n' + body)
+
+    for part in message.get_payload():
+      field_name = part.get_param('name', header='content-disposition')
+      content = json.loads(part.get_payload(decode=True).decode('utf-8'))
+      if field_name == 'entity-file':
+        self.emulator.import_entities(content)
+      elif field_name == 'data-file':
+        self.emulator.import_data(content)
+
+    self._send(200, {'imported': True})
+
+  def import_local(self, params, body):
+    filepath = params.get('file')
+    if not filepath or not os.path.isfile(filepath):
+      self._send(400, {'error': 'no such file: ' + str(filepath)})
+      return
+
+    with open(filepath) as import_file:
+      content = json.load(import_file)
+
+    if params.get('type') == 'entity':
+      self.emulator.import_entities(content)
+    else:
+      self.emulator.import_data(content)
+    self._send(200, {'imported': True})
+
+  def update(self, params, body):
+    if self.emulator.update(params.get('entity')):
+      self._send(200, {'entity': params.get('entity')})
+    else:
+      self._send(400, {'error': 'no such entity: ' + str(params.get('entity'))})
+
+  def export(self, params, body):
+    text = self.emulator.export(params.get('entity'), params.get('type'))
+    if text is None:
+      self._send(400, {'error': 'no such entity: ' + str(params.get('entity'))})
+      return
+
+    location = params.get('export-location')
+    if location:
+      if location.endswith('/') or os.path.isdir(location):
+        location = os.path.join(location, params.get('entity') + '-' +
+                                params.get('type') + '.json')
+      utils.create_folder(location)
+      with open(location, 'w') as export_file:
+        export_file.write(text)
+      self._send(200, {'saved': location})
+      return
+
+    self._send(200, text)
+
+  def stop(self, params, body):
+    self.emulator.terminate()
+    self._send(200, {'stopped': True})
+
+  def stats(self, params, body):
+    self._send(200, self.emulator.stats())
+
+
+def decode_config(config):
+  """The config of an imported entity (a json string, maybe escaped)."""
+  if isinstance(config, dict):
+    return config
+  if not config:
+    return {}
+  try:
+    return json.loads(config)
+  except ValueError:
+    return json.loads(config.replace('\\"', '"'))
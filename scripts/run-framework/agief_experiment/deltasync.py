@@ -0,0 +1,318 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""DeltaSync class, pushes changed files to a remote host over SFTP."""
+
+import os
+import json
+import time
+import uuid
+import queue
+import fnmatch
+import hashlib
+import logging
+import threading
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+from agief_experiment.sshpool import SSHPool
+
+# local_root: the folder to sync from
+# remote_root: the folder to sync to, relative to the remote home folder
+# exclude_dirs: fnmatch patterns of folders (relative paths) not to sync
+# gitignore: if True, also exclude what the .gitignore files exclude
+SyncTree = collections.namedtuple(
+    'SyncTree', ['local_root', 'remote_root', 'exclude_dirs', 'gitignore'])
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def experiment_trees(env):
+  """
+  The trees synced for a run-framework experiment (as by
+  remote-sync-experiment.sh): code, experiment folder and variables folder.
+
+  :type env: EnvResolver
+  """
+  exp_home = env.resolve('AGI_EXP_HOME')
+  return [
+      SyncTree(env.resolve('AGI_HOME'), 'agief-project/agi',
+               ('*.git', '*/src'), False),
+      SyncTree(exp_home, 'agief-project/run',
+               ('*.git', 'input', 'output'), False),
+      SyncTree(os.path.join(exp_home, '..', 'variables'),
+               'agief-project/variables', ('*.git',), False),
+  ]
+
+
+def tf_experiment_trees(env):
+  """
+  The tree synced for a TensorFlow experiment (as by
+  remote-sync-tf-experiment.sh), the code folder.
+
+  :type env: EnvResolver
+  """
+  return [SyncTree(env.resolve('AGI_CODE_HOME'), 'agief-remote-run',
+                   ('*.git',), True)]
+
+
+class DeltaSync:
+  """
+  Push the files that changed since the last sync, to a remote host.
+
+  A manifest of what was pushed (size, mtime and content hash of each file)
+  is cached locally per host and remote folder, so the changed files are
+  found without listing the remote tree. Files are only hashed if their size
+  or mtime changed. A random id is written to the remote folder along with
+  the manifest; if it doesn't match (e.g. a new machine, or the folder was
+  deleted) the manifest is discarded and everything is pushed.
+
+  Files are pushed over SFTP on the host's pooled SSH connection, with
+  'streams' files in flight at once. Remote files are never deleted, as with
+  rsync without --delete.
+  """
+
+  MANIFEST_FOLDER = os.path.expanduser('~/.agief/sync-manifests')
+  MARKER_FILENAME = '.agief-sync-id'
+
+  def __init__(self, host_node, streams=4, manifest_folder=None):
+    self.host_node = host_node
+    self.streams = streams
+    self.manifest_folder = manifest_folder or self.MANIFEST_FOLDER
+    self.pool = SSHPool.for_host(host_node)
+
+  def sync(self, trees):
+    """Sync each SyncTree, and return the total number of files pushed."""
+    return sum(self.sync_tree(tree) for tree in trees)
+
+  def sync_tree(self, tree):
+    start = time.time()
+    local_root = os.path.normpath(tree.local_root)
+    print("  sync " + local_root + " -> " + self.host_node.host + ":~/" +
+          tree.remote_root)
+
+    if not os.path.isdir(local_root):
+      raise Exception("ERROR: sync folder does not exist: " + local_root)
+
+    manifest_filepath = self.manifest_filepath(tree.remote_root)
+    manifest = load_manifest(manifest_filepath)
+
+    with self.pool.sftp() as sftp:
+      remote_id = read_remote_file(sftp, self.marker_path(tree))
+
+    if remote_id is None or remote_id != manifest['id']:
+      logging.info("No valid sync manifest for %s:%s, pushing all files",
+                   self.host_node.host, tree.remote_root)
+      manifest = {'id': uuid.uuid4().hex, 'files': {}}
+      remote_id = None
+
+    files = manifest['files']
+    changed = []
+    seen = set()
+    for relpath, stat in scan_tree(local_root, tree.exclude_dirs,
+                                   tree.gitignore):
+      seen.add(relpath)
+      entry = files.get(relpath)
+      if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        continue
+
+      content_hash = hash_file(os.path.join(local_root, relpath))
+      if entry and entry[2] == content_hash:
+        # touched, but the same content
+        files[relpath] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        continue
+
+      changed.append((relpath, stat, content_hash))
+
+    # forget files deleted locally (they are left on the remote host)
+    for relpath in set(files) - seen:
+      del files[relpath]
+
+    try:
+      pushed_bytes = self.push(local_root, tree.remote_root, changed, files)
+      if remote_id is None:
+        with self.pool.sftp() as sftp:
+          make_remote_dirs(sftp, tree.remote_root, set())
+          with sftp.open(self.marker_path(tree), 'w') as marker:
+            marker.write(manifest['id'])
+    finally:
+      save_manifest(manifest_filepath, manifest)
+
+    elapsed = max(time.time() - start, 1e-6)
+    print("  ... %d file(s) changed, %.1f MB pushed in %.2fs" % (
+        len(changed), pushed_bytes / (1024.0 * 1024.0), elapsed))
+    return len(changed)
+
+  def push(self, local_root, remote_root, changed, files):
+    """
+    Push the 'changed' files concurrently, recording each one in 'files'
+    once it is pushed. Return the number of bytes pushed.
+    """
+    if not changed:
+      return 0
+
+    pending = queue.Queue()
+    for item in changed:
+      pending.put(item)
+
+    lock = threading.Lock()
+    created_dirs = set()
+    pushed = [0]
+
+    def push_files():
+      # one SFTP session per stream, for as many files as it can take
+      with self.pool.sftp() as sftp:
+        while True:
+          try:
+            relpath, stat, content_hash = pending.get_nowait()
+          except queue.Empty:
+            return
+
+          remote_path = remote_root + '/' + relpath.replace(os.sep, '/')
+          with lock:
+            make_remote_dirs(sftp, os.path.dirname(remote_path),
+                             created_dirs)
+
+          logging.debug("push %s", relpath)
+          sftp.put(os.path.join(local_root, relpath), remote_path)
+          sftp.chmod(remote_path, stat.st_mode & 0o777)
+
+          with lock:
+            files[relpath] = [stat.st_size, stat.st_mtime_ns, content_hash]
+            pushed[0] += stat.st_size
+
+    streams = min(self.streams, len(changed))
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+      futures = [executor.submit(push_files) for _ in range(streams)]
+    for future in futures:
+      future.result()
+
+    return pushed[0]
+
+  def manifest_filepath(self, remote_root):
+    name = "%s@%s_%s_%s.json" % (self.host_node.user, self.host_node.host,
+                                 self.host_node.ssh_port, remote_root)
+    return os.path.join(self.manifest_folder, name.replace('/', '_'))
+
+  def marker_path(self, tree):
+    return tree.remote_root + '/' + self.MARKER_FILENAME
+
+
+def scan_tree(local_root, exclude_dirs, gitignore=False):
+  """
+  Generator of (relative path, os.stat_result) of the files under
+  'local_root', skipping excluded folders (and .gitignore'd paths).
+  """
+  ignores = gitignore_patterns(local_root) if gitignore else []
+
+  for dirpath, dirnames, filenames in os.walk(local_root):
+    reldir = os.path.relpath(dirpath, local_root)
+    reldir = '' if reldir == '.' else reldir + '/'
+
+    dirnames[:] = [
+        d for d in dirnames
+        if not any(fnmatch.fnmatch(reldir + d, p) for p in exclude_dirs)
+        and not is_ignored(reldir + d, True, ignores)]
+
+    for filename in filenames:
+      relpath = reldir + filename
+      if is_ignored(relpath, False, ignores):
+        continue
+      try:
+        stat = os.stat(os.path.join(dirpath, filename))
+      except OSError:
+        # e.g. a dangling link
+        continue
+      yield relpath, stat
+
+
+def gitignore_patterns(local_root):
+  """The patterns of the top level .gitignore (negations not supported)."""
+  filepath = os.path.join(local_root, '.gitignore')
+  if not os.path.isfile(filepath):
+    return []
+
+  with open(filepath) as gitignore_file:
+    lines = [line.strip() for line in gitignore_file]
+  return [line for line in lines
+          if line and not line.startswith(('#', '!'))]
+
+
+def is_ignored(relpath, is_dir, patterns):
+  """True if a .gitignore pattern matches 'relpath'."""
+  name = relpath.rsplit('/', 1)[-1]
+  for pattern in patterns:
+    if pattern.endswith('/'):
+      if not is_dir:
+        continue
+      pattern = pattern.rstrip('/')
+
+    if '/' in pattern:
+      if fnmatch.fnmatch(relpath, pattern.lstrip('/')):
+        return True
+    elif fnmatch.fnmatch(name, pattern):
+      return True
+  return False
+
+
+def hash_file(filepath):
+  sha1 = hashlib.sha1()
+  with open(filepath, 'rb') as f:
+    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+def load_manifest(filepath):
+  try:
+    with open(filepath) as manifest_file:
+      return json.load(manifest_file)
+  except (IOError, OSError, ValueError):
+    return {'id': None, 'files': {}}
+
+
+def save_manifest(filepath, manifest):
+  folder = os.path.dirname(filepath)
+  if not os.path.isdir(folder):
+    os.makedirs(folder)
+
+  tmp_filepath = filepath + '.tmp'
+  with open(tmp_filepath, 'w') as manifest_file:
+    json.dump(manifest, manifest_file, separators=(',', ':'))
+  os.replace(tmp_filepath, filepath)
+
+
+def read_remote_file(sftp, path):
+  """The content of a (small) remote file, or None if it does not exist."""
+  try:
+    with sftp.open(path) as remote_file:
+      return remote_file.read().decode('utf-8').strip()
+  except IOError:
+    return None
+
+
+def make_remote_dirs(sftp, path, created):
+  """mkdir -p 'path' on the remote host, skipping folders in 'created'."""
+  if not path or path in created:
+    return
+
+  make_remote_dirs(sftp, os.path.dirname(path), created)
+  try:
+    sftp.mkdir(path)
+  except IOError:
+    # it already exists (or it can't be created, and put() will fail)
+    pass
+  created.add(path)
@@ -0,0 +1,132 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""EntityFile class."""
+
+import os
+import json
+import logging
+
+import dpath.util
+
+from agief_experiment import utils
+
+
+class EntityFile:
+  """
+  An entity input file (as used by Import/Export), parsed once.
+
+  Entities are indexed by name, and the config of an entity (a json string
+  inside the entity) is only decoded when it is first accessed. Any number of
+  parameters can be set in memory, and the file is written once by save(),
+  or on leaving a 'with' block without an exception.
+  """
+
+  def __init__(self, filepath):
+    self.filepath = filepath
+
+    with open(filepath) as entity_file:
+      self.entities = json.load(entity_file)
+
+    # the first entity with a given name wins, as in a linear search
+    self.index = {}
+    for entity in self.entities:
+      self.index.setdefault(entity["name"], entity)
+
+    self.configs = {}
+    self.modified = set()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    if exc_type is None:
+      self.save()
+
+  def entity(self, entity_name):
+    """Return the entity named 'entity_name' (fully qualified, WITH prefix)."""
+    entity = self.index.get(entity_name)
+
+    if entity is None:
+      msg = "\nERROR: Could not find an entity in the input file " \
+            "matching the entity name specified in the " \
+            "experiment file in field 'file-entities'.\n"
+      msg += "\tEntity input file: " + self.filepath + "\n"
+      msg += "\tEntity name: " + entity_name
+      raise Exception(msg)
+
+    return entity
+
+  def config(self, entity_name):
+    """Return the decoded config of an entity, decoding it on first access."""
+    config = self.configs.get(entity_name)
+    if config is None:
+      config = utils.get_entityfile_config(self.entity(entity_name))
+      self.configs[entity_name] = config
+    return config
+
+  def has_parameter(self, entity_name, param_path):
+    """True if entity 'entity_name' exists, with a parameter 'param_path'."""
+    if entity_name not in self.index:
+      return False
+    try:
+      dpath.util.get(self.config(entity_name), param_path, '.')
+    except (KeyError, ValueError):
+      return False
+    return True
+
+  def set_parameter(self, entity_name, param_path, value):
+    """
+    Set parameter at 'param_path' for entity 'entity_name', in memory.
+
+    :param entity_name: the fully qualified entity name, WITH Prefix
+    :param param_path: set parameter at this path, delimited by '.'
+    :param value:
+    :return: description of the parameter that was set
+    """
+    config = self.config(entity_name)
+
+    changed = dpath.util.set(config, param_path, value, '.')
+
+    if changed == 0:
+      msg = "\nERROR: Could not set the config in entity at param " \
+            "path.\n"
+      msg += "\tEntity = " + entity_name + "\n"
+      msg += "\tParam_path = " + param_path
+      raise Exception(msg)
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug("config(t+1) = " + json.dumps(config, indent=4))
+
+    self.modified.add(entity_name)
+
+    return entity_name + "." + param_path + " = " + str(value)
+
+  def save(self, filepath=None):
+    """
+    Encode the modified configs, and write the whole file (compact json).
+    The file is replaced rather than modified in place, as it may be a link
+    to a base input file.
+    """
+    for entity_name in self.modified:
+      utils.set_entityfile_config(self.entity(entity_name),
+                                  self.configs[entity_name])
+    self.modified.clear()
+
+    filepath = filepath or self.filepath
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, 'w') as entity_file:
+      json.dump(self.entities, entity_file, separators=(',', ':'))
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,149 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""EnvResolver class."""
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+import subprocess
+
+# A path env is a variable name, optionally followed by a literal suffix,
+# e.g. 'AGI_HOME/bin/' is resolved as the shell would resolve '$AGI_HOME/bin/'
+VARIABLE_REGEX = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)(.*)$', re.DOTALL)
+
+
+class EnvResolver:
+  """
+  Resolve variables defined by a VARIABLES_FILE, without forking a shell per
+  lookup.
+
+  The variables file is sourced once, the resulting environment is kept in
+  memory, and it is sourced again only if the modification time of the file
+  changes. If sourcing fails (e.g. the file does not exist yet), nothing is
+  kept, and the file is sourced again on the next lookup. There is one
+  shared resolver per variables file, per session.
+  """
+
+  _resolvers = {}
+  _resolvers_lock = threading.Lock()
+
+  def __init__(self, variables_file):
+    self.variables_file = variables_file
+    self.environment = None
+    self.mtime = None
+    self.lookups = 0
+    self.spawns = 0
+    self._lock = threading.Lock()
+
+  @classmethod
+  def for_file(cls, variables_file):
+    """Return the shared resolver for 'variables_file'."""
+    with cls._resolvers_lock:
+      resolver = cls._resolvers.get(variables_file)
+      if resolver is None:
+        resolver = cls(variables_file)
+        cls._resolvers[variables_file] = resolver
+      return resolver
+
+  @classmethod
+  def report(cls):
+    """Log the number of lookups and shell spawns saved, for each resolver."""
+    with cls._resolvers_lock:
+      resolvers = list(cls._resolvers.values())
+
+    for resolver in resolvers:
+      logging.info("Variables file %s: %d lookups, %d shell spawns, "
+                   "%d shell spawns saved", resolver.variables_file,
+                   resolver.lookups, resolver.spawns, resolver.spawns_saved())
+
+  def spawns_saved(self):
+    """The number of shell spawns avoided by serving lookups from memory."""
+    return self.lookups - self.spawns
+
+  def resolve(self, path_env):
+    """
+    Return the value of 'path_env' after sourcing the variables file,
+    equivalent to `source $VARIABLES_FILE && echo $path_env`
+
+    :param path_env: variable name, optionally followed by a literal suffix
+    """
+    environment = self.snapshot()
+
+    match = VARIABLE_REGEX.match(path_env)
+    if not match:
+      return path_env
+
+    name, suffix = match.groups()
+    return environment.get(name, "") + suffix
+
+  def snapshot(self):
+    """
+    Return the environment resulting from sourcing the variables file,
+    sourcing it again if the file was modified since the last snapshot (or
+    if the last attempt failed). An empty environment if sourcing fails.
+    """
+    mtime = self._file_mtime()
+
+    with self._lock:
+      self.lookups += 1
+      if self.environment is None or mtime != self.mtime:
+        logging.debug("Sourcing variables file = %s", self.variables_file)
+        self.environment = self._source()
+        self.mtime = mtime
+        self.spawns += 1
+        if self.environment is None:
+          return {}
+      return self.environment
+
+  def invalidate(self):
+    """Discard the snapshot, so that the next lookup sources the file."""
+    with self._lock:
+      self.environment = None
+      self.mtime = None
+
+  def _file_mtime(self):
+    try:
+      return os.stat(self.variables_file).st_mtime
+    except (OSError, TypeError):
+      return None
+
+  def _source(self):
+    # dump the environment with this interpreter, so that values containing
+    # newlines survive, and the output of the variables file is ignored.
+    # 'set -a' exports every variable the file assigns, so that plain
+    # 'FOO=bar' lines are found too, as with 'source && echo $FOO'
+    dump_env = "import os, json, sys; json.dump(dict(os.environ), sys.stdout)"
+    cmd = "set -a && source \"{0}\" > /dev/null && \"{1}\" -c \"{2}\"".format(
+        self.variables_file, sys.executable, dump_env)
+
+    output, error = subprocess.Popen(cmd,
+                                     shell=True,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     executable="/bin/bash").communicate()
+
+    if error:
+      logging.debug("Stderr when sourcing variables file: %s", str(error))
+
+    try:
+      return json.loads(output.decode('utf-8'))
+    except ValueError:
+      logging.warning("unable to source variables file: %s",
+                      self.variables_file)
+      return None
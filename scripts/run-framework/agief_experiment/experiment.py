@@ -1,16 +1,20 @@
 import datetime
-import functools
 import json
 import os
 import logging
-import time
+import threading
 
 
 import dpath
+import requests
 
-from agief_experiment.valueseries import ValueSeries
 from agief_experiment.experimentutils import ExperimentUtils
 from agief_experiment.launchmode import LaunchMode
+from agief_experiment.sweepscheduler import SweepScheduler
+from agief_experiment.entityfile import EntityFile
+from agief_experiment.tracing import Tracer
+from agief_experiment.metrics import Metrics
+from agief_experiment.stall import StallError
 from agief_experiment import utils
 
 
@@ -48,6 +52,23 @@ class Experiment:
         self.prefixes_history = ""
         self.prefix_modifier = ""
 
+        # when parameter sets run in parallel, each thread runs one prefix
+        self.run_local = threading.local()
+        self.history_lock = threading.Lock()
+
+        # if set, results are compressed and uploaded in the background
+        self.results_pipeline = None
+
+        # if set (an AgeRateHistory), the age rates of completed runs are
+        # kept per experiment, as a baseline for stall detection
+        self.age_rate_history = None
+
+        # if set (a SweepJournal), the stages completed by each parameter set
+        # are journaled, and completed sets are skipped if it is resumed
+        self.journal = None
+        self.resumed_keys = set()
+        self.reserved_prefixes = set()
+
     def reset_prefix(self):
 
         print("-------------- RESET_PREFIX -------------")
@@ -75,11 +96,19 @@ class Experiment:
             else:
                 self.prefix_modifier += "i"
 
+            # don't reuse the prefix of a set in the journal (on resume)
+            while self.prefix() in self.reserved_prefixes:
+                self.prefix_modifier += "i"
+
     def prefix(self):
+        run_prefix = getattr(self.run_local, 'prefix', None)
+        if run_prefix is not None:
+            return run_prefix
         return self.prefix_base + self.prefix_modifier
 
     def remember_prefix(self):
-        self.prefixes_history += self.prefix() + "\n"
+        with self.history_lock:
+            self.prefixes_history += self.prefix() + "\n"
 
     def persist_prefix_history(self, cloud, filename=PREFIXES_FILENAME):
         """ Save prefix history to a file """
@@ -174,7 +203,7 @@ class Experiment:
 
     def run_parameterset(self, compute_node, cloud, args, entity_filepath,
                          data_filepaths, compute_data_filepaths,
-                         sweep_param_vals=''):
+                         sweep_param_vals='', exp_def=None):
         """
         Import input files
         Run Experiment and Export experiment
@@ -190,9 +219,42 @@ class Experiment:
         :param compute_data_filepaths: data files on the compute machine,
                                        relative to run folder
         :param sweep_param_vals:
-        :return:
+        :param exp_def: the experiment (from the plan) of the parameter set,
+                        if None, parameters of all experiments are set
+        :return: False if the parameter set failed, True otherwise
         """
 
+        node = compute_node.base_url()
+        Metrics.set('agief_parameter_set_running', 1, node=node,
+                    prefix=self.prefix())
+        set_index = getattr(self.run_local, 'set_index', None)
+        if set_index is not None:
+            Metrics.set('agief_parameter_set_index', set_index, node=node)
+
+        if self.journal is not None and set_index is not None:
+            self.journal.start(self.journal_key(exp_def, set_index),
+                               set_index, self.prefix(),
+                               list(sweep_param_vals))
+
+        with Tracer.context(prefix=self.prefix(),
+                            parameter_set="; ".join(sweep_param_vals)):
+            with Tracer.span('parameter-set') as span:
+                succeeded = self._run_parameterset(
+                    compute_node, cloud, args, entity_filepath,
+                    data_filepaths, compute_data_filepaths, sweep_param_vals,
+                    exp_def)
+                span.tag(failed=not succeeded)
+
+        Metrics.remove('agief_parameter_set_running', node=node,
+                       prefix=self.prefix())
+        Metrics.inc('agief_parameter_sets',
+                    result='succeeded' if succeeded else 'failed')
+        return succeeded
+
+    def _run_parameterset(self, compute_node, cloud, args, entity_filepath,
+                          data_filepaths, compute_data_filepaths,
+                          sweep_param_vals, exp_def):
+
         print("........ Run parameter set.")
 
         # print and save experiment info
@@ -224,20 +286,38 @@ class Experiment:
                                                cloud=cloud,
                                                no_local_docker=args.no_docker)
 
+            if (self.launch_mode is LaunchMode.warm) and args.launch_compute:
+                self.warm_compute(compute_node, cloud, args)
+
+            if args.fold_params:
+                unfolded_params = self.fold_params(entity_filepath, exp_def)
+
             compute_node.import_experiment(entity_filepath, data_filepaths)
             compute_node.import_compute_experiment(compute_data_filepaths,
                                                    is_data=True)
 
-            self.set_entity_params(compute_node)
-            self.set_dataset(compute_node)
+            if args.fold_params:
+                compute_node.set_parameters_db(unfolded_params)
+            else:
+                with Tracer.span('experiment.set-params'):
+                    self.set_entity_params(compute_node, exp_def)
+                    self.set_dataset(compute_node, exp_def)
+            self.journal_stage('imported')
 
             if not self.debug_no_run:
+                history_key = self.age_rate_key(exp_def)
                 compute_node.run_experiment(
-                    self.entity_with_prefix("experiment")
+                    self.entity_with_prefix("experiment"),
+                    baseline_rate=self.age_rate_history.baseline(history_key)
+                    if history_key else None
                 )
+                if history_key:
+                    self.age_rate_history.record(history_key,
+                                                 compute_node.age_rate)
                 self.append_runtime(compute_node.runtime)
                 print("Parameter Sweeps finished in %d days, %d hr, %d min, "
                       "%d s" % tuple(compute_node.runtime))
+                self.journal_stage('ran')
 
             self.remember_prefix()
 
@@ -254,7 +334,8 @@ class Experiment:
                 compute_node.export_subtree(
                     self.entity_with_prefix("experiment"),
                     out_entity_file_path,
-                    out_data_file_path
+                    out_data_file_path,
+                    compress=args.export_gzip
                 )
 
             if args.export_compute:
@@ -264,38 +345,182 @@ class Experiment:
                     self.experiment_utils.outputfile_remote(self.prefix()),
                     True
                 )
+
+            if args.export or args.export_compute:
+                self.journal_stage('exported')
         except Exception as e:
             failed = True
+            compute_node.warm_dirty = True
             logging.error("Experiment failed for some reason, shut down " +
                           "Compute and continue.")
             logging.error(e)
 
+            # a stalled run stops Compute, relaunch it for the next sets
+            if isinstance(e, StallError) and (
+                    self.launch_mode is LaunchMode.per_session) and (
+                    args.launch_compute):
+                compute_node.shutdown_compute(cloud, args, None)
+                compute_node.launch(self, cloud=cloud,
+                                    main_class=args.main_class,
+                                    no_local_docker=args.no_docker)
+
         if (self.launch_mode is LaunchMode.per_experiment) and (
                 args.launch_compute):
             compute_node.shutdown_compute(cloud, args, task_arn)
 
         if not failed and args.upload:
-            self.upload_results(cloud, compute_node, args.export_compute)
+            if self.results_pipeline is None:
+                self.upload_results(cloud, compute_node, args.export_compute)
+            else:
+                self.submit_results(cloud, compute_node, args.export_compute)
+
+        return not failed
+
+    def journal_key(self, exp_def, set_index):
+        """The key of a parameter set in the journal: its place in the plan."""
+        return "%d:%d" % (exp_def.index if exp_def is not None else 0,
+                          set_index)
+
+    def journal_stage(self, stage):
+        """Journal that the current prefix has completed 'stage'."""
+        if self.journal is not None:
+            self.journal.record(self.prefix(), stage)
+
+    def journal_stages(self, args):
+        """The stages of SweepJournal that a parameter set completes."""
+        stages = ['imported']
+        if not self.debug_no_run:
+            stages.append('ran')
+        if args.export or args.export_compute:
+            stages.append('exported')
+        if args.upload:
+            stages.append('uploaded')
+        return stages
+
+    def is_journaled_complete(self, args, exp_def, set_index):
+        """True if the journal shows the parameter set is complete."""
+        if self.journal is None or not self.journal.resumed:
+            return False
+        key = self.journal_key(exp_def, set_index)
+        return key in self.resumed_keys or self.journal.is_complete(
+            key, self.journal_stages(args))
+
+    def resume_journal(self, compute_node, cloud, args):
+        """
+        Resume a sweep from the journal: upload the results of the sets that
+        were exported but not uploaded (they are not run again), and add the
+        prefixes of completed sets to the prefix history.
+        """
+        stages = self.journal_stages(args)
+        self.reserved_prefixes = self.journal.prefixes()
+
+        resumed = []
+        if args.upload:
+            resumed = self.journal.pending(stages, 'uploaded')
+            for state in resumed:
+                print("Resume: upload the results of " + state.prefix)
+                self.run_local.prefix = state.prefix
+                try:
+                    if self.results_pipeline is None:
+                        self.upload_results(cloud, compute_node,
+                                            args.export_compute)
+                    else:
+                        self.submit_results(cloud, compute_node,
+                                            args.export_compute)
+                except Exception as e:
+                    logging.error("Could not upload the results of %s: %s",
+                                  state.prefix, e)
+                finally:
+                    self.run_local.prefix = None
+
+        self.resumed_keys = set(state.key for state in resumed)
+
+        states = {state.key: state for state in
+                  self.journal.completed(stages) + resumed}
+        with self.history_lock:
+            for state in sorted(states.values(), key=lambda s: s.index):
+                self.prefixes_history += state.prefix + "\n"
+
+    def age_rate_key(self, exp_def):
+        """
+        The key of the experiment of a parameter set in the age rate history,
+        None if the history is not kept.
+        """
+        if self.age_rate_history is None or exp_def is None:
+            return None
+        return "%s:%d" % (os.path.basename(self.exps_file), exp_def.index)
+
+    @Tracer.traced('experiment.warm-compute')
+    def warm_compute(self, compute_node, cloud, args):
+        """
+        Prepare a warm Compute (LaunchMode.warm) for the next parameter set.
+        It is relaunched if it is not in a clean state, or if it has run
+        'args.warm_recycle' parameter sets since it was launched (the
+        entities of previous parameter sets can't be deleted through the
+        API, so this bounds how many accumulate). Data files it has loaded
+        are reused if they are read only (Compute.read_only_data).
+        """
+        compute_node.reuse_data = True
+
+        if 0 < args.warm_recycle <= compute_node.warm_runs:
+            print("Recycle Compute after %d parameter sets" %
+                  compute_node.warm_runs)
+        else:
+            try:
+                clean = compute_node.is_clean(
+                    self.entity_with_prefix("experiment"))
+            except (requests.RequestException, ValueError) as e:
+                logging.warning("Could not check the state of Compute: %s", e)
+                clean = False
+
+            if clean:
+                compute_node.warm_runs += 1
+                return
+
+            print("Compute is not in a clean state, relaunch it")
+
+        compute_node.shutdown_compute(cloud, args, None)
+        compute_node.launch(self, cloud=cloud, main_class=args.main_class,
+                            no_local_docker=args.no_docker)
+        compute_node.warm_runs += 1
+
+    def submit_results(self, cloud, compute_node, export_compute):
+        """
+        Queue upload_results for the current prefix on the results pipeline,
+        so that it runs in the background (waits if the pipeline is full).
+        The log is uploaded first, here, as the next parameter set will
+        append to it.
+        """
+        prefix = self.prefix()
+
+        self.upload_log(cloud, compute_node)
+
+        def upload_prefix_results():
+            self.run_local.prefix = prefix
+            try:
+                with Tracer.context(prefix=prefix):
+                    self.upload_results(cloud, compute_node, export_compute,
+                                        upload_log=False)
+            finally:
+                self.run_local.prefix = None
+
+        self.results_pipeline.submit(prefix, upload_prefix_results)
 
     @staticmethod
-    def setup_parameter_sweepers(param_sweep):
+    def setup_parameter_sweepers(sweep):
         """
         For each 'param' in a set, get details and setup counter
         The result is an array of counters
         Each counter represents one parameter
+
+        :type sweep: experimentplan.Sweep
         """
         val_sweepers = []
         # set of params for one 'sweep'
-        for param in param_sweep['parameter-set']:
-            if 'val-series' in param:
-                value_series = ValueSeries(param['val-series'])
-            else:
-                value_series = ValueSeries.from_range(minv=param['val-begin'],
-                                                      maxv=param['val-end'],
-                                                      deltav=param['val-inc'])
-            val_sweepers.append({'value-series': value_series,
-                                 'entity-name': param['entity-name'],
-                                 'param-path': param['parameter-path']})
+        for param in sweep.params:
+            val_sweepers.append({'value-series': param.value_series(),
+                                 'entity-name': param.entity_name,
+                                 'param-path': param.param_path})
         return val_sweepers
 
     def inc_parameter_set(self, compute_node, args, entity_filepath,
@@ -304,10 +529,12 @@ class Experiment:
         Iterate through counters, incrementing each parameter in the set
         Set the new values in the input file, and then run the experiment
         First counter to reset, return False
+        The input file is read once, and written once with all the values.
 
         :param compute_node:
         :param args:
-        :param entity_filepath:
+        :param entity_filepath: None to only advance the counters (to skip a
+                                completed parameter set)
         :param val_sweepers:
         :return: reset (True if any counter has reached above max),
                        description of parameters (string)
@@ -325,6 +552,7 @@ class Experiment:
         # inc all counters, and set parameter in entity file
         sweep_param_vals = []
         reset = False
+        entity_file = EntityFile(entity_filepath) if entity_filepath else None
         for val_sweeper in val_sweepers:
             val_series = val_sweeper['value-series']
 
@@ -340,16 +568,23 @@ class Experiment:
                 reset = True
                 break
 
-            set_param = compute_node.set_parameter_inputfile(
-                            entity_filepath,
-                            self.entity_with_prefix(
-                                val_sweeper['entity-name']
-                            ),
-                            val_sweeper['param-path'],
-                            val_series.value())
+            if entity_file is None:
+                set_param = (val_sweeper['entity-name'] + "." +
+                             val_sweeper['param-path'] + " = " +
+                             str(val_series.value()))
+            else:
+                set_param = entity_file.set_parameter(
+                                self.entity_with_prefix(
+                                    val_sweeper['entity-name']
+                                ),
+                                val_sweeper['param-path'],
+                                val_series.value())
             sweep_param_vals.append(set_param)
             val_series.next_val()
 
+        if sweep_param_vals and entity_file is not None:
+            entity_file.save()
+
         if len(sweep_param_vals) == 0:
             logging.warning("no parameters were changed.")
 
@@ -366,6 +601,7 @@ class Experiment:
 
         return reset, sweep_param_vals
 
+    @Tracer.traced('experiment.create-input-files')
     def create_all_input_files(self, base_entity_filename,
                                base_data_filenames):
         self.reset_prefix()
@@ -382,70 +618,112 @@ class Experiment:
             )
         )
 
-    def run_sweeps(self, compute_node, cloud, args):
+    def run_sweeps(self, compute_node, cloud, args, compute_nodes=None):
         """
         Perform parameter sweep steps, and run experiment for each step.
+        If a pool of 'compute_nodes' is given, the parameter sets are run in
+        parallel, each on whichever node is free (a pool of one node is used
+        instead of 'compute_node').
         """
 
         print("\n........ Run Sweeps")
 
+        if compute_nodes:
+            compute_node = compute_nodes[0]
+
         exps_filename = self.experiment_utils.experiment_def_file()
 
         if not os.path.exists(exps_filename):
             msg = "Experiment file does not exist at: " + exps_filename
             raise Exception(msg)
 
-        # Silently remove older log file if exists
-        log_filepath = self.experiment_utils.runpath(self.LOG_FILENAME)
-        if compute_node.remote():
-            utils.remote_run(compute_node.host_node, 'rm ' + log_filepath)
-        else:
-            utils.remove_file(log_filepath, True)
-
-        with open(exps_filename) as exps_file:
-            filedata = json.load(exps_file)
-
-        for exp_i in filedata['experiments']:
-            import_files = exp_i['import-files']  # import files dictionary
-
-            logging.debug("Import Files Dictionary = \n" +
-                          json.dumps(import_files, indent=4))
-
-            base_entity_filename = import_files['file-entities']
-            base_data_filenames = import_files['file-data']
-
-            exp_ll_data_filepaths = []
-            if 'load-local-files' in exp_i:
-                load_local_files = exp_i['load-local-files']
-                if 'file-data' in load_local_files:
-                    exp_ll_data_filepaths = list(
-                        map(self.experiment_utils.runpath,
-                            load_local_files['file-data'])
-                    )
-
-            run_parameterset_partial = (
-                functools.partial(
-                    self.run_parameterset,
-                    compute_node=compute_node,
-                    cloud=cloud,
-                    args=args,
-                    compute_data_filepaths=exp_ll_data_filepaths)
-            )
+        if self.journal is not None and self.journal.resumed:
+            self.resume_journal(compute_node, cloud, args)
+
+        # Silently remove older log file if exists (on every node in use)
+        cleaned_logs = set()
+        for node in (compute_nodes or [compute_node]):
+            log_filepath = self.log_filepath(node)
+            if (node.host_node.host, log_filepath) in cleaned_logs:
+                continue
+            cleaned_logs.add((node.host_node.host, log_filepath))
+
+            if node.remote():
+                utils.remote_run(node.host_node, 'rm ' + log_filepath)
+            else:
+                utils.remove_file(log_filepath, True)
+
+        parameter_sets = self.parameter_sets(compute_node, args)
+
+        num_sets = self.experiment_utils.plan().num_sets()
+        if num_sets is not None:
+            Metrics.set('agief_parameter_sets_planned', num_sets)
+
+        if compute_nodes and len(compute_nodes) > 1:
+            self.run_parametersets_parallel(compute_nodes, cloud, args,
+                                            parameter_sets)
+            return
+
+        for parameter_set in parameter_sets:
+            del parameter_set['prefix']
+            self.run_local.set_index = parameter_set.pop('index')
+            self.run_parameterset(compute_node, cloud, args, **parameter_set)
+
+    def parameter_sets(self, compute_node, args):
+        """
+        Generate the parameter sets of all the experiments, in plan order.
+        The input files for each set are created just before it is yielded.
+
+        :return: generator of dicts, with the arguments for run_parameterset,
+                 the 'prefix' of the set and its 'index' (from 1)
+        """
+
+        index = 0
+        for exp_def in self.experiment_utils.plan().experiments:
+            base_entity_filename = exp_def.entity_filename
+            base_data_filenames = exp_def.data_filenames
+
+            logging.debug("Import Files = %s, %s", base_entity_filename,
+                          base_data_filenames)
+
+            exp_ll_data_filepaths = list(exp_def.load_local_data_filepaths)
+
+            if len(exp_def.sweeps) == 0:
+                if self.is_journaled_complete(args, exp_def, index + 1):
+                    print("Resume: skip completed parameter set " +
+                          str(index + 1))
+                    index += 1
+                    continue
 
-            if 'parameter-sweeps' not in exp_i or (
-                    len(exp_i['parameter-sweeps']) == 0):
                 print("No parameters to sweep, just run once.")
                 exp_entity_filepath, exp_data_filepaths = (
                     self.create_all_input_files(base_entity_filename,
                                                 base_data_filenames)
                 )
-                run_parameterset_partial(entity_filepath=exp_entity_filepath,
-                                         data_filepaths=exp_data_filepaths)
+                index += 1
+                yield {'prefix': self.prefix(),
+                       'index': index,
+                       'entity_filepath': exp_entity_filepath,
+                       'data_filepaths': exp_data_filepaths,
+                       'compute_data_filepaths': exp_ll_data_filepaths,
+                       'sweep_param_vals': '',
+                       'exp_def': exp_def}
             else:
                 # array of sweep definitions
-                for param_sweep in exp_i['parameter-sweeps']:
-                    counters = self.setup_parameter_sweepers(param_sweep)
+                for sweep in exp_def.sweeps:
+                    counters = self.setup_parameter_sweepers(sweep)
                     while True:
+                        if self.is_journaled_complete(args, exp_def,
+                                                      index + 1):
+                            reset, _ = self.inc_parameter_set(
+                                compute_node, args, None, counters)
+                            if reset:
+                                break
+                            index += 1
+                            print("Resume: skip completed parameter set " +
+                                  str(index))
+                            continue
+
                         exp_entity_filepath, exp_data_filepaths = (
                             self.create_all_input_files(
                                 base_entity_filename,
@@ -458,73 +736,144 @@ class Experiment:
                         )
                         if reset:
                             break
-                        run_parameterset_partial(
-                            entity_filepath=exp_entity_filepath,
-                            data_filepaths=exp_data_filepaths,
-                            sweep_param_vals=sweep_param_vals
-                        )
+                        index += 1
+                        yield {'prefix': self.prefix(),
+                               'index': index,
+                               'entity_filepath': exp_entity_filepath,
+                               'data_filepaths': exp_data_filepaths,
+                               'compute_data_filepaths': exp_ll_data_filepaths,
+                               'sweep_param_vals': sweep_param_vals,
+                               'exp_def': exp_def}
+
+    def run_parametersets_parallel(self, compute_nodes, cloud, args,
+                                   parameter_sets):
+        """
+        Run the parameter sets concurrently over a pool of Compute nodes.
+        Each set runs with its own prefix, and the prefix history is kept in
+        plan order regardless of the order in which the sets finish.
 
-    def set_entity_params(self, compute_node):
-        print("\n....... Set Entity Parameters")
+        :return: list of SweepResult, in plan order
+        """
+
+        print("\n........ Run parameter sets over " + str(len(compute_nodes)) +
+              " Compute nodes")
+
+        history_start = len(self.prefixes_history.splitlines())
+
+        def run_planned_parameterset(compute_node, parameter_set):
+            parameter_set = dict(parameter_set)
+            self.run_local.prefix = parameter_set.pop('prefix')
+            self.run_local.set_index = parameter_set.pop('index')
+            try:
+                return self.run_parameterset(compute_node, cloud, args,
+                                             **parameter_set)
+            finally:
+                self.run_local.prefix = None
+                self.run_local.set_index = None
 
-        with open(self.experiment_utils.experiment_def_file()) as (
-                data_exps_file):
-            data = json.load(data_exps_file)
+        scheduler = SweepScheduler(compute_nodes)
+        results = scheduler.run(parameter_sets, run_planned_parameterset)
 
-        for exp_i in data['experiments']:
-            for param in exp_i['entity-parameters']:
-                entity_name = param['entity-name']
-                param_path = param['parameter-path']
-                value = param['value']
+        # rewrite the prefixes remembered by this sweep, in plan order
+        with self.history_lock:
+            history = self.prefixes_history.splitlines()
+            remembered = set(history[history_start:])
+            ordered = [result.prefix for result in results
+                       if result.prefix in remembered]
+            self.prefixes_history = "".join(
+                prefix + "\n" for prefix in history[:history_start] + ordered)
 
-                if utils.is_valid_filename(value):
-                    value = value.replace(self.TEMPLATE_OUTPUT_PREFIX,
-                                          self.prefix())
-                    value = self.experiment_utils.runpath(value)
+        print(SweepScheduler.summary(results))
 
+        return results
+
+    def set_entity_params(self, compute_node, exp_def=None):
+        """
+        Set the entity parameters of the experiment 'exp_def' (from the plan),
+        or of all experiments if it is None.
+        """
+        print("\n....... Set Entity Parameters")
+
+        for exp_i in self.plan_experiments(exp_def):
+            for param in exp_i.entity_params:
                 compute_node.set_parameter_db(
-                    self.entity_with_prefix(entity_name),
-                    param_path,
-                    value
+                    self.entity_with_prefix(param.entity_name),
+                    param.param_path,
+                    param.resolve(self.prefix(), self.TEMPLATE_OUTPUT_PREFIX)
                 )
 
-    def set_dataset(self, compute_node):
+    def set_dataset(self, compute_node, exp_def=None):
         """
         The dataset can be located in different locations on different
         machines. The location can be set in the experiments definition file
-        (experiments.json). This method parses that file, finds the parameters
-        to set relative to the AGI_DATA_HOME env variable, and sets the
-        specified parameters.
+        (experiments.json). The plan resolves the parameters relative to the
+        AGI_DATA_HOME env variable, and this method sets them, for the
+        experiment 'exp_def' or for all experiments if it is None.
         """
 
         print("\n....... Set Dataset")
 
-        with open(self.experiment_utils.experiment_def_file()) as (
-                data_exps_file):
-            data = json.load(data_exps_file)
-
-        for exp_i in data['experiments']:
-            # array of sweep definitions
-            for param in exp_i['dataset-parameters']:
-                entity_name = param['entity-name']
-                param_path = param['parameter-path']
-                data_filenames = param['value']
+        for exp_i in self.plan_experiments(exp_def):
+            for param in exp_i.dataset_params:
+                compute_node.set_parameter_db(
+                    self.entity_with_prefix(param.entity_name),
+                    param.param_path, param.data_paths
+                )
 
-                data_filenames_arr = data_filenames.split(',')
+    def params(self, exp_def=None):
+        """
+        The entity parameters and then the dataset parameters to set, for
+        the experiment 'exp_def' or for all experiments if it is None.
 
-                data_paths = ""
-                for data_filename in data_filenames_arr:
-                    if data_paths != "":
-                        # IMPORTANT: if space added here, additional
-                        # characters ('+') get added, probably due to encoding
-                        # issues on the request
-                        data_paths += ","
-                    data_paths += self.experiment_utils.datapath(data_filename)
+        :return: list of (entity name WITH prefix, param path, value)
+        """
+        params = []
+        for exp_i in self.plan_experiments(exp_def):
+            for param in exp_i.entity_params:
+                params.append((
+                    self.entity_with_prefix(param.entity_name),
+                    param.param_path,
+                    param.resolve(self.prefix(), self.TEMPLATE_OUTPUT_PREFIX)))
+        for exp_i in self.plan_experiments(exp_def):
+            for param in exp_i.dataset_params:
+                params.append((self.entity_with_prefix(param.entity_name),
+                               param.param_path, param.data_paths))
+        return params
+
+    @Tracer.traced('experiment.fold-params')
+    def fold_params(self, entity_filepath, exp_def=None):
+        """
+        Write the entity and dataset parameters into the entity file before
+        it is imported, instead of setting each one with /config afterwards.
+        Parameters of entities (or at paths) that are not in the file can't
+        be folded in.
 
-                compute_node.set_parameter_db(
-                    self.entity_with_prefix(entity_name),
-                    param_path, data_paths
-                )
+        :return: the parameters that were not folded in, as from params()
+        """
+        print("\n....... Fold Entity and Dataset Parameters into " +
+              entity_filepath)
+
+        unfolded = []
+        with EntityFile(entity_filepath) as entity_file:
+            for entity_name, param_path, value in self.params(exp_def):
+                if entity_file.has_parameter(entity_name, param_path):
+                    entity_file.set_parameter(entity_name, param_path, value)
+                else:
+                    unfolded.append((entity_name, param_path, value))
+
+        if unfolded:
+            logging.info("%d parameter(s) not in the entity file, to be set "
+                         "with /config: %s", len(unfolded),
+                         ", ".join(entity_name + "." + param_path
+                                   for entity_name, param_path, _
+                                   in unfolded))
+        return unfolded
+
+    def plan_experiments(self, exp_def=None):
+        """ The experiments to use: just 'exp_def', or all in the plan """
+        if exp_def is not None:
+            return [exp_def]
+        return self.experiment_utils.plan().experiments
 
     def generate_input_files_locally(self, compute_node):
         entity_filepath, data_filepaths = (
@@ -539,12 +888,15 @@ class Experiment:
                                     entity_filepath=entity_filepath,
                                     data_filepath=data_filepaths[0])
 
-    def upload_results(self, cloud, compute_node, export_compute):
+    @Tracer.traced('experiment.upload')
+    def upload_results(self, cloud, compute_node, export_compute,
+                       upload_log=True):
         """ Upload the results of the experiment to the cloud storage (s3)
 
         :param compute_node: the compute node doing the compute
         :param export_compute: boolean, indicates if export is conducted on
                                the compute node itself
+        :param upload_log: False if the log has already been uploaded
         :type cloud: Cloud
         :type compute_node: Compute
         """
@@ -566,17 +918,8 @@ class Experiment:
             self.experiment_utils.experiment_def_file()
         )
 
-        # upload log4j configuration file that was used
-        if compute_node.remote():
-            cloud.remote_upload_runfilename_s3(compute_node.host_node,
-                                               self.prefix(),
-                                               self.LOG_FILENAME)
-        else:
-            log_filepath = self.experiment_utils.runpath(self.LOG_FILENAME)
-            self.upload_experiment_file(cloud,
-                                        self.prefix(),
-                                        self.LOG_FILENAME,
-                                        log_filepath)
+        if upload_log:
+            self.upload_log(cloud, compute_node)
 
         # upload /output files (entity.json, data.json and experiment-info.txt)
 
@@ -620,7 +963,8 @@ class Experiment:
                     files_to_compress.append(output_features_filepath)
 
                 # Compress the output files
-                utils.compress_files(archive_filename, files_to_compress)
+                with Tracer.span('experiment.compress'):
+                    utils.compress_files(archive_filename, files_to_compress)
 
                 # Move uncompressed files to /output-big directory
                 utils.move_file(output_data_filepath, folder_path_big, True)
@@ -637,6 +981,26 @@ class Experiment:
                                     "output",
                                     folder_path)
 
+        self.journal_stage('uploaded')
+
+    def upload_log(self, cloud, compute_node):
+        """Upload the log of Compute, for the current prefix."""
+        if compute_node.remote():
+            cloud.remote_upload_runfilename_s3(compute_node.host_node,
+                                               self.prefix(),
+                                               self.LOG_FILENAME)
+        else:
+            self.upload_experiment_file(cloud,
+                                        self.prefix(),
+                                        self.LOG_FILENAME,
+                                        self.log_filepath(compute_node))
+
+    def log_filepath(self, compute_node):
+        """The log file of 'compute_node', in its own run folder if any."""
+        if compute_node.run_folder:
+            return os.path.join(compute_node.run_folder, self.LOG_FILENAME)
+        return self.experiment_utils.runpath(self.LOG_FILENAME)
+
     @staticmethod
     def upload_experiment_file(cloud, prefix, dest_name, source_path):
         """
@@ -0,0 +1,200 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""ExperimentPlan, the compiled form of the experiments definition file."""
+
+import json
+import logging
+
+import numpy
+
+from agief_experiment import utils
+from agief_experiment.valueseries import ValueSeries
+
+
+class Record:
+  """Base class for immutable plan records, with fields in __slots__."""
+
+  __slots__ = ()
+
+  def __init__(self, **fields):
+    for name in self.__slots__:
+      object.__setattr__(self, name, fields[name])
+
+  def __setattr__(self, name, value):
+    raise AttributeError("plan records are immutable")
+
+  def __repr__(self):
+    fields = ", ".join(name + "=" + repr(getattr(self, name))
+                       for name in self.__slots__)
+    return self.__class__.__name__ + "(" + fields + ")"
+
+
+class SweepParam(Record):
+  """One swept parameter, with its series of values."""
+
+  __slots__ = ('entity_name', 'param_path', 'series')
+
+  def value_series(self):
+    """A new ValueSeries, positioned at the first value."""
+    return ValueSeries(self.series)
+
+
+class Sweep(Record):
+  """A set of parameters that are swept together."""
+
+  __slots__ = ('params',)
+
+  def num_sets(self):
+    """
+    Number of parameter sets of the sweep: the params advance together, until
+    the first series runs out. None if no series runs out (they all end with
+    the repeat char).
+    """
+    if not self.params:
+      return 0
+    lengths = [len(param.series) for param in self.params
+               if ValueSeries.REPEAT_CHAR not in param.series]
+    return min(lengths) if lengths else None
+
+
+class EntityParam(Record):
+  """
+  A parameter set on an entity before each run. If the value is a filename,
+  'path' is its full path in AGI_RUN_HOME, with the output prefix template
+  still to be substituted.
+  """
+
+  __slots__ = ('entity_name', 'param_path', 'value', 'path')
+
+  def resolve(self, prefix, template_output_prefix):
+    """Return the value to set, for the run with 'prefix'."""
+    if self.path is None:
+      return self.value
+    return self.path.replace(template_output_prefix, prefix)
+
+
+class DatasetParam(Record):
+  """
+  A dataset parameter, with 'data_paths' the comma separated full paths
+  of the data files in AGI_DATA_RUN_HOME.
+  """
+
+  __slots__ = ('entity_name', 'param_path', 'data_paths')
+
+
+class ExperimentDef(Record):
+  """One experiment of the experiments definition file."""
+
+  __slots__ = ('index', 'entity_filename', 'data_filenames',
+               'gen_entity_filename', 'gen_data_filenames',
+               'load_local_data_filepaths', 'sweeps', 'entity_params',
+               'dataset_params')
+
+  def num_sets(self):
+    """Number of parameter sets of the experiment, None if unbounded."""
+    if not self.sweeps:
+      return 1
+    counts = [sweep.num_sets() for sweep in self.sweeps]
+    return None if None in counts else sum(counts)
+
+
+class ExperimentPlan(Record):
+  """
+  The experiments definition file (e.g. experiments.json), parsed once and
+  compiled into immutable records, with data paths resolved.
+  """
+
+  __slots__ = ('filepath', 'experiments')
+
+  def num_sets(self):
+    """Number of parameter sets of all the experiments, None if unbounded."""
+    counts = [exp_def.num_sets() for exp_def in self.experiments]
+    return None if None in counts else sum(counts)
+
+  @classmethod
+  def compile(cls, experiment_utils):
+    """
+    Compile the experiments definition file of 'experiment_utils'.
+
+    :type experiment_utils: ExperimentUtils
+    """
+    filepath = experiment_utils.experiment_def_file()
+
+    with open(filepath) as exps_file:
+      filedata = json.load(exps_file)
+
+    experiments = tuple(
+        compile_experiment(experiment_utils, index, exp_i)
+        for index, exp_i in enumerate(filedata['experiments']))
+
+    logging.debug("Compiled experiment plan: %s", filepath)
+    return cls(filepath=filepath, experiments=experiments)
+
+
+def compile_experiment(experiment_utils, index, exp_i):
+  import_files = exp_i.get('import-files', {})
+  gen_files = exp_i.get('gen-files', {})
+
+  load_local_data_filepaths = tuple(
+      experiment_utils.runpath(filename)
+      for filename in exp_i.get('load-local-files', {}).get('file-data', []))
+
+  sweeps = tuple(compile_sweep(param_sweep)
+                 for param_sweep in exp_i.get('parameter-sweeps', []))
+
+  entity_params = tuple(
+      EntityParam(entity_name=param['entity-name'],
+                  param_path=param['parameter-path'],
+                  value=param['value'],
+                  path=(experiment_utils.runpath(param['value'])
+                        if utils.is_valid_filename(param['value']) else None))
+      for param in exp_i.get('entity-parameters', []))
+
+  dataset_params = tuple(
+      DatasetParam(entity_name=param['entity-name'],
+                   param_path=param['parameter-path'],
+                   # IMPORTANT: no space after the comma, or additional
+                   # characters ('+') get added, due to encoding on request
+                   data_paths=",".join(
+                       experiment_utils.datapath(data_filename)
+                       for data_filename in param['value'].split(',')))
+      for param in exp_i.get('dataset-parameters', []))
+
+  return ExperimentDef(
+      index=index,
+      entity_filename=import_files.get('file-entities'),
+      data_filenames=tuple(import_files.get('file-data', [])),
+      gen_entity_filename=gen_files.get('file-entities'),
+      gen_data_filenames=tuple(gen_files.get('file-data', [])),
+      load_local_data_filepaths=load_local_data_filepaths,
+      sweeps=sweeps,
+      entity_params=entity_params,
+      dataset_params=dataset_params)
+
+
+def compile_sweep(param_sweep):
+  params = []
+  for param in param_sweep['parameter-set']:
+    if 'val-series' in param:
+      series = tuple(param['val-series'])
+    else:
+      # as python numbers, so that values can be serialized to json
+      series = tuple(numpy.arange(param['val-begin'], param['val-end'],
+                                  param['val-inc']).tolist())
+    params.append(SweepParam(entity_name=param['entity-name'],
+                             param_path=param['parameter-path'],
+                             series=series))
+  return Sweep(params=tuple(params))
@@ -1,10 +1,10 @@
-import json
 import os
-import shutil
 import subprocess
 import logging
 
 from agief_experiment import utils
+from agief_experiment.envresolver import EnvResolver
+from agief_experiment.experimentplan import ExperimentPlan
 
 
 class ExperimentUtils:
@@ -25,6 +25,22 @@ class ExperimentUtils:
 
         self.experiments_def_filename = experiments_def_filename
 
+        # base filepath -> (mtime, size, template prefix occurs in file)
+        self.template_scans = {}
+
+        self.compiled_plan = None
+
+    def plan(self):
+        """
+        Return the compiled experiments definition file. It is compiled on
+        first use, and then shared by every stage of the session.
+
+        :rtype: ExperimentPlan
+        """
+        if self.compiled_plan is None:
+            self.compiled_plan = ExperimentPlan.compile(self)
+        return self.compiled_plan
+
     def filepath_from_exp_variable(self, filename, path_env):
 
         variables_file = self.variables_filepath()
@@ -35,12 +51,8 @@ class ExperimentUtils:
         logging.debug("experiment:filepath_from_env_variable: "
                       "variables file = %s", variables_file)
 
-        cmd = "source " + variables_file + " && echo $" + path_env
-        output, error = subprocess.Popen(cmd,
-                                         shell=True,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         executable="/bin/bash").communicate()
+        # source the variables file once, and serve lookups from memory
+        output = EnvResolver.for_file(variables_file).resolve(path_env)
 
         file_path = utils.cleanpath(output, filename)
         return file_path
@@ -55,7 +67,9 @@ class ExperimentUtils:
                                          shell=True,
                                          stdout=subprocess.PIPE,
                                          stderr=subprocess.PIPE,
-                                         executable="/bin/bash").communicate()
+                                         executable="/bin/bash",
+                                         universal_newlines=True
+                                         ).communicate()
 
         return commit
 
@@ -85,28 +99,12 @@ class ExperimentUtils:
         :return: entityfilename, datafilenames
         """
 
-        exps_filename = self.experiment_def_file()
-
-        with open(exps_filename) as exps_file:
-            filedata = json.load(exps_file)
-
-        for exp_i in filedata['experiments']:
-
+        for exp_def in self.plan().experiments:
             if is_import_files:
-                key = 'import-files'
-            else:
-                key = 'gen-files'
-
-            input_files = exp_i[key]  # import files dictionary
+                return exp_def.entity_filename, list(exp_def.data_filenames)
 
-            logging.debug("Input Files Dictionary = %s",
-                          json.dumps(input_files, indent=4))
-
-            # get experiment file-names, and expand to full path
-            base_entity_filename = input_files['file-entities']
-            base_data_filenames = input_files['file-data']
-
-            return base_entity_filename, base_data_filenames
+            return (exp_def.gen_entity_filename,
+                    list(exp_def.gen_data_filenames))
 
     def inputfile_base(self, filename):
         """
@@ -193,6 +191,11 @@ class ExperimentUtils:
         and change contents of entities to use the generated prefix.
         If they are in the /output subfolder, then do not modify.
 
+        Each base file is scanned once for the template prefix. If it does
+        not occur, the new file is a link to the base file (or a copy if
+        links are not supported), otherwise it is rendered in a single
+        streaming pass.
+
         Base input files are located in:  'experiment-folder/input'
         experiment.py input files are located in subfolder:
         'experiment-folder/input/prefix'
@@ -227,17 +230,37 @@ class ExperimentUtils:
                 filepath = self.inputfile(prefix, filename)
                 # create path if it doesn't exist
                 utils.create_folder(filepath)
-                # create new input files with prefix in the name
-                shutil.copyfile(base_filepath, filepath)
-                # search replace contents for PREFIX and replace with 'prefix'
-                utils.replace_in_file(template_prefix, prefix,
-                                      filepath)
+                # create new input files with prefix in the name, with
+                # contents PREFIX replaced with 'prefix'
+                if self.contains_template(base_filepath, template_prefix):
+                    utils.render_file(base_filepath, filepath,
+                                      template_prefix, prefix)
+                else:
+                    method = utils.link_or_copy_file(base_filepath, filepath)
+                    logging.debug("No template prefix in %s, %s to %s",
+                                  base_filepath, method, filepath)
                 filenames.append(filepath)
             else:
                 filenames.append(base_filepath)
 
         return filenames
 
+    def contains_template(self, base_filepath, template_prefix):
+        """
+        Return True if the template prefix occurs in the base file. The
+        result is cached until the base file is modified.
+        """
+        stat = os.stat(base_filepath)
+        key = (base_filepath, template_prefix)
+
+        scan = self.template_scans.get(key)
+        if scan is None or scan[:2] != (stat.st_mtime, stat.st_size):
+            contains = utils.file_contains(base_filepath, template_prefix)
+            scan = (stat.st_mtime, stat.st_size, contains)
+            self.template_scans[key] = scan
+
+        return scan[2]
+
     def variables_filepath(self):
         """
         Return full filename with path, of the file being used for
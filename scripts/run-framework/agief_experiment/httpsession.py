@@ -0,0 +1,185 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""HttpSession class, pooled keep-alive HTTP access to the Compute REST API."""
+
+import os
+import zlib
+import uuid
+import logging
+import threading
+import collections
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# connect_timeout, read_timeout: seconds, read_timeout None means wait forever
+# retries: number of retries on connection errors and gateway errors
+# methods: the HTTP methods that are safe to retry for this endpoint
+EndpointPolicy = collections.namedtuple(
+    'EndpointPolicy',
+    ['connect_timeout', 'read_timeout', 'retries', 'backoff_factor', 'methods'])
+
+
+class HttpSession:
+  """
+  A keep-alive HTTP session for one Compute node (host and port).
+
+  All endpoints share a single connection pool, and each endpoint has its
+  own timeouts and retry policy. There is one shared session per base url,
+  so that every Compute object talking to the same node reuses connections.
+  """
+
+  POOL_MAXSIZE = 8
+
+  STATUS_FORCELIST = (502, 503, 504)
+
+  DEFAULT_POLICY = EndpointPolicy(3.05, 60, 2, 0.5, ('GET',))
+
+  # /update and /import are not idempotent (and /import streams a file),
+  # so they are never retried
+  ENDPOINT_POLICIES = {
+      '/version': EndpointPolicy(1, 5, 0, 0, ('GET',)),
+      '/config': EndpointPolicy(3.05, 30, 3, 0.5, ('GET', 'POST')),
+      '/update': EndpointPolicy(3.05, 60, 0, 0, ()),
+      '/import': EndpointPolicy(3.05, 3600, 0, 0, ()),
+      '/import-local': EndpointPolicy(3.05, 3600, 0, 0, ()),
+      '/export': EndpointPolicy(3.05, 3600, 1, 1, ('GET',)),
+      '/stop': EndpointPolicy(3.05, 10, 0, 0, ()),
+  }
+
+  _sessions = {}
+  _sessions_lock = threading.Lock()
+
+  def __init__(self, base_url):
+    self.base_url = base_url
+    self.session = requests.Session()
+
+    # the pool is owned by the default adapter, and shared by the endpoint
+    # adapters, which only differ in their retry policy
+    default_adapter = self._adapter(self.DEFAULT_POLICY)
+    self.session.mount(base_url, default_adapter)
+
+    for endpoint, policy in self.ENDPOINT_POLICIES.items():
+      adapter = self._adapter(policy)
+      adapter.poolmanager = default_adapter.poolmanager
+      self.session.mount(base_url + endpoint, adapter)
+
+  @classmethod
+  def for_url(cls, base_url):
+    """Return the shared session for the Compute node at 'base_url'."""
+    with cls._sessions_lock:
+      session = cls._sessions.get(base_url)
+      if session is None:
+        session = cls(base_url)
+        cls._sessions[base_url] = session
+      return session
+
+  @classmethod
+  def close_all(cls):
+    """Close all the shared sessions, and their pooled connections."""
+    with cls._sessions_lock:
+      sessions = list(cls._sessions.values())
+      cls._sessions.clear()
+
+    for session in sessions:
+      session.close()
+
+  def _adapter(self, policy):
+    retry = Retry(total=policy.retries,
+                  connect=policy.retries,
+                  read=policy.retries,
+                  status=policy.retries,
+                  backoff_factor=policy.backoff_factor,
+                  status_forcelist=self.STATUS_FORCELIST,
+                  allowed_methods=frozenset(policy.methods),
+                  raise_on_status=False)
+
+    return HTTPAdapter(pool_connections=1,
+                       pool_maxsize=self.POOL_MAXSIZE,
+                       max_retries=retry)
+
+  def policy(self, endpoint):
+    return self.ENDPOINT_POLICIES.get(endpoint, self.DEFAULT_POLICY)
+
+  def request(self, method, endpoint, **kwargs):
+    """
+    Make a request to 'endpoint' e.g. '/config', on the pooled session.
+    The endpoint timeouts are used, unless 'timeout' is given explicitly.
+    """
+    if 'timeout' not in kwargs:
+      policy = self.policy(endpoint)
+      kwargs['timeout'] = (policy.connect_timeout, policy.read_timeout)
+
+    logging.debug("%s %s%s", method, self.base_url, endpoint)
+    return self.session.request(method, self.base_url + endpoint, **kwargs)
+
+  def get(self, endpoint, **kwargs):
+    return self.request('GET', endpoint, **kwargs)
+
+  def post(self, endpoint, **kwargs):
+    return self.request('POST', endpoint, **kwargs)
+
+  def close(self):
+    self.session.close()
+
+
+class MultipartFileStream:
+  """
+  A multipart/form-data request body with a single file, that is read in
+  chunks as it is sent, rather than loaded into memory.
+
+  Pass the object itself as request data to send it with a Content-Length,
+  or gzipped() to compress it on the fly (sent with chunked encoding).
+  """
+
+  CHUNK_SIZE = 1024 * 1024
+
+  def __init__(self, field_name, filepath, chunk_size=CHUNK_SIZE):
+    self.filepath = filepath
+    self.chunk_size = chunk_size
+
+    boundary = uuid.uuid4().hex
+    self.content_type = 'multipart/form-data; boundary=' + boundary
+    self.head = ('--{0}\r\n'
+                 'Content-Disposition: form-data; name="{1}"; '
+                 'filename="{2}"\r\n'
+                 'Content-Type: application/octet-stream\r\n'
+                 '\r\n').format(boundary, field_name,
+                                 os.path.basename(filepath)).encode('utf-8')
+    self.tail = '\r\n--{0}--\r\n'.format(boundary).encode('utf-8')
+
+  def __len__(self):
+    return len(self.head) + os.path.getsize(self.filepath) + len(self.tail)
+
+  def __iter__(self):
+    yield self.head
+    with open(self.filepath, 'rb') as f:
+      while True:
+        chunk = f.read(self.chunk_size)
+        if not chunk:
+          break
+        yield chunk
+    yield self.tail
+
+  def gzipped(self, level=6):
+    """Generator of the body, gzip compressed as it is read."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in self:
+      data = compressor.compress(chunk)
+      if data:
+        yield data
+    yield compressor.flush()
@@ -5,8 +5,18 @@ class LaunchMode(Enum):
     per_experiment = 1
     per_session = 2
 
+    # launched once per session like per_session, but checked (and relaunched
+    # if necessary) before each parameter set, reusing loaded datasets
+    warm = 3
+
     @classmethod
     def from_args(cls, args):
+        if getattr(args, 'launch_warm', False):
+            return cls.warm
         return (cls.per_session
                 if args.launch_per_session
                 else cls.per_experiment)
+
+    def launches_per_session(self):
+        """True if Compute is launched once, at the start of the session."""
+        return self in (LaunchMode.per_session, LaunchMode.warm)
@@ -0,0 +1,164 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""LocalFleet class."""
+
+import os
+import socket
+import shutil
+import logging
+
+from agief_experiment import utils
+from agief_experiment.compute import Compute
+from agief_experiment.host_node import HostNode
+
+
+class LocalFleet:
+  """
+  A fleet of Compute nodes on this machine, each on its own port, with its
+  own run folder and log files.
+
+  Each instance runs from AGI_RUN_HOME/fleet/[port], which has a copy of the
+  run folder files (node.properties, log4j2.xml), with node.properties
+  rewritten to use the port and a unique node name.
+  """
+
+  FLEET_FOLDER = "fleet"
+  NODE_PROPERTIES = "node.properties"
+  RUN_FILES = ["log4j2.xml"]
+
+  def __init__(self, experiment, cores_per_instance=2, ram_per_instance=4):
+    """
+    :param experiment: an Experiment object, used to locate the run folder
+    :param cores_per_instance: number of cores to allow for each instance
+    :param ram_per_instance: GB of RAM to allow for each instance
+    """
+    self.experiment_utils = experiment.experiment_utils
+    self.cores_per_instance = cores_per_instance
+    self.ram_per_instance = ram_per_instance
+
+  def instance_count(self, max_instances=None):
+    """
+    Choose the number of instances from the free cores and free memory.
+    """
+    free_cores = free_cpu_count()
+    free_ram = free_memory_gb()
+
+    count = int(min(free_cores // self.cores_per_instance,
+                    free_ram // self.ram_per_instance))
+    if max_instances:
+      count = min(count, max_instances)
+    count = max(count, 1)
+
+    logging.info("Local fleet: %.1f free cores, %.1f GB free RAM, "
+                 "%d instances", free_cores, free_ram, count)
+    return count
+
+  def compute_nodes(self, count, base_port):
+    """
+    Prepare the run folders for 'count' instances, on free ports starting
+    at 'base_port', and return a Compute object for each one.
+    Compute is launched as usual with Compute.launch.
+    """
+    print("\n....... Prepare local fleet of " + str(count) +
+          " Compute nodes")
+
+    compute_nodes = []
+    for port in free_ports(count, int(base_port)):
+      run_folder = self.create_run_folder(port)
+      print("  - port " + str(port) + ", run folder = " + run_folder)
+      compute_nodes.append(Compute(HostNode(), str(port),
+                                   run_folder=run_folder))
+    return compute_nodes
+
+  def create_run_folder(self, port):
+    """Create the run folder for the instance on 'port'."""
+    run_folder = self.experiment_utils.runpath(
+        self.FLEET_FOLDER + "/" + str(port) + "/")
+    utils.create_folder(run_folder)
+
+    for filename in self.RUN_FILES:
+      source = self.experiment_utils.runpath(filename)
+      if os.path.isfile(source):
+        shutil.copyfile(source, os.path.join(run_folder, filename))
+
+    source = self.experiment_utils.runpath(self.NODE_PROPERTIES)
+    properties = []
+    if os.path.isfile(source):
+      with open(source) as properties_file:
+        properties = properties_file.read().splitlines()
+    else:
+      logging.warning("no %s found in run folder, creating one for the "
+                      "fleet instance", self.NODE_PROPERTIES)
+
+    properties = [line for line in properties
+                  if not line.startswith(('node-port=', 'node-name='))]
+    properties.append("node-name=node-" + str(port))
+    properties.append("node-port=" + str(port))
+
+    with open(os.path.join(run_folder, self.NODE_PROPERTIES), 'w') as f:
+      f.write("\n".join(properties) + "\n")
+
+    return run_folder
+
+
+def free_cpu_count():
+  """Number of cores not in use, based on the 1 minute load average."""
+  cores = os.cpu_count() or 1
+  try:
+    load = os.getloadavg()[0]
+  except OSError:
+    load = 0
+  return max(cores - load, 1)
+
+
+def free_memory_gb():
+  """Available memory in GB (MemAvailable on Linux, free pages otherwise)."""
+  try:
+    with open('/proc/meminfo') as meminfo:
+      for line in meminfo:
+        if line.startswith('MemAvailable:'):
+          return int(line.split()[1]) / (1024.0 * 1024.0)
+  except (IOError, OSError):
+    pass
+
+  try:
+    pages = os.sysconf('SC_AVPHYS_PAGES')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return pages * page_size / (1024.0 ** 3)
+  except (ValueError, OSError, AttributeError):
+    return 0
+
+
+def free_ports(count, base_port, host='localhost'):
+  """Return 'count' ports, from 'base_port' upwards, that can be bound."""
+  ports = []
+  port = base_port
+  while len(ports) < count:
+    if port > 65535:
+      raise Exception("ERROR: could not find " + str(count) + " free ports "
+                      "from " + str(base_port))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+      sock.bind((host, port))
+      ports.append(port)
+    except socket.error:
+      logging.debug("port %d is in use", port)
+    finally:
+      sock.close()
+    port += 1
+
+  return ports
@@ -0,0 +1,300 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Metrics class, live progress of a session as Prometheus metrics."""
+
+import os
+import time
+import socket
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agief_experiment.retry import RetryStats
+from agief_experiment.tracing import Tracer
+
+# name: (type, help), counters are named without the '_total' suffix
+FAMILIES = {
+    'agief_parameter_set_running':
+        ('gauge', "The parameter set running on a Compute node, by prefix."),
+    'agief_parameter_set_index':
+        ('gauge', "Index (from 1, in plan order) of the parameter set "
+                  "running on a Compute node."),
+    'agief_parameter_sets_planned':
+        ('gauge', "Number of parameter sets in the experiments file."),
+    'agief_parameter_sets':
+        ('counter', "Parameter sets finished, by result."),
+    'agief_entity_age':
+        ('gauge', "Last polled age of the experiment entity."),
+    'agief_entity_age_rate':
+        ('gauge', "Ages per second of the experiment entity, measured from "
+                  "successive polls."),
+    'agief_entity_poll_timestamp_seconds':
+        ('gauge', "Time of the last poll of the experiment entity."),
+    'agief_stage_duration_seconds':
+        ('summary', "Duration of the stages of the session."),
+    'agief_stage_last_duration_seconds':
+        ('gauge', "Duration of the last run of each stage of the session."),
+    'agief_stalls':
+        ('counter', "Runs aborted because their age stopped advancing."),
+    'agief_exported_bytes':
+        ('counter', "Bytes exported from Compute to files."),
+    'agief_uploaded_bytes':
+        ('counter', "Bytes uploaded to S3."),
+    'agief_retry_attempts':
+        ('counter', "Attempts of each retry loop."),
+    'agief_retries':
+        ('counter', "Retries of each retry loop."),
+    'agief_retry_give_ups':
+        ('counter', "Retry loops that ran out of attempts."),
+}
+
+OPENMETRICS_CONTENT_TYPE = ('application/openmetrics-text; version=1.0.0; '
+                            'charset=utf-8')
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metrics:
+  """
+  Live progress of the session (prefix and index of the running parameter
+  sets, age and age rate of the experiment entity, stage durations, bytes
+  exported and uploaded, retries), for Prometheus to scrape:
+
+    - from a textfile, rewritten atomically at most every 'interval'
+      seconds, e.g. into the folder of the node exporter textfile
+      collector (in the Prometheus text format that it reads)
+    - from http://host:port/metrics, in the OpenMetrics format if the
+      scraper asks for it, the Prometheus text format otherwise
+
+  Every sample is labelled with 'session', to tell apart the sessions that
+  run at the same time. Stage durations are taken from the spans of
+  Tracer, and retry counts from RetryStats.
+
+  Metrics are disabled until start() is called; until then set(), inc()
+  and remove() do nothing.
+  """
+
+  enabled = False
+  interval = 1.0
+
+  _lock = threading.Lock()
+  _write_lock = threading.Lock()
+  _session = None
+  _samples = {}
+  _textfile = None
+  _server = None
+  _last_write = 0.0
+
+  @classmethod
+  def start(cls, textfile=None, port=None, host='localhost', session=None,
+            interval=1.0):
+    """Enable metrics, to a textfile and/or an HTTP endpoint on 'port'."""
+    with cls._lock:
+      cls._session = session or (socket.gethostname() + "-" +
+                                 str(os.getpid()))
+      cls._textfile = textfile
+      cls._samples = {}
+      cls.interval = interval
+      cls.enabled = bool(textfile or port)
+
+    if not cls.enabled:
+      return
+
+    Tracer.add_listener(cls.observe_span)
+
+    if port:
+      cls._server = ThreadingHTTPServer((host, int(port)),
+                                        MetricsRequestHandler)
+      cls._server.daemon_threads = True
+      thread = threading.Thread(target=cls._server.serve_forever,
+                                name='metrics-http')
+      thread.daemon = True
+      thread.start()
+      logging.info("Serving metrics at http://%s:%d/metrics", host,
+                   cls._server.server_address[1])
+
+    cls.publish(force=True)
+
+  @classmethod
+  def close(cls):
+    """Write the final textfile, stop the HTTP endpoint, and disable."""
+    if not cls.enabled:
+      return
+
+    cls.publish(force=True)
+    Tracer.remove_listener(cls.observe_span)
+
+    with cls._lock:
+      cls.enabled = False
+      server, cls._server = cls._server, None
+    if server is not None:
+      server.shutdown()
+      server.server_close()
+
+  @classmethod
+  def set(cls, name, value, **labels):
+    """Set the gauge 'name' (with 'labels') to 'value'."""
+    if not cls.enabled:
+      return
+    with cls._lock:
+      cls._samples[(name, label_key(labels))] = value
+    cls.publish()
+
+  @classmethod
+  def inc(cls, name, amount=1, **labels):
+    """Add 'amount' to the counter 'name' (with 'labels')."""
+    if not cls.enabled:
+      return
+    key = (name, label_key(labels))
+    with cls._lock:
+      cls._samples[key] = cls._samples.get(key, 0) + amount
+    cls.publish()
+
+  @classmethod
+  def remove(cls, name, **labels):
+    """Remove the sample 'name' with 'labels', e.g. of a finished set."""
+    if not cls.enabled:
+      return
+    with cls._lock:
+      cls._samples.pop((name, label_key(labels)), None)
+    cls.publish()
+
+  @classmethod
+  def observe_span(cls, record):
+    """Tracer listener, the duration of each span is a stage duration."""
+    labels = label_key({'stage': record['name']})
+    with cls._lock:
+      count_key = ('agief_stage_duration_seconds_count', labels)
+      sum_key = ('agief_stage_duration_seconds_sum', labels)
+      cls._samples[count_key] = cls._samples.get(count_key, 0) + 1
+      cls._samples[sum_key] = (cls._samples.get(sum_key, 0) +
+                               record['duration'])
+      cls._samples[('agief_stage_last_duration_seconds', labels)] = (
+          record['duration'])
+    cls.publish()
+
+  @classmethod
+  def publish(cls, force=False):
+    """Rewrite the textfile, if it is older than 'interval' (or 'force')."""
+    with cls._lock:
+      if cls._textfile is None:
+        return
+      now = time.time()
+      if not force and now - cls._last_write < cls.interval:
+        return
+      cls._last_write = now
+      textfile = cls._textfile
+
+    with cls._write_lock:
+      text = cls.render()
+      folder = os.path.dirname(os.path.abspath(textfile))
+      try:
+        if not os.path.isdir(folder):
+          os.makedirs(folder)
+        with open(textfile + '.tmp', 'w') as metrics_file:
+          metrics_file.write(text)
+        os.replace(textfile + '.tmp', textfile)
+      except OSError as e:
+        logging.warning("Could not write metrics to %s: %s", textfile, e)
+
+  @classmethod
+  def render(cls, openmetrics=False):
+    """The metrics, in the OpenMetrics or the Prometheus text format."""
+    with cls._lock:
+      samples = dict(cls._samples)
+      session = cls._session
+
+    for stats in RetryStats.all():
+      loop = label_key({'loop': stats.name})
+      samples[('agief_retry_attempts', loop)] = stats.attempts
+      samples[('agief_retries', loop)] = stats.retries
+      samples[('agief_retry_give_ups', loop)] = stats.give_ups
+
+    by_family = {}
+    for (name, labels), value in samples.items():
+      family = family_name(name)
+      by_family.setdefault(family, []).append((name, labels, value))
+
+    lines = []
+    for family in sorted(by_family):
+      metric_type, help_text = FAMILIES[family]
+      header = family
+      suffix = ''
+      if metric_type == 'counter':
+        suffix = '_total'
+        if not openmetrics:
+          header = family + suffix
+      lines.append("# HELP %s %s" % (header, help_text))
+      lines.append("# TYPE %s %s" % (header, metric_type))
+      for name, labels, value in sorted(by_family[family]):
+        if metric_type == 'counter':
+          name += suffix
+        lines.append("%s{%s} %s" % (
+            name, format_labels((('session', session),) + labels),
+            format_value(value)))
+
+    if openmetrics:
+      lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+  """Serve Metrics.render() at /metrics."""
+
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+
+    openmetrics = 'application/openmetrics-text' in self.headers.get(
+        'Accept', '')
+    body = Metrics.render(openmetrics).encode('utf-8')
+
+    self.send_response(200)
+    self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE if openmetrics
+                     else PROMETHEUS_CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    logging.debug("metrics: " + format, *args)
+
+
+def label_key(labels):
+  return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def family_name(name):
+  for suffix in ('_count', '_sum'):
+    if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+      return name[:-len(suffix)]
+  return name
+
+
+def format_labels(labels):
+  return ",".join('%s="%s"' % (name, escape_label(value))
+                  for name, value in labels)
+
+
+def escape_label(value):
+  return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+  if isinstance(value, bool):
+    return '1' if value else '0'
+  return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,172 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""ReadinessProbe class, waits for a launched Compute to be ready."""
+
+import os
+import re
+import time
+import socket
+import logging
+import threading
+
+from agief_experiment.retry import Retry, RetryPolicy
+
+
+class ReadinessProbe:
+  """
+  Wait until Compute is ready, in cheap to expensive steps:
+
+    1. (optional, local launches) tail the stdout log of Compute, until a
+       line matches the 'started' marker
+    2. TCP connect to the port, at sub-second intervals
+    3. GET /version, once the port accepts connections
+
+  The time to each step is recorded per launch, to track startup latency.
+  """
+
+  # the overall budget, the same as the original 120 polls x 3 seconds
+  DEADLINE = 360
+
+  CONNECT_POLICY = RetryPolicy(initial=0.05, maximum=0.5, jitter=0.2)
+  VERSION_POLICY = RetryPolicy(initial=0.1, maximum=1.0, jitter=0.2)
+  LOG_POLICY = RetryPolicy(initial=0.05, maximum=0.5, jitter=0.2)
+
+  CONNECT_TIMEOUT = 0.5
+
+  # (base url, seconds to ready, {step: seconds since launch})
+  launches = []
+  _launches_lock = threading.Lock()
+
+  def __init__(self, compute, log_filepath=None, started_marker=None,
+               deadline=DEADLINE):
+    """
+    :param compute: the Compute to wait for
+    :param log_filepath: the stdout log of a local Compute
+    :param started_marker: regular expression of the log line that shows
+                           Compute has started (log tailing is skipped if
+                           either this or log_filepath is None)
+    """
+    self.compute = compute
+    self.log_filepath = log_filepath
+    self.started_marker = started_marker
+    self.deadline = deadline
+
+  def wait(self, launch_time=None):
+    """
+    Wait until Compute is ready, and return its version.
+    Raises an Exception if it is not ready within the deadline.
+
+    :param launch_time: when Compute was launched (time.time()), log lines
+                        written before then are ignored
+    """
+    start = launch_time or time.time()
+    steps = {}
+
+    if self.log_filepath and self.started_marker:
+      if not self._wait_log_marker(start):
+        raise Exception("Error: could not start framework, '" +
+                        self.started_marker + "' not found in " +
+                        self.log_filepath)
+      steps['log'] = time.time() - start
+
+    if not self._wait_connect(start):
+      raise Exception("Error: could not start framework, nothing listening "
+                      "at " + self.compute.base_url())
+    steps['connect'] = time.time() - start
+
+    version = self._wait_version(start)
+    if version is None:
+      raise Exception("Error: could not start framework, no version from " +
+                      self.compute.base_url())
+    steps['version'] = time.time() - start
+
+    latency = time.time() - start
+    with self._launches_lock:
+      self.launches.append((self.compute.base_url(), latency, steps))
+
+    logging.info("Compute at %s ready in %.2fs (%s)", self.compute.base_url(),
+                 latency, ", ".join("%s %.2fs" % (step, seconds)
+                                    for step, seconds in steps.items()))
+    return version
+
+  def _policy(self, policy, start):
+    remaining = max(self.deadline - (time.time() - start), 0)
+    return RetryPolicy(initial=policy.initial, maximum=policy.maximum,
+                       jitter=policy.jitter, deadline=remaining)
+
+  def _wait_log_marker(self, start):
+    regex = re.compile(self.started_marker)
+    position = 0
+    partial = ''
+
+    for _ in Retry(self._policy(self.LOG_POLICY, start), 'compute-wait-log'):
+      try:
+        stat = os.stat(self.log_filepath)
+      except OSError:
+        continue
+
+      # a log left by a previous launch, not yet truncated
+      if stat.st_mtime < start:
+        continue
+
+      if stat.st_size < position:
+        position, partial = 0, ''
+
+      with open(self.log_filepath, 'r', errors='replace') as log_file:
+        log_file.seek(position)
+        text = partial + log_file.read()
+        position = log_file.tell()
+
+      lines = text.split('\n')
+      partial = lines.pop()
+      if any(regex.search(line) for line in lines):
+        return True
+
+    return False
+
+  def _wait_connect(self, start):
+    address = (self.compute.host_node.host, int(self.compute.port))
+    for _ in Retry(self._policy(self.CONNECT_POLICY, start),
+                   'compute-wait-connect'):
+      try:
+        sock = socket.create_connection(address, self.CONNECT_TIMEOUT)
+        sock.close()
+        return True
+      except (socket.error, socket.timeout):
+        pass
+    return False
+
+  def _wait_version(self, start):
+    for _ in Retry(self._policy(self.VERSION_POLICY, start),
+                   'compute-wait-version'):
+      version = self.compute.version(True)
+      if version is not None:
+        return version
+    return None
+
+  @classmethod
+  def report(cls):
+    """Log the startup latency over all the launches."""
+    with cls._launches_lock:
+      latencies = [latency for _, latency, _ in cls.launches]
+
+    if not latencies:
+      return
+
+    logging.info("Compute startup: %d launches, mean %.2fs, min %.2fs, "
+                 "max %.2fs", len(latencies),
+                 sum(latencies) / len(latencies), min(latencies),
+                 max(latencies))
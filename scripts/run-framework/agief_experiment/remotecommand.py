@@ -0,0 +1,246 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""RemoteCommand class, streaming the output of a command run over SSH."""
+
+import re
+import sys
+import codecs
+import select
+import logging
+import threading
+import collections
+
+import paramiko
+
+from agief_experiment.sshpool import SSHPool
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+# stream: STDOUT or STDERR
+# text: the line, without the line ending
+RemoteLine = collections.namedtuple('RemoteLine', ['stream', 'text'])
+
+
+class LineMatcher:
+  """
+  Resolves on the first line that matches 'pattern' (a regular expression,
+  searched anywhere in the line), optionally only on one 'stream'.
+
+  The match is available as soon as the line arrives, from 'match' or from
+  wait() in another thread. If 'stop' is True, the command stops being read
+  (and its channel is closed) once the matcher resolves.
+  """
+
+  def __init__(self, pattern, stream=None, stop=False):
+    self.regex = re.compile(pattern)
+    self.stream = stream
+    self.stop = stop
+    self.match = None
+    self.resolved = threading.Event()
+
+  def feed(self, line):
+    """Return True if 'line' resolved the matcher."""
+    if self.resolved.is_set():
+      return False
+    if self.stream is not None and line.stream != self.stream:
+      return False
+
+    match = self.regex.search(line.text)
+    if match is None:
+      return False
+
+    self.match = match
+    self.resolved.set()
+    return True
+
+  def wait(self, timeout=None):
+    """Wait for the matcher to resolve, and return the match (or None)."""
+    self.resolved.wait(timeout)
+    return self.match
+
+
+class RemoteCommand:
+  """
+  A command run on a remote machine, on a channel of the host's pooled SSH
+  connection, with its output decoded and split into lines as it arrives.
+
+  Only the last 'history' lines are kept (see tail()), so that the output
+  of long runs doesn't accumulate in memory. Lines can be handled as they
+  arrive by iterating over lines(), with on_line() callbacks, or by
+  LineMatchers from match().
+
+  NOTE: with a pty (the default, as some commands need a terminal), the
+  remote side merges stderr into stdout.
+  """
+
+  ENVIRONMENT = {'LC_ALL': 'C.UTF-8', 'LANG': 'C.UTF-8'}
+
+  def __init__(self, host_node, cmd, timeout=3600, history=1000, echo=True,
+               get_pty=True, max_repeats=15, wait_period=5):
+    """
+    :param host_node: HostNode object
+    :param cmd: The commands to be executed
+    :param timeout: seconds to wait for output, before giving up
+    :param history: number of recent lines to keep
+    :param echo: if True, write the lines to this process' stdout/stderr
+    """
+    self.host_node = host_node
+    self.cmd = cmd
+    self.timeout = timeout
+    self.echo = echo
+    self.get_pty = get_pty
+    self.max_repeats = max_repeats
+    self.wait_period = wait_period
+
+    self.recent = collections.deque(maxlen=history)
+    self.callbacks = []
+    self.matchers = []
+    self.stopped = False
+    self.exit_status = None
+
+  def on_line(self, callback):
+    """Call callback(line) with each RemoteLine, as it arrives."""
+    self.callbacks.append(callback)
+    return self
+
+  def match(self, pattern, stream=None, stop=False):
+    """Add and return a LineMatcher for 'pattern'."""
+    matcher = LineMatcher(pattern, stream, stop)
+    self.matchers.append(matcher)
+    return matcher
+
+  def tail(self):
+    """The most recent lines (as RemoteLines), up to 'history' of them."""
+    return list(self.recent)
+
+  def run(self):
+    """
+    Run the command to completion, or until a stopping matcher resolves.
+    Raises ValueError if the command failed.
+    """
+    try:
+      for _ in self.lines():
+        pass
+    except paramiko.ssh_exception.SSHException:
+      logging.error("SSH command failed on %s: %s", self.host_node.host,
+                    self.cmd)
+      self.exit_status = 1
+
+    self.check_exit_status()
+    return self
+
+  def check_exit_status(self):
+    if self.exit_status is not None and self.exit_status > 0:
+      raise ValueError('SSH connection closed with exit status code: ' +
+                       str(self.exit_status))
+
+  def lines(self):
+    """Generator of RemoteLines from stdout and stderr, as they arrive."""
+    partial = {STDOUT: '', STDERR: ''}
+
+    chunks = self.chunks()
+    try:
+      for stream, text in chunks:
+        complete = (partial[stream] + text).split('\n')
+        partial[stream] = complete.pop()
+
+        for text_line in complete:
+          line = RemoteLine(stream, text_line.rstrip('\r'))
+          self._handle(line)
+          yield line
+          if self.stopped:
+            return
+
+      for stream, text in partial.items():
+        if text:
+          line = RemoteLine(stream, text.rstrip('\r'))
+          self._handle(line)
+          yield line
+    finally:
+      # closes the channel, if reading stopped early
+      chunks.close()
+
+  def _handle(self, line):
+    self.recent.append(line)
+
+    if self.echo:
+      out = sys.stderr if line.stream == STDERR else sys.stdout
+      out.write(line.text + '\n')
+
+    for callback in self.callbacks:
+      callback(line)
+
+    for matcher in self.matchers:
+      if matcher.feed(line) and matcher.stop:
+        self.stopped = True
+
+  def chunks(self):
+    """
+    Generator of (stream, text) chunks of output, decoded as they arrive.
+    The exit status is set once the output is exhausted.
+    """
+    decoders = {STDOUT: codecs.getincrementaldecoder('utf-8')('replace'),
+                STDERR: codecs.getincrementaldecoder('utf-8')('replace')}
+
+    pool = SSHPool.for_host(self.host_node)
+    with pool.session(get_pty=self.get_pty, environment=self.ENVIRONMENT,
+                      max_repeats=self.max_repeats,
+                      wait_period=self.wait_period) as channel:
+      logging.debug("Executing command remotely = %s", self.cmd)
+      channel.exec_command(self.cmd)
+
+      # Indicate that we're not going to write to that channel anymore
+      channel.shutdown_write()
+      channel.settimeout(self.timeout)
+
+      # Chunked read to prevent stalls
+      logging.debug('Reading from remote...')
+      while (not channel.closed or channel.recv_ready() or
+             channel.recv_stderr_ready()):
+        got_chunk = False
+        select.select([channel], [], [], self.timeout)
+
+        if channel.recv_ready():
+          data = channel.recv(len(channel.in_buffer))
+          text = decoders[STDOUT].decode(data)
+          got_chunk = True
+          if text:
+            yield STDOUT, text
+
+        if channel.recv_stderr_ready():
+          # Make sure to read stderr to prevent stall
+          data = channel.recv_stderr(len(channel.in_stderr_buffer))
+          text = decoders[STDERR].decode(data)
+          got_chunk = True
+          if text:
+            yield STDERR, text
+
+        if (not got_chunk and channel.exit_status_ready() and
+            not channel.recv_stderr_ready() and not channel.recv_ready()):
+          # Exit as remote side is finished and our buffers are empty
+          logging.debug('Output buffers are empty. Exiting...')
+          break
+
+      for stream, decoder in decoders.items():
+        text = decoder.decode(b'', final=True)
+        if text:
+          yield stream, text
+
+      # Get the exit status code
+      logging.debug('Waiting for exit status code...')
+      self.exit_status = channel.recv_exit_status()
+      logging.debug('Exit status code received: %s', str(self.exit_status))
@@ -0,0 +1,103 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""ResultsPipeline class, background processing of finished runs."""
+
+import queue
+import logging
+import threading
+import traceback
+
+
+class ResultsPipeline:
+  """
+  A bounded queue of finished runs (by prefix), processed by worker threads,
+  so that Compute can start the next run while the results of the previous
+  ones are compressed and uploaded.
+
+  submit() blocks while the queue is full (back-pressure), so that results
+  can't pile up on disk faster than they are uploaded. drain() waits for all
+  the submitted work, and failures are reported per prefix.
+  """
+
+  def __init__(self, workers=2, max_pending=4):
+    self.queue = queue.Queue(maxsize=max_pending)
+    self.failures = []
+    self.completed = []
+    self._lock = threading.Lock()
+
+    self.workers = []
+    for i in range(workers):
+      worker = threading.Thread(target=self._work,
+                                name="results-pipeline-" + str(i))
+      worker.daemon = True
+      worker.start()
+      self.workers.append(worker)
+
+  def submit(self, prefix, task):
+    """
+    Queue 'task' (a callable with no arguments) for the run 'prefix'.
+    Blocks while the queue is full.
+    """
+    if self.queue.full():
+      logging.info("Results pipeline is full, waiting to queue %s", prefix)
+    self.queue.put((prefix, task))
+
+  def _work(self):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          return
+
+        prefix, task = item
+        try:
+          task()
+          with self._lock:
+            self.completed.append(prefix)
+        except Exception as e:  # pylint: disable=W0703
+          logging.error("Processing results failed for prefix %s", prefix)
+          logging.error(traceback.format_exc())
+          with self._lock:
+            self.failures.append((prefix, e))
+      finally:
+        self.queue.task_done()
+
+  def drain(self):
+    """
+    Wait until all the submitted work is done, and stop the workers.
+
+    :return: False if processing failed for any prefix, True otherwise
+    """
+    if self.workers:
+      print("\n....... Wait for results processing to finish (" +
+            str(self.queue.qsize()) + " queued)")
+
+    for _ in self.workers:
+      self.queue.put(None)
+    for worker in self.workers:
+      worker.join()
+    self.workers = []
+
+    print(self.summary())
+    return not self.failures
+
+  def summary(self):
+    """Return a printable summary, with a line per failed prefix."""
+    message = ("\n....... Results processing: %d ok, %d failed\n" %
+               (len(self.completed), len(self.failures)))
+    for prefix, error in self.failures:
+      message += "  " + prefix + ": FAILED (" + str(error) + ")\n"
+    return message
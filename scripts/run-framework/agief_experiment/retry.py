@@ -0,0 +1,213 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Retry loops with exponential backoff, jitter and deadlines."""
+
+import time
+import random
+import logging
+import threading
+
+
+class RetryError(Exception):
+  """Raised when a retry loop runs out of attempts or time."""
+
+
+class RetryPolicy:
+  """
+  How to retry: the delay before attempt n+1 is
+  min(maximum, initial * multiplier^(n-1)), reduced by up to 'jitter'
+  (a fraction) at random, so that many nodes retrying at once drift apart.
+
+  A loop stops after 'max_attempts' attempts, or once 'deadline' seconds
+  have passed since it started (the last delay is cut short to fit), which
+  ever comes first. None means no limit.
+
+  Exceptions of the types in 'retryable' are retried, unless 'classify'
+  (a callable taking the exception) returns False for them.
+  """
+
+  def __init__(self, initial=0.5, maximum=30.0, multiplier=2.0, jitter=0.5,
+               max_attempts=None, deadline=None, retryable=(Exception,),
+               classify=None):
+    self.initial = initial
+    self.maximum = maximum
+    self.multiplier = multiplier
+    self.jitter = jitter
+    self.max_attempts = max_attempts
+    self.deadline = deadline
+    self.retryable = retryable
+    self.classify = classify
+
+  @classmethod
+  def from_repeats(cls, max_repeats, wait_period, **kwargs):
+    """
+    A policy for callers that used to retry 'max_repeats' times with a
+    fixed 'wait_period': start shorter, and back off up to twice as long.
+    """
+    return cls(initial=min(1.0, wait_period), maximum=2.0 * wait_period,
+               max_attempts=max_repeats, **kwargs)
+
+  def delay(self, attempt):
+    """The delay after 'attempt' (1 based) failed."""
+    base = min(self.maximum,
+               self.initial * self.multiplier ** (attempt - 1))
+    return base * (1.0 - self.jitter * random.random())
+
+  def is_retryable(self, error):
+    if not isinstance(error, self.retryable):
+      return False
+    return self.classify is None or self.classify(error)
+
+
+class RetryStats:
+  """
+  Totals per named retry loop (e.g. 'ssh-connect'): attempts, retries,
+  loops given up, and time spent working versus waiting between attempts.
+  """
+
+  _stats = {}
+  _lock = threading.Lock()
+
+  def __init__(self, name):
+    self.name = name
+    self.attempts = 0
+    self.retries = 0
+    self.give_ups = 0
+    self.work_seconds = 0.0
+    self.wait_seconds = 0.0
+
+  @classmethod
+  def for_name(cls, name):
+    with cls._lock:
+      stats = cls._stats.get(name)
+      if stats is None:
+        stats = cls(name)
+        cls._stats[name] = stats
+      return stats
+
+  @classmethod
+  def all(cls):
+    with cls._lock:
+      return sorted(cls._stats.values(), key=lambda stats: stats.name)
+
+  @classmethod
+  def report(cls):
+    """Log the totals of every retry loop that retried at least once."""
+    for stats in cls.all():
+      if stats.retries == 0 and stats.give_ups == 0:
+        continue
+      logging.info("Retries %s: %d attempts, %d retries, %d given up, "
+                   "%.1fs working, %.1fs waiting", stats.name,
+                   stats.attempts, stats.retries, stats.give_ups,
+                   stats.work_seconds, stats.wait_seconds)
+
+  def add(self, attempts=0, retries=0, give_ups=0, work=0.0, wait=0.0):
+    with self._lock:
+      self.attempts += attempts
+      self.retries += retries
+      self.give_ups += give_ups
+      self.work_seconds += work
+      self.wait_seconds += wait
+
+
+class Retry:
+  """
+  One retry loop, following a RetryPolicy. Either:
+
+    Retry(policy, 'name').call(fn, args)    # retry fn on retryable errors
+
+    for attempt in Retry(policy, 'name'):   # retry until 'break'
+      ...
+
+    retry = Retry(policy, 'name')           # or drive it by hand
+    while ...:
+      if not retry.backoff(): raise ...
+  """
+
+  def __init__(self, policy, name='retry'):
+    self.policy = policy
+    self.name = name
+    self.stats = RetryStats.for_name(name)
+    self.attempt = 0
+    self.start = time.time()
+
+  def elapsed(self):
+    return time.time() - self.start
+
+  def remaining(self):
+    """Seconds left before the deadline, or None if there is no deadline."""
+    if self.policy.deadline is None:
+      return None
+    return self.policy.deadline - self.elapsed()
+
+  def backoff(self):
+    """
+    Record a failed attempt, and sleep before the next one.
+    Return False (without sleeping) if there are no attempts left.
+    """
+    self.attempt += 1
+
+    max_attempts = self.policy.max_attempts
+    remaining = self.remaining()
+    if ((max_attempts is not None and self.attempt >= max_attempts) or
+        (remaining is not None and remaining <= 0)):
+      self.stats.add(give_ups=1)
+      return False
+
+    delay = self.policy.delay(self.attempt)
+    if remaining is not None:
+      delay = min(delay, remaining)
+
+    logging.debug("%s: attempt %d failed, retrying in %.2fs", self.name,
+                  self.attempt, delay)
+    time.sleep(delay)
+    self.stats.add(retries=1, wait=delay)
+    return True
+
+  def __iter__(self):
+    while True:
+      start = time.time()
+      try:
+        yield self.attempt + 1
+      finally:
+        # also runs when the caller breaks out of the loop (GeneratorExit),
+        # so that the successful attempt is counted
+        self.stats.add(attempts=1, work=time.time() - start)
+
+      if not self.backoff():
+        return
+
+  def call(self, fn, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs) until it returns, retrying retryable errors.
+    Raises RetryError (from the last error) when out of attempts or time,
+    and non retryable errors straight away.
+    """
+    while True:
+      start = time.time()
+      try:
+        result = fn(*args, **kwargs)
+        self.stats.add(attempts=1, work=time.time() - start)
+        return result
+      except Exception as e:  # pylint: disable=W0703
+        self.stats.add(attempts=1, work=time.time() - start)
+        if not self.policy.is_retryable(e):
+          raise
+
+        logging.debug("%s: %s", self.name, e)
+        if not self.backoff():
+          raise RetryError("%s: gave up after %d attempts (%.1fs): %s" % (
+              self.name, self.attempt, self.elapsed(), e)) from e
@@ -0,0 +1,189 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""S3Uploader class, parallel multipart uploads to S3."""
+
+import os
+import time
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore
+from boto3.s3.transfer import TransferConfig
+
+from agief_experiment.metrics import Metrics
+
+MB = 1024 * 1024
+
+
+class S3Uploader:
+  """
+  Upload files to S3 with one shared client for the whole session.
+
+  Buckets are checked (and created if missing) once per session. Files above
+  'multipart_threshold' are uploaded in parts of 'multipart_chunksize', with
+  up to 'part_concurrency' parts in flight, and up to 'file_concurrency'
+  files are uploaded at the same time.
+
+  The endpoint can be set to a local S3 stand-in (e.g. MinIO or moto server)
+  with 'endpoint_url', or the environment variable AGI_S3_ENDPOINT_URL.
+  """
+
+  def __init__(self, endpoint_url=None, file_concurrency=8,
+               part_concurrency=8, multipart_threshold=16 * MB,
+               multipart_chunksize=16 * MB):
+    self.endpoint_url = endpoint_url or os.getenv('AGI_S3_ENDPOINT_URL')
+    self.file_concurrency = file_concurrency
+    self.part_concurrency = part_concurrency
+
+    self.transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        max_concurrency=part_concurrency,
+        use_threads=True)
+
+    self._client = None
+    self._lock = threading.Lock()
+    # held while a bucket is checked, so that it is created at most once
+    self._bucket_lock = threading.Lock()
+    self.checked_buckets = set()
+
+    # totals for the session
+    self.files_uploaded = 0
+    self.bytes_uploaded = 0
+    self.seconds = 0.0
+
+  def client(self):
+    """The shared S3 client, created on first use (clients are threadsafe)."""
+    with self._lock:
+      if self._client is None:
+        config = botocore.config.Config(
+            max_pool_connections=self.file_concurrency * self.part_concurrency)
+        self._client = boto3.session.Session().client(
+            's3', endpoint_url=self.endpoint_url, config=config)
+      return self._client
+
+  def ensure_bucket(self, bucket_name):
+    """
+    Create the bucket if it does not exist, checking once per session (a
+    check that fails is done again on the next call).
+    """
+    with self._bucket_lock:
+      if bucket_name in self.checked_buckets:
+        return
+
+      client = self.client()
+      try:
+        client.head_bucket(Bucket=bucket_name)
+      except botocore.exceptions.ClientError as e:
+        # If it was a 404 error, then the bucket does not exist.
+        error_code = int(e.response['Error']['Code'])
+        if error_code != 404:
+          raise
+
+        logging.warning("s3 bucket " + bucket_name +
+                        " does not exist, creating it now.")
+        client.create_bucket(Bucket=bucket_name)
+
+      self.checked_buckets.add(bucket_name)
+
+  def upload_file(self, bucket_name, key, source_filepath):
+    """Upload one file, and return the number of bytes uploaded."""
+    return self.upload_files(bucket_name, [(key, source_filepath)])
+
+  def upload_folder(self, bucket_name, key, source_folderpath):
+    """
+    Upload all the files in a folder (recursively) to 'key'/[relative path],
+    and return the number of bytes uploaded.
+    """
+    if not os.path.exists(source_folderpath):
+      logging.warning("folder does not exist, cannot upload: " +
+                      source_folderpath)
+      return 0
+
+    if not os.path.isdir(source_folderpath):
+      logging.warning("path is not a folder, cannot upload: " +
+                      source_folderpath)
+      return 0
+
+    files = []
+    for root, _, filenames in os.walk(source_folderpath):
+      for filename in filenames:
+        filepath = os.path.join(root, filename)
+        relpath = os.path.relpath(filepath, source_folderpath)
+        files.append((key.rstrip('/') + '/' + relpath.replace(os.sep, '/'),
+                      filepath))
+
+    return self.upload_files(bucket_name, files)
+
+  def upload_files(self, bucket_name, files):
+    """
+    Upload (key, filepath) pairs concurrently, and return the number of
+    bytes uploaded. Empty and missing files are skipped.
+    """
+    files = [(key, filepath) for key, filepath in files
+             if self._is_uploadable(filepath)]
+    if not files:
+      return 0
+
+    self.ensure_bucket(bucket_name)
+
+    start = time.time()
+    workers = min(len(files), self.file_concurrency)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+      sizes = list(executor.map(
+          lambda item: self._upload(bucket_name, item[0], item[1]), files))
+    elapsed = max(time.time() - start, 1e-6)
+
+    total = sum(sizes)
+    with self._lock:
+      self.files_uploaded += len(files)
+      self.bytes_uploaded += total
+      self.seconds += elapsed
+    Metrics.inc('agief_uploaded_bytes', total)
+
+    print(" ... uploaded %d file(s), %.1f MB in %.2fs (%.1f MB/s)" % (
+        len(files), total / MB, elapsed, total / MB / elapsed))
+    return total
+
+  def _upload(self, bucket_name, key, filepath):
+    print(" ... file = " + filepath + ", to bucket = " + bucket_name +
+          ", key = " + key)
+    self.client().upload_file(filepath, bucket_name, key,
+                              Config=self.transfer_config)
+    return os.path.getsize(filepath)
+
+  @staticmethod
+  def _is_uploadable(filepath):
+    try:
+      if os.stat(filepath).st_size == 0:
+        logging.warning("file is empty, cannot upload: " + filepath)
+        return False
+    except OSError:
+      logging.warning("file does not exist, cannot upload: " + filepath)
+      return False
+    return True
+
+  def report(self):
+    """Log the totals for the session."""
+    if self.files_uploaded == 0:
+      return
+
+    logging.info("S3 uploads: %d files, %.1f MB in %.1fs (%.1f MB/s)",
+                 self.files_uploaded, self.bytes_uploaded / MB, self.seconds,
+                 self.bytes_uploaded / MB / max(self.seconds, 1e-6))
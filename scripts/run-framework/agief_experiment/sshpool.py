@@ -0,0 +1,181 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""SSHPool class, a shared SSH connection per remote host."""
+
+import socket
+import logging
+import threading
+import contextlib
+
+import paramiko
+
+from agief_experiment.retry import Retry, RetryError, RetryPolicy
+
+CONNECT_ERRORS = (paramiko.ssh_exception.BadHostKeyException,
+                  paramiko.ssh_exception.AuthenticationException,
+                  paramiko.ssh_exception.SSHException,
+                  socket.error)
+
+
+def is_retryable_connect(error):
+  # a different host key won't go away by retrying (but authentication can
+  # fail for a while on a new instance, until its keys are installed)
+  return not isinstance(error, paramiko.ssh_exception.BadHostKeyException)
+
+
+class SSHPool:
+  """
+  One authenticated SSH transport per host (and port, user and key), shared
+  by all commands, each of which runs on its own channel.
+
+  The transport is connected on first use, and reconnected transparently if
+  it has dropped. At most 'max_channels' channels are open at once (sshd
+  allows 10 sessions per connection by default), further commands wait for
+  a free channel.
+  """
+
+  MAX_CHANNELS = 8
+  KEEPALIVE = 60
+
+  # zlib compression of the transport, as with 'ssh -C'
+  COMPRESS = True
+
+  _pools = {}
+  _pools_lock = threading.Lock()
+
+  def __init__(self, host, port, user, keypath, max_channels=MAX_CHANNELS):
+    self.host = host
+    self.port = int(port)
+    self.user = user
+    self.keypath = keypath
+
+    self.client = None
+    self.connect_lock = threading.Lock()
+    self.channels = threading.BoundedSemaphore(max_channels)
+    self.connects = 0
+
+  @staticmethod
+  def key(host_node):
+    return (host_node.host, int(host_node.ssh_port), host_node.user,
+            host_node.keypath)
+
+  @classmethod
+  def for_host(cls, host_node):
+    """
+    Return the shared pool for 'host_node'. It is looked up per call, as the
+    host can be changed after the HostNode is created.
+    """
+    key = cls.key(host_node)
+    with cls._pools_lock:
+      pool = cls._pools.get(key)
+      if pool is None:
+        pool = cls(*key)
+        cls._pools[key] = pool
+      return pool
+
+  @classmethod
+  def close_all(cls):
+    """Close all the shared connections."""
+    with cls._pools_lock:
+      pools = list(cls._pools.values())
+      cls._pools.clear()
+
+    for pool in pools:
+      pool.close()
+
+  def transport(self, max_repeats=15, wait_period=5):
+    """Return the active transport, connecting (again) if necessary."""
+    with self.connect_lock:
+      if self.client is not None:
+        transport = self.client.get_transport()
+        if transport is not None and transport.is_active():
+          return transport
+
+        logging.info("SSH connection to %s dropped, reconnecting", self.host)
+        self.client.close()
+        self.client = None
+
+      policy = RetryPolicy.from_repeats(max_repeats, wait_period,
+                                        retryable=CONNECT_ERRORS,
+                                        classify=is_retryable_connect)
+      try:
+        self.client = Retry(policy, 'ssh-connect').call(self._connect)
+      except RetryError as e:
+        raise paramiko.ssh_exception.SSHException(
+            "Could not connect to " + self.host + ": " + str(e))
+
+      self.connects += 1
+      logging.debug("SSH connected to %s:%d", self.host, self.port)
+      return self.client.get_transport()
+
+  def _connect(self):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+      client.connect(self.host, username=self.user,
+                     key_filename=self.keypath, port=self.port,
+                     compress=self.COMPRESS)
+      client.get_transport().set_keepalive(self.KEEPALIVE)
+    except Exception:
+      client.close()
+      raise
+    return client
+
+  @contextlib.contextmanager
+  def session(self, get_pty=False, environment=None, **connect_args):
+    """
+    Open a channel (session) on the shared transport, for one command.
+    Waits while 'max_channels' channels are in use, and the channel is
+    closed on leaving the 'with' block.
+    """
+    with self.channels:
+      transport = self.transport(**connect_args)
+      try:
+        channel = transport.open_session()
+      except paramiko.ssh_exception.SSHException:
+        # the transport may have died since it was checked, if so try once
+        # more on a new connection
+        if transport.is_active():
+          raise
+        channel = self.transport(**connect_args).open_session()
+
+      try:
+        if get_pty:
+          channel.get_pty()
+        if environment:
+          channel.update_environment(environment)
+        yield channel
+      finally:
+        channel.close()
+
+  @contextlib.contextmanager
+  def sftp(self, **connect_args):
+    """
+    Open an SFTP session on the shared transport. It counts as one channel
+    towards 'max_channels', and is closed on leaving the 'with' block.
+    """
+    with self.channels:
+      sftp = paramiko.SFTPClient.from_transport(self.transport(**connect_args))
+      try:
+        yield sftp
+      finally:
+        sftp.close()
+
+  def close(self):
+    with self.connect_lock:
+      if self.client is not None:
+        self.client.close()
+        self.client = None
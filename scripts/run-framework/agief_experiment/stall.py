@@ -0,0 +1,216 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""StallPolicy and StallWatchdog, detect runs whose age stops advancing."""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+import collections
+
+
+class StallError(Exception):
+  """Raised when a run is aborted because it stalled."""
+
+
+class StallPolicy:
+  """
+  When a run is considered stalled: its rate of progress (age per second)
+  over the last 'window' seconds is below 'fraction' of its own moving
+  average, or of the 'baseline' rate of previous runs of the same
+  experiment (if there is one), or no poll of the run has succeeded for
+  'window' seconds (Compute does not respond).
+
+  The moving average is weighted by time, with a time constant of
+  'smoothing' windows, so that it does not depend on the poll period. Runs
+  are not checked until they have been polled for 'window' seconds.
+  """
+
+  def __init__(self, fraction=0.1, window=60.0, smoothing=10.0):
+    self.fraction = fraction
+    self.window = window
+    self.smoothing = smoothing
+
+  def watchdog(self, baseline=None):
+    """A new StallWatchdog for one run."""
+    return StallWatchdog(self, baseline)
+
+
+class StallWatchdog:
+  """
+  Follow the age of one run, poll by poll, and tell when it has stalled
+  (see StallPolicy):
+
+    watchdog = policy.watchdog(baseline=history.baseline(key))
+    while ...:
+      try:
+        ...poll
+        watchdog.update(age)
+      except ...:
+        ...the poll failed
+      reason = watchdog.stalled()
+      if reason:
+        ...abort
+  """
+
+  def __init__(self, policy, baseline=None):
+    self.policy = policy
+    self.baseline = baseline
+    self.started = time.time()
+    self.last_poll = None
+    self.first = None
+    self.samples = collections.deque()
+    self.average = None
+
+  def update(self, age, now=None):
+    """
+    Record a successful poll of the run, its age is ignored if it is not a
+    number.
+    """
+    if now is None:
+      now = time.time()
+    self.last_poll = max(self.last_poll or now, now)
+
+    try:
+      age = float(age)
+    except (TypeError, ValueError):
+      return
+
+    if self.samples:
+      t_last, age_last = self.samples[-1]
+      if now <= t_last:
+        return
+      # time weighted moving average of the rate between polls
+      rate = max(age - age_last, 0) / (now - t_last)
+      if self.average is None:
+        self.average = rate
+      else:
+        weight = 1 - math.exp(-(now - t_last) /
+                              (self.policy.window * self.policy.smoothing))
+        self.average += weight * (rate - self.average)
+    else:
+      self.first = (now, age)
+
+    self.samples.append((now, age))
+
+    # keep one sample at least 'window' old, to measure the recent rate
+    while (len(self.samples) > 2 and
+           now - self.samples[1][0] >= self.policy.window):
+      self.samples.popleft()
+
+  def rate(self):
+    """Age per second over the last window, None until it is measured."""
+    if len(self.samples) < 2:
+      return None
+
+    t_first, age_first = self.samples[0]
+    t_last, age_last = self.samples[-1]
+    if t_last - t_first < self.policy.window:
+      return None
+    return max(age_last - age_first, 0) / (t_last - t_first)
+
+  def mean_rate(self):
+    """Age per second since the first poll, None if unknown."""
+    if self.first is None or not self.samples:
+      return None
+
+    (t_first, age_first), (t_last, age_last) = self.first, self.samples[-1]
+    if t_last <= t_first or age_last <= age_first:
+      return None
+    return (age_last - age_first) / (t_last - t_first)
+
+  def stalled(self, now=None):
+    """A description of why the run is stalled, or None if it is not."""
+    if now is None:
+      now = time.time()
+
+    last_poll = self.last_poll or self.started
+    if now - last_poll >= self.policy.window:
+      return ("no successful poll for %ds, Compute does not respond" %
+              (now - last_poll))
+
+    rate = self.rate()
+    if rate is None:
+      return None
+
+    fraction = self.policy.fraction
+    if self.average and rate < fraction * self.average:
+      return ("age rate %.3g/s over the last %ds, below %g of its moving "
+              "average %.3g/s" % (rate, self.policy.window, fraction,
+                                  self.average))
+    if self.baseline and rate < fraction * self.baseline:
+      return ("age rate %.3g/s over the last %ds, below %g of the baseline "
+              "%.3g/s of previous runs" % (rate, self.policy.window,
+                                           fraction, self.baseline))
+    return None
+
+
+class AgeRateHistory:
+  """
+  The age rates of previous runs, per experiment, kept in a JSON file. The
+  baseline of an experiment is the median of its last 'keep' rates.
+  """
+
+  def __init__(self, filepath, keep=10):
+    self.filepath = filepath
+    self.keep = keep
+    self._lock = threading.Lock()
+    self._rates = None
+
+  def _load(self):
+    if self._rates is not None:
+      return self._rates
+
+    self._rates = {}
+    if os.path.exists(self.filepath):
+      try:
+        with open(self.filepath) as history_file:
+          self._rates = json.load(history_file)
+      except (OSError, ValueError) as e:
+        logging.warning("Could not read the age rate history %s: %s",
+                        self.filepath, e)
+    return self._rates
+
+  def baseline(self, key):
+    """The baseline age rate of experiment 'key', None if never run."""
+    with self._lock:
+      rates = sorted(self._load().get(key, []))
+    if not rates:
+      return None
+
+    middle = len(rates) // 2
+    if len(rates) % 2:
+      return rates[middle]
+    return (rates[middle - 1] + rates[middle]) / 2.0
+
+  def record(self, key, rate):
+    """Add the age rate of a completed run of experiment 'key'."""
+    if not rate:
+      return
+
+    with self._lock:
+      rates = self._load()
+      rates[key] = (rates.get(key, []) + [rate])[-self.keep:]
+
+      try:
+        with open(self.filepath + '.tmp', 'w') as history_file:
+          json.dump(rates, history_file, indent=2, sort_keys=True)
+        os.replace(self.filepath + '.tmp', self.filepath)
+      except OSError as e:
+        logging.warning("Could not write the age rate history %s: %s",
+                        self.filepath, e)
@@ -0,0 +1,206 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""SweepJournal class, a crash safe record of the progress of a sweep."""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+
+class SetState:
+  """The last attempt at a parameter set: its prefix and completed stages."""
+
+  __slots__ = ('key', 'index', 'prefix', 'params', 'stages')
+
+  def __init__(self, key, index, prefix, params):
+    self.key = key
+    self.index = index
+    self.prefix = prefix
+    self.params = params
+    self.stages = set()
+
+  def is_complete(self, stages):
+    return set(stages) <= self.stages
+
+
+class SweepJournal:
+  """
+  Append-only journal (JSON lines) of the parameter sets of a sweep: when
+  each set starts (its key in the plan, index, parameters and prefix), and
+  each stage it completes (imported, ran, exported, uploaded). Every record
+  is flushed and fsync'd before the sweep moves on, so the journal survives
+  a crash of run-framework or of the machine.
+
+  A session that does not resume starts the journal afresh (with a
+  'session' record); a resumed session reads the state of every set from
+  the journal, and appends to it. The experiments file is fingerprinted, so
+  that a sweep is not resumed against a different plan.
+  """
+
+  def __init__(self, filepath, exps_filepath, resume=False):
+    self.filepath = filepath
+    self.resumed = resume
+    self._lock = threading.Lock()
+    self._states = {}
+    self._prefix_keys = {}
+
+    exps_hash = file_hash(exps_filepath)
+    if resume:
+      journal_hash = self._load()
+      if journal_hash is not None and journal_hash != exps_hash:
+        raise Exception("The experiments file " + exps_filepath + " has "
+                        "changed since the journal " + filepath + " was "
+                        "written, the sweep cannot be resumed.")
+
+    self._file = open_for_append(filepath)
+    self._append({'event': 'session', 'time': time.time(),
+                  'exps_file': exps_filepath, 'exps_hash': exps_hash,
+                  'resume': resume})
+
+  def _load(self):
+    """Read the state of the sets, and return the experiments file hash."""
+    exps_hash = None
+    if not os.path.exists(self.filepath):
+      logging.warning("No journal at %s, nothing to resume", self.filepath)
+      return exps_hash
+
+    with open(self.filepath) as journal_file:
+      for line in journal_file:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          # a record torn by a crash
+          continue
+
+        event = record.get('event')
+        if event == 'session':
+          if not record.get('resume'):
+            self._states = {}
+            self._prefix_keys = {}
+          exps_hash = record.get('exps_hash')
+        elif event == 'set':
+          self._start(record['key'], record['index'], record['prefix'],
+                      record.get('params'))
+        elif event == 'stage':
+          state = self._states.get(self._prefix_keys.get(record['prefix']))
+          if state is not None and state.prefix == record['prefix']:
+            state.stages.add(record['stage'])
+
+    logging.info("Journal %s: %d parameter sets recorded", self.filepath,
+                 len(self._states))
+    return exps_hash
+
+  def _start(self, key, index, prefix, params):
+    self._states[key] = SetState(key, index, prefix, params)
+    self._prefix_keys[prefix] = key
+
+  def _append(self, record):
+    self._file.write(json.dumps(record) + "\n")
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def start(self, key, index, prefix, params=None):
+    """Record the start of an attempt at parameter set 'key'."""
+    with self._lock:
+      self._start(key, index, prefix, params)
+      self._append({'event': 'set', 'key': key, 'index': index,
+                    'prefix': prefix, 'params': params,
+                    'time': time.time()})
+
+  def record(self, prefix, stage):
+    """Record that the set running as 'prefix' has completed 'stage'."""
+    with self._lock:
+      state = self._states.get(self._prefix_keys.get(prefix))
+      # or a previous attempt at a set, since retried with another prefix
+      if state is None or state.prefix != prefix:
+        return
+      state.stages.add(stage)
+      self._append({'event': 'stage', 'prefix': prefix, 'stage': stage,
+                    'time': time.time()})
+
+  def state(self, key):
+    """The SetState of the last attempt at set 'key', or None."""
+    with self._lock:
+      return self._states.get(key)
+
+  def prefixes(self):
+    """The prefixes of every attempt at a set in the journal."""
+    with self._lock:
+      return set(self._prefix_keys)
+
+  def is_complete(self, key, stages):
+    state = self.state(key)
+    return state is not None and state.is_complete(stages)
+
+  def completed(self, stages):
+    """The sets that have completed 'stages', in plan order."""
+    with self._lock:
+      states = [state for state in self._states.values()
+                if state.is_complete(stages)]
+    return sorted(states, key=lambda state: state.index)
+
+  def pending(self, stages, stage):
+    """
+    The sets that have completed all of 'stages' but 'stage', e.g. exported
+    but not uploaded, in plan order.
+    """
+    before = [other for other in stages if other != stage]
+    with self._lock:
+      states = [state for state in self._states.values()
+                if state.is_complete(before) and stage not in state.stages]
+    return sorted(states, key=lambda state: state.index)
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+
+def open_for_append(filepath):
+  """
+  Open a file to append records, creating it (durably) if needed. If the
+  last record was torn by a crash, it is terminated so that the next record
+  starts on a line of its own.
+  """
+  exists = os.path.exists(filepath)
+  journal_file = open(filepath, 'a')
+
+  if not exists:
+    folder = os.path.dirname(os.path.abspath(filepath))
+    folder_fd = os.open(folder, os.O_RDONLY)
+    try:
+      os.fsync(folder_fd)
+    finally:
+      os.close(folder_fd)
+  elif os.path.getsize(filepath) > 0:
+    with open(filepath, 'rb') as existing_file:
+      existing_file.seek(-1, os.SEEK_END)
+      if existing_file.read(1) != b'\n':
+        journal_file.write("\n")
+
+  return journal_file
+
+
+def file_hash(filepath):
+  digest = hashlib.sha1()
+  with open(filepath, 'rb') as hashed_file:
+    for block in iter(lambda: hashed_file.read(1024 * 1024), b''):
+      digest.update(block)
+  return digest.hexdigest()
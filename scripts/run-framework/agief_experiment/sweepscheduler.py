@@ -0,0 +1,108 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""SweepScheduler class."""
+
+import queue
+import itertools
+import logging
+import traceback
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+# index: position of the parameter set in the plan
+# prefix: the prefix of the run
+# compute_node: the Compute that ran the parameter set
+# failed: True if the parameter set failed
+# error: the exception that escaped the run, if any
+SweepResult = collections.namedtuple(
+    'SweepResult', ['index', 'prefix', 'compute_node', 'failed', 'error'])
+
+
+class SweepScheduler:
+  """
+  Dispatch parameter sets to whichever Compute node in a pool is free.
+
+  Parameter sets are pulled from the plan only when a node becomes free, so
+  that input files are generated just ahead of the run that uses them.
+  """
+
+  def __init__(self, compute_nodes):
+    if not compute_nodes:
+      raise ValueError("ERROR: the sweep scheduler needs at least one "
+                       "Compute node.")
+
+    self.compute_nodes = compute_nodes
+    self.free_nodes = queue.Queue()
+    for compute_node in compute_nodes:
+      self.free_nodes.put(compute_node)
+
+  def run(self, parameter_sets, run_parameterset):
+    """
+    Run every parameter set, each one on the next free Compute node.
+
+    :param parameter_sets: iterable of parameter sets (dicts with a 'prefix')
+    :param run_parameterset: callable(compute_node, parameter_set), returns
+                             False if the parameter set failed
+    :return: list of SweepResult, in plan order
+    """
+    futures = []
+    parameter_sets = iter(parameter_sets)
+    with ThreadPoolExecutor(max_workers=len(self.compute_nodes)) as executor:
+      for index in itertools.count():
+        # block until a node is free, before planning the next set (a
+        # generator creates the prefix and input files of the set when it
+        # is pulled)
+        compute_node = self.free_nodes.get()
+        parameter_set = next(parameter_sets, None)
+        if parameter_set is None:
+          self.free_nodes.put(compute_node)
+          break
+
+        futures.append(executor.submit(self._run, index, parameter_set,
+                                       compute_node, run_parameterset))
+
+    return [future.result() for future in futures]
+
+  def _run(self, index, parameter_set, compute_node, run_parameterset):
+    failed = True
+    error = None
+    try:
+      failed = not run_parameterset(compute_node, parameter_set)
+    except Exception as e:  # pylint: disable=W0703
+      error = e
+      logging.error("Parameter set %d (prefix = %s) failed on %s",
+                    index, parameter_set['prefix'], compute_node.base_url())
+      logging.error(traceback.format_exc())
+    finally:
+      self.free_nodes.put(compute_node)
+
+    return SweepResult(index, parameter_set['prefix'], compute_node, failed,
+                       error)
+
+  @staticmethod
+  def summary(results):
+    """Return a printable summary of the results, one line per set."""
+    message = "\n....... Sweep results\n"
+    for result in results:
+      status = "FAILED" if result.failed else "ok"
+      message += "  [%d] %s on %s: %s" % (result.index, result.prefix,
+                                          result.compute_node.base_url(),
+                                          status)
+      if result.error is not None:
+        message += " (" + str(result.error) + ")"
+      message += "\n"
+    return message
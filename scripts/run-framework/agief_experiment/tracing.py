@@ -0,0 +1,268 @@
+# Copyright (C) 2018 Project AGI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Tracer class, nested timing spans of the stages of a session."""
+
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import contextlib
+
+
+class NullSpan:
+  """The span returned while tracing is disabled, it does nothing."""
+
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    return False
+
+  def tag(self, **tags):
+    pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+  """A timed stage, nested in the span that was open when it started."""
+
+  __slots__ = ('name', 'tags', 'start', 'parent', 'depth', 'span_id')
+
+  def __init__(self, name, tags):
+    self.name = name
+    self.tags = tags
+    self.start = None
+    self.parent = None
+    self.depth = 0
+    self.span_id = None
+
+  def __enter__(self):
+    stack = Tracer.stack()
+    if stack:
+      self.parent = stack[-1].span_id
+      self.depth = len(stack)
+    self.span_id = Tracer.next_id()
+    stack.append(self)
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, exc_traceback):
+    end = time.time()
+    stack = Tracer.stack()
+    if stack and stack[-1] is self:
+      stack.pop()
+    if exc_type is not None:
+      self.tags['error'] = exc_type.__name__
+    Tracer.record(self, end)
+    return False
+
+  def tag(self, **tags):
+    """Add tags to the span, e.g. results only known at the end."""
+    self.tags.update(tags)
+
+
+class Tracer:
+  """
+  Records nested timing spans of the stages of a session (e.g. sync,
+  launch, import, run, export, upload), tagged with the prefix and the
+  parameter set they belong to:
+
+    with Tracer.span('import', files=3):
+      ...
+
+    @Tracer.traced('compute.run')
+    def run_experiment(self, ...):
+
+  Each span is appended to a JSONL file as it ends, and all of them are
+  written as a Chrome trace (for chrome://tracing or Perfetto) by close().
+  Spans nest per thread. Tags set with context() apply to the spans started
+  by the same thread, within the 'with' block.
+
+  Listeners (e.g. Metrics) added with add_listener() are called with the
+  record of each span as it ends.
+
+  Tracing is disabled until start() is called or a listener is added; until
+  then span() returns a shared no-op span and traced functions are called
+  directly.
+  """
+
+  enabled = False
+
+  _lock = threading.Lock()
+  _local = threading.local()
+  _jsonl_file = None
+  _chrome_filepath = None
+  _records = []
+  _last_id = 0
+  _thread_names = {}
+  _listeners = []
+
+  @classmethod
+  def start(cls, jsonl_filepath=None, chrome_filepath=None):
+    """Enable tracing, to a JSONL file and/or a Chrome trace file."""
+    with cls._lock:
+      if jsonl_filepath:
+        cls._jsonl_file = open_for_write(jsonl_filepath)
+      cls._chrome_filepath = chrome_filepath
+      cls._records = []
+      cls.enabled = bool(jsonl_filepath or chrome_filepath or
+                         cls._listeners)
+
+  @classmethod
+  def close(cls):
+    """Write the Chrome trace (if any), and stop writing spans."""
+    with cls._lock:
+      if not cls.enabled:
+        return
+      cls.enabled = bool(cls._listeners)
+
+      if cls._jsonl_file is not None:
+        cls._jsonl_file.close()
+        logging.info("Trace spans written to %s", cls._jsonl_file.name)
+        cls._jsonl_file = None
+
+      if cls._chrome_filepath:
+        write_chrome_trace(cls._chrome_filepath, cls._records,
+                           cls._thread_names)
+        logging.info("Chrome trace written to %s", cls._chrome_filepath)
+        cls._chrome_filepath = None
+      cls._records = []
+
+  @classmethod
+  def add_listener(cls, listener):
+    """Call 'listener' with the record of each span, and enable tracing."""
+    with cls._lock:
+      cls._listeners = cls._listeners + [listener]
+      cls.enabled = True
+
+  @classmethod
+  def remove_listener(cls, listener):
+    with cls._lock:
+      cls._listeners = [other for other in cls._listeners
+                        if other != listener]
+      cls.enabled = bool(cls._jsonl_file is not None or
+                         cls._chrome_filepath or cls._listeners)
+
+  @classmethod
+  def span(cls, name, **tags):
+    """A span (to use in a 'with' block), or a no-op if disabled."""
+    if not cls.enabled:
+      return NULL_SPAN
+
+    context = getattr(cls._local, 'context', None)
+    if context:
+      tags = dict(context, **tags)
+    return Span(name, tags)
+
+  @classmethod
+  def traced(cls, name):
+    """Decorator, to run each call of a function in a span 'name'."""
+    def decorator(fn):
+      @functools.wraps(fn)
+      def wrapper(*args, **kwargs):
+        if not cls.enabled:
+          return fn(*args, **kwargs)
+        with cls.span(name):
+          return fn(*args, **kwargs)
+      return wrapper
+    return decorator
+
+  @classmethod
+  @contextlib.contextmanager
+  def context(cls, **tags):
+    """Tag the spans started by this thread within the 'with' block."""
+    previous = getattr(cls._local, 'context', None)
+    cls._local.context = dict(previous or {}, **tags)
+    try:
+      yield
+    finally:
+      cls._local.context = previous
+
+  @classmethod
+  def stack(cls):
+    stack = getattr(cls._local, 'stack', None)
+    if stack is None:
+      stack = []
+      cls._local.stack = stack
+    return stack
+
+  @classmethod
+  def next_id(cls):
+    with cls._lock:
+      cls._last_id += 1
+      return cls._last_id
+
+  @classmethod
+  def record(cls, span, end):
+    thread = threading.current_thread()
+    record = {'name': span.name, 'id': span.span_id, 'parent': span.parent,
+              'depth': span.depth, 'start': span.start,
+              'duration': end - span.start, 'pid': os.getpid(),
+              'tid': thread.ident, 'tags': span.tags}
+
+    with cls._lock:
+      if not cls.enabled:
+        return
+      cls._thread_names[thread.ident] = thread.name
+      if cls._jsonl_file is not None:
+        cls._jsonl_file.write(json.dumps(record, default=str) + '\n')
+        cls._jsonl_file.flush()
+      if cls._chrome_filepath:
+        cls._records.append(record)
+      listeners = cls._listeners
+
+    for listener in listeners:
+      listener(record)
+
+
+def open_for_write(filepath):
+  folder = os.path.dirname(os.path.abspath(filepath))
+  if not os.path.isdir(folder):
+    os.makedirs(folder)
+  return open(filepath, 'w')
+
+
+def chrome_trace(records, thread_names=None):
+  """
+  The Chrome trace event format of span records: a complete event ('X')
+  per span, in microseconds since the first span started.
+  """
+  origin = min([record['start'] for record in records] or [0])
+
+  events = []
+  for record in records:
+    events.append({'name': record['name'], 'cat': record['name'].split('.')[0],
+                   'ph': 'X', 'ts': (record['start'] - origin) * 1e6,
+                   'dur': record['duration'] * 1e6, 'pid': record['pid'],
+                   'tid': record['tid'], 'args': record['tags']})
+
+  for tid, name in (thread_names or {}).items():
+    events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                   'tid': tid, 'args': {'name': name}})
+
+  return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(filepath, records, thread_names=None):
+  with open_for_write(filepath + '.tmp') as trace_file:
+    json.dump(chrome_trace(records, thread_names), trace_file, default=str)
+  os.replace(filepath + '.tmp', filepath)
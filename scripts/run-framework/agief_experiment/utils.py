@@ -22,16 +22,18 @@ import errno
 import zipfile
 import fileinput
 import sys
-import time
 import logging
 import datetime
-import itertools
-import select
-import socket
-import io
+import collections
+import shutil
 
 import paramiko
 
+from agief_experiment import remotecommand
+from agief_experiment.remotecommand import RemoteCommand
+from agief_experiment.retry import Retry, RetryPolicy
+from agief_experiment.tracing import Tracer
+
 
 def restart_line():
   sys.stdout.write('\r')
@@ -47,6 +49,94 @@ def replace_in_file(src_string, dest_string, file_path):
   f.close()
 
 
+# chunk size for streaming file operations
+FILE_CHUNK_SIZE = 4 * 1024 * 1024
+
+# ioctl request to clone a file (reflink) on Linux filesystems that support it
+FICLONE = 0x40049409
+
+
+def file_contains(file_path, text, chunk_size=FILE_CHUNK_SIZE):
+  """
+  Return True if the file contains 'text', reading it in chunks.
+  """
+  needle = text.encode('utf-8')
+  overlap = len(needle) - 1
+
+  with open(file_path, 'rb') as f:
+    previous = b''
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        return False
+      window = previous + chunk
+      if needle in window:
+        return True
+      previous = window[max(len(window) - overlap, 0):] if overlap else b''
+
+
+def render_file(src_path, dest_path, src_string, dest_string,
+                chunk_size=FILE_CHUNK_SIZE):
+  """
+  Write a copy of 'src_path' to 'dest_path', with every occurrence of
+  'src_string' replaced by 'dest_string', in a single streaming pass.
+  """
+  old = src_string.encode('utf-8')
+  new = dest_string.encode('utf-8')
+  keep = len(old) - 1
+
+  with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+    pending = b''
+    while True:
+      chunk = src.read(chunk_size)
+      if not chunk:
+        break
+
+      # hold back the end of the buffer, it may be the start of a match
+      parts = (pending + chunk).split(old)
+      tail = parts[-1]
+      split = max(len(tail) - keep, 0)
+      parts[-1] = tail[:split]
+      dest.write(new.join(parts))
+      pending = tail[split:]
+
+    dest.write(pending)
+
+
+def link_or_copy_file(src_path, dest_path):
+  """
+  Make 'dest_path' have the same contents as 'src_path', as cheaply as
+  possible: a reflink if the filesystem supports it, otherwise a hard link,
+  otherwise a copy.
+
+  A reflink or copy keeps the mtime of 'src_path', as a link does, so that
+  files with the same content can be recognised from their stat.
+
+  NOTE: with a hard link, 'dest_path' must only be replaced (never modified
+  in place), or 'src_path' would be modified too.
+  :return: 'reflink', 'link' or 'copy'
+  """
+  remove_file(dest_path, silent=True)
+
+  try:
+    import fcntl
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+      fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dest_path)
+    return 'reflink'
+  except (ImportError, IOError, OSError):
+    remove_file(dest_path, silent=True)
+
+  try:
+    os.link(src_path, dest_path)
+    return 'link'
+  except OSError:
+    pass
+
+  shutil.copy2(src_path, dest_path)
+  return 'copy'
+
+
 def create_folder(filepath):
   if not os.path.exists(os.path.dirname(filepath)):
     try:
@@ -69,7 +159,8 @@ def getbaseurl(host, port):
 def filepath_from_env_variable(filename, path_env):
   cmd = "echo $" + path_env
   output, _ = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                               executable="/bin/bash").communicate()
+                               executable="/bin/bash",
+                               universal_newlines=True).communicate()
 
   file_path = cleanpath(output, filename)
   return file_path
@@ -90,15 +181,18 @@ def cleanpath(path, filename):
 def run_bashscript_repeat(cmd, max_repeats, wait_period):
   """
   Run a shell command repeatedly until exit status shows success.
-  Run command 'cmd' a maximum of 'max_repeats' times and
-  wait 'wait_period' between attempts.
+  Run command 'cmd' a maximum of 'max_repeats' times, backing off
+  exponentially (with jitter) from a second up to 2 x 'wait_period'
+  between attempts.
   """
 
   logging.debug("running cmd = %s", str(cmd))
 
   success = False
   exit_status = 0
-  for i in range(1, max_repeats + 1):
+  retry = Retry(RetryPolicy.from_repeats(max_repeats, wait_period),
+                'bash-script')
+  for i in retry:
     child = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                              executable="/bin/bash")
 
@@ -118,9 +212,6 @@ def run_bashscript_repeat(cmd, max_repeats, wait_period):
       break
 
     logging.warning("Run bash script was unsuccessful on attempt %s", str(i))
-    logging.debug("Wait %ss, and try again.", str(wait_period))
-
-    time.sleep(wait_period)
 
   if not success:
     msg = "ERROR: was not able run shell command: " + cmd + "\n"
@@ -348,106 +439,37 @@ def docker_stop(container_id=None):
   return exit_status
 
 
-def remote_run(host_node, cmd, timeout=3600, max_repeats=15, wait_period=5):
+def remote_run(host_node, cmd, timeout=3600, max_repeats=15, wait_period=5,
+               history=1000):
   """
   Runs a set of commands on a remote machine over SSH using paramiko.
+  The command runs on a new channel of the host's pooled SSH connection.
+  stdout and stderr are echoed, and the last 'history' chunks of stdout are
+  returned as a list once the command exits. For long running commands, use
+  RemoteCommand to handle lines as they arrive instead.
 
   :param host_node: HostNode object
   :param cmd: The commands to be executed
   """
-  stdout_chunks = []
-  exit_status_code = -1
+  stdout_chunks = collections.deque(maxlen=history)
 
-  client = paramiko.SSHClient()
-  client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-  # Connect to remote machine using HostNode details
-  for _ in range(1, max_repeats + 1):
+  command = RemoteCommand(host_node, cmd, timeout, max_repeats=max_repeats,
+                          wait_period=wait_period)
+  with Tracer.span('remote-run', host=host_node.host, cmd=cmd[:200]):
     try:
-      client.connect(host_node.host, username=host_node.user,
-                    key_filename=host_node.keypath, port=int(host_node.ssh_port))
-      client.get_transport().set_keepalive(60)
-      break
-    except (paramiko.ssh_exception.BadHostKeyException,
-            paramiko.ssh_exception.AuthenticationException,
-            paramiko.ssh_exception.SSHException,
-            paramiko.ssh_exception.socket.error):
-      time.sleep(wait_period)
-
-  try:
-    logging.debug("Executing command remotely = %s", cmd)
-
-    # Execute command and the capture output
-    stdin, stdout, stderr = client.exec_command(cmd, get_pty=True, environment={
-        'LC_ALL': 'C.UTF-8',
-        'LANG': 'C.UTF-8'
-    })
-  except paramiko.ssh_exception.SSHException:
-    exit_status_code = 1
-    client.close()
-  else:
-    # Get the shared channel for stdout/stderr/stdin
-    channel = stdout.channel
-
-    # stdin is not used
-    stdin.close()
-
-    # Indicate that we're not going to write to that channel anymore
-    channel.shutdown_write()
-    channel.settimeout(timeout)
-
-    # Read stdout/stderr in order to prevent read block hangs
-    output = stdout.channel.recv(len(stdout.channel.in_buffer)).decode('utf-8')
-    stdout_chunks.append(output)
-    sys.stdout.write(output)
-
-    # Chunked read to prevent stalls
-    logging.debug('Reading from remote...')
-    while not channel.closed or channel.recv_ready() or channel.recv_stderr_ready():
-      # stop if channel was closed prematurely, and there is no data in the buffers.
-      got_chunk = False
-      readq, _, _ = select.select([stdout.channel], [], [], timeout)
-      for c in readq:
-        if c.recv_ready():
-          output = stdout.channel.recv(len(c.in_buffer)).decode('utf-8')
-          stdout_chunks.append(output)
-          sys.stdout.write(output)
-          got_chunk = True
-        if c.recv_stderr_ready():
-          # Make sure to read stderr to prevent stall
-          stderr.channel.recv_stderr(len(c.in_stderr_buffer))
-          got_chunk = True
-
-      if not got_chunk \
-          and stdout.channel.exit_status_ready() \
-          and not stderr.channel.recv_stderr_ready() \
-          and not stdout.channel.recv_ready():
-        # Indicate that we're not going to read from this channel anymore
-        stdout.channel.shutdown_read()
-
-        # Close the channel
-        stdout.channel.close()
-
-        # Exit as remote side is finished and our buffers are empty
-        logging.debug('Output buffers are empty. Exiting...')
-        break
-
-    # Close all the pseudofiles
-    stdout.close()
-    stderr.close()
-
-    # Get the exit status code
-    logging.debug('Waiting for exit status code...')
-    exit_status_code = stdout.channel.recv_exit_status()
-    logging.debug('Exit status code received: %s', str(exit_status_code))
-
-    # Close the client
-    client.close()
-
-  if exit_status_code > 0:
-    raise ValueError('SSH connection closed with exit status code: ' + str(exit_status_code))
-
-  return stdout_chunks
+      for stream, text in command.chunks():
+        if stream == remotecommand.STDOUT:
+          stdout_chunks.append(text)
+          sys.stdout.write(text)
+        else:
+          sys.stderr.write(text)
+    except paramiko.ssh_exception.SSHException:
+      logging.error("SSH command failed on %s: %s", host_node.host, cmd)
+      command.exit_status = 1
+
+    command.check_exit_status()
+
+  return list(stdout_chunks)
 
 
 def logger_level(level):
@@ -0,0 +1,465 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+
+from agief_experiment.compute import Compute
+from agief_experiment.experiment import Experiment
+from agief_experiment.experimentutils import ExperimentUtils
+from agief_experiment import utils
+
+HELP_GENERIC = """
+benchmark-files.py times the file-side hot paths of run-framework (preparing
+the input files of a parameter set, and packaging its results), on synthetic
+entity, data and log files of each of the given sizes:
+
+  create_input_files        ExperimentUtils.create_input_files (entity and
+                            data file)
+  replace_in_file           utils.replace_in_file (entity file)
+  set_parameter_inputfile   Compute.set_parameter_inputfile (entity file)
+  compress_files            utils.compress_files (data file)
+  compress_folder_contents  utils.compress_folder_contents (8 data files)
+  match_file_by_name        utils.match_file_by_name (a tree of empty files,
+                            one per 10 KB of the size)
+  parse_results             results_parser.parse_results (console log)
+
+Each case runs in a fresh process, and reports the wall time, the peak RSS,
+and the bytes read and written (from /proc/self/io, on Linux). Results are
+saved as JSON, with the commit they were measured at, and --compare prints
+the ratios to an earlier results file, e.g.:
+
+  python benchmark-files.py --sizes 1MB,100MB --json before.json
+  (make changes)
+  python benchmark-files.py --sizes 1MB,100MB --compare before.json
+"""
+
+CASES = ['create_input_files', 'replace_in_file', 'set_parameter_inputfile',
+         'compress_files', 'compress_folder_contents', 'match_file_by_name',
+         'parse_results']
+
+SIZE_UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+ENTITY_WEIGHTS = 160
+DATA_ITEM_SIZE = 1024 * 1024
+FOLDER_FILES = 8
+MATCH_FILE_SPACING = 10 * 1024
+MATCH_FOLDER_FILES = 100
+
+
+def setup_arg_parsing():
+    parser = argparse.ArgumentParser(
+        description=HELP_GENERIC,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--sizes', dest='sizes',
+                        help='Comma separated sizes of the synthetic files '
+                             '(default=%(default)s).')
+    parser.add_argument('--cases', dest='cases',
+                        help='Comma separated cases to run, of: ' +
+                             ', '.join(CASES) + ' (default=all).')
+    parser.add_argument('--repeats', dest='repeats', type=int,
+                        help='Runs of each case, the one with the median '
+                             'wall time is reported (default=%(default)s).')
+    parser.add_argument('--folder', dest='folder',
+                        help='Folder for the synthetic files, which are '
+                             'kept and reused if given (default=a temporary '
+                             'folder, removed at the end).')
+    parser.add_argument('--json', dest='json_filepath',
+                        help='Write the results to this JSON file '
+                             '(default=benchmark-files-COMMIT.json).')
+    parser.add_argument('--compare', dest='compare_filepath',
+                        help='Print the ratios to the results in this JSON '
+                             'file.')
+
+    # used to run one case in a fresh process
+    parser.add_argument('--run_case', dest='run_case', help=argparse.SUPPRESS)
+    parser.add_argument('--size', dest='size', type=int,
+                        help=argparse.SUPPRESS)
+
+    parser.set_defaults(sizes='1MB,100MB,1GB')
+    parser.set_defaults(cases=','.join(CASES))
+    parser.set_defaults(repeats=3)
+
+    return parser.parse_args()
+
+
+def parse_size(size):
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * multiplier)
+    return int(size)
+
+
+def format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return "%d%s" % (size // SIZE_UNITS[unit], unit)
+    return str(size)
+
+
+# ------------------------------------------------------------------------------
+# synthetic files
+
+def size_folder(folder, size):
+    return os.path.join(folder, format_size(size))
+
+
+def create_files(folder, size):
+    """
+    Create the synthetic files of 'size' in their own subfolder of 'folder',
+    unless they already exist.
+    """
+    files_folder = size_folder(folder, size)
+    done_filepath = os.path.join(files_folder, '.done')
+    if os.path.isfile(done_filepath):
+        return
+
+    print("Creating %s synthetic files in %s" % (format_size(size),
+                                                 files_folder))
+    shutil.rmtree(files_folder, ignore_errors=True)
+    input_folder = os.path.join(files_folder, 'exp', 'input')
+    os.makedirs(input_folder)
+
+    with open(os.path.join(files_folder, 'variables.sh'), 'w') as variables:
+        variables.write("export AGI_EXP_HOME=%s\n" %
+                        os.path.join(files_folder, 'exp'))
+
+    write_entity_file(os.path.join(input_folder, 'entity.json'), size)
+    write_data_file(os.path.join(input_folder, 'data.json'), size)
+
+    results_folder = os.path.join(files_folder, 'results')
+    os.makedirs(results_folder)
+    for i in range(FOLDER_FILES):
+        write_data_file(os.path.join(results_folder, 'data-%d.json' % i),
+                        size // FOLDER_FILES)
+
+    write_match_tree(os.path.join(files_folder, 'tree'),
+                     max(size // MATCH_FILE_SPACING, 1))
+    write_console_log(os.path.join(files_folder, 'console.log'), size)
+
+    open(done_filepath, 'w').close()
+
+
+def write_entity_file(filepath, size):
+    """An entity file of about 'size' bytes, of ~1 KB entities."""
+    prefix = Experiment.TEMPLATE_PREFIX + Experiment.PREFIX_DELIMITER
+
+    with open(filepath, 'w') as entity_file:
+        entity_file.write('[')
+        written = 2
+        i = 0
+        while i < 2 or written < size:
+            name = prefix + ('experiment' if i == 0 else 'entity-%d' % i)
+            parent = 'null' if i == 0 else prefix + 'experiment'
+            config = {'age': 0, 'learningRate': 0.1, 'terminationAge': 100,
+                      'input': prefix + 'entity-%d-output' % max(i - 1, 0),
+                      'weights': [0.5] * ENTITY_WEIGHTS}
+            text = json.dumps({'name': name, 'type': 'model', 'node': 'node',
+                               'parent': parent, 'config': json.dumps(config)})
+            if i > 0:
+                text = ',' + text
+            entity_file.write(text)
+            written += len(text)
+            i += 1
+        entity_file.write(']')
+
+
+def write_data_file(filepath, size):
+    """A data file of about 'size' bytes, of data items up to 1 MB."""
+    prefix = Experiment.TEMPLATE_PREFIX + Experiment.PREFIX_DELIMITER
+    count = max(size // DATA_ITEM_SIZE, 1)
+    item_size = max(size // count - 100, 1)
+    elements = ('0.12345,' * (item_size // 8 + 1))[:item_size]
+
+    with open(filepath, 'w') as data_file:
+        data_file.write('[')
+        for i in range(count):
+            if i > 0:
+                data_file.write(',')
+            json.dump({'name': prefix + 'entity-%d-output' % i,
+                       'sizes': '[%d]' % item_size, 'elements': elements,
+                       'refKeys': 'null'}, data_file)
+        data_file.write(']')
+
+
+def write_match_tree(folder, count):
+    """A tree of 'count' empty files, the one to match is last."""
+    for i in range(count):
+        subfolder = os.path.join(folder, 'dir-%d' % (i // MATCH_FOLDER_FILES))
+        if i % MATCH_FOLDER_FILES == 0:
+            os.makedirs(subfolder)
+        name = 'match-me.json' if i == count - 1 else 'file-%d.json' % i
+        open(os.path.join(subfolder, name), 'w').close()
+
+
+def write_console_log(filepath, size):
+    """A console log as parsed by results_parser, of about 'size' bytes."""
+    phase1 = ("==============================================\n"
+              "Experiment Information\n"
+              "==============================================\n"
+              "Prefix: 170101-0000\n"
+              "....... Launch Compute\n")
+    block = ("==============================================\n"
+             "Experiment Information\n"
+             "Dataset from phase 1 experiment prefix 170101-0000\n"
+             "Prefix: 170101-%04d\n"
+             "....... Launch Compute\n"
+             "Errors:\n"
+             "  0 1 2 3 4 5 6 7 8 9\n"
+             "  = 97.5%% correct\n"
+             "F-Score:\n"
+             "  0.97 0.98 0.96\n"
+             "Overall F-Score: 0.97\n"
+             "Errors:\n"
+             "  = 95.1%% correct\n"
+             "F-Score:\n"
+             "  0.95 0.94 0.96\n"
+             "Overall F-Score: 0.95\n"
+             "-------------- RESET_PREFIX -------------\n")
+
+    with open(filepath, 'w') as log_file:
+        log_file.write(phase1 + "Phase 2\n")
+        written = len(phase1) + 8
+        i = 0
+        while written < size:
+            text = block % (i % 10000)
+            log_file.write(text)
+            written += len(text)
+            i += 1
+
+
+# ------------------------------------------------------------------------------
+# cases, each returns a function to time, after any setup
+
+def setup_case(case, files_folder):
+    input_folder = os.path.join(files_folder, 'exp', 'input')
+    entity_filepath = os.path.join(input_folder, 'entity.json')
+    data_filepath = os.path.join(input_folder, 'data.json')
+    work_folder = tempfile.mkdtemp(dir=files_folder, prefix='work-')
+
+    if case == 'create_input_files':
+        os.environ['VARIABLES_FILE'] = os.path.join(files_folder,
+                                                    'variables.sh')
+        experiment_utils = ExperimentUtils('experiments.json')
+        # resolve the variables before timing
+        experiment_utils.inputfile_base('')
+        prefix = os.path.basename(work_folder)
+        return lambda: experiment_utils.create_input_files(
+            prefix, Experiment.TEMPLATE_PREFIX, ['entity.json', 'data.json'])
+
+    if case == 'replace_in_file':
+        filepath = os.path.join(work_folder, 'entity.json')
+        shutil.copyfile(entity_filepath, filepath)
+        return lambda: utils.replace_in_file(Experiment.TEMPLATE_PREFIX,
+                                             '170101-0000', filepath)
+
+    if case == 'set_parameter_inputfile':
+        filepath = os.path.join(work_folder, 'entity.json')
+        shutil.copyfile(entity_filepath, filepath)
+        return lambda: Compute.set_parameter_inputfile(
+            filepath, Experiment.TEMPLATE_PREFIX +
+            Experiment.PREFIX_DELIMITER + 'experiment', 'learningRate', 0.5)
+
+    if case == 'compress_files':
+        return lambda: utils.compress_files(
+            os.path.join(work_folder, 'results.zip'), [data_filepath])
+
+    if case == 'compress_folder_contents':
+        results_folder = os.path.join(work_folder, 'results')
+        shutil.copytree(os.path.join(files_folder, 'results'), results_folder)
+        return lambda: utils.compress_folder_contents(results_folder)
+
+    if case == 'match_file_by_name':
+        tree_folder = os.path.join(files_folder, 'tree')
+        return lambda: utils.match_file_by_name(tree_folder, 'match-me')
+
+    if case == 'parse_results':
+        sys.path.insert(0, os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), '..', 'utils'))
+        import results_parser
+        log_filepath = os.path.join(files_folder, 'console.log')
+        return lambda: results_parser.parse_results(log_filepath)
+
+    raise ValueError("Unknown case: " + case)
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process so far, or None."""
+    try:
+        with open('/proc/self/io') as io_file:
+            counters = dict(line.split(':') for line in io_file)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def peak_rss():
+    """The peak resident set size of this process so far, in bytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_case(case, size, folder):
+    """Run one case in this process, and print its measurements as JSON."""
+    files_folder = size_folder(folder, size)
+    fn = setup_case(case, files_folder)
+
+    # the output of the functions is not part of the measurement
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        rss_before = peak_rss()
+        io_before = io_counters()
+        start = time.time()
+        fn()
+        wall = time.time() - start
+        io_after = io_counters()
+        rss_after = peak_rss()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    result = {'case': case, 'size': size, 'wall_seconds': wall,
+              'peak_rss_bytes': rss_after, 'rss_before_bytes': rss_before,
+              'bytes_read': None, 'bytes_written': None}
+    if io_before and io_after:
+        result['bytes_read'] = io_after[0] - io_before[0]
+        result['bytes_written'] = io_after[1] - io_before[1]
+
+    print(json.dumps(result))
+
+
+def measure(case, size, folder):
+    """Run one case in a fresh process, and return its measurements."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--run_case', case,
+           '--size', str(size), '--folder', folder]
+    output = subprocess.check_output(cmd, universal_newlines=True)
+    result = json.loads(output.strip().splitlines()[-1])
+
+    # discard the files written (input files are created in a folder named
+    # as the work folder, used as the prefix), for the next run
+    files_folder = size_folder(folder, size)
+    input_folder = os.path.join(files_folder, 'exp', 'input')
+    for parent in (files_folder, input_folder):
+        for name in os.listdir(parent):
+            if name.startswith('work-'):
+                shutil.rmtree(os.path.join(parent, name))
+    return result
+
+
+# ------------------------------------------------------------------------------
+# reporting
+
+def format_bytes(value):
+    if value is None:
+        return 'n/a'
+    for unit in ('GB', 'MB', 'KB'):
+        if value >= SIZE_UNITS[unit]:
+            return "%.1f%s" % (value / float(SIZE_UNITS[unit]), unit)
+    return "%dB" % value
+
+
+def print_results(results, baseline=None):
+    baseline_index = {}
+    if baseline:
+        baseline_index = {(r['case'], r['size']): r
+                          for r in baseline['results']}
+
+    print("\n%-26s %6s %10s %10s %10s %10s %s" % (
+        'case', 'size', 'wall (s)', 'peak RSS', 'read', 'written',
+        'vs baseline' if baseline else ''))
+    for result in results:
+        comparison = ''
+        previous = baseline_index.get((result['case'], result['size']))
+        if previous:
+            comparison = "x%.2f time, x%.2f RSS" % (
+                result['wall_seconds'] / max(previous['wall_seconds'], 1e-9),
+                result['peak_rss_bytes'] / float(
+                    max(previous['peak_rss_bytes'], 1)))
+        print("%-26s %6s %10.3f %10s %10s %10s %s" % (
+            result['case'], format_size(result['size']),
+            result['wall_seconds'], format_bytes(result['peak_rss_bytes']),
+            format_bytes(result['bytes_read']),
+            format_bytes(result['bytes_written']), comparison))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    args = setup_arg_parsing()
+
+    # the warnings of the functions measured are not of interest
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=logging.ERROR if args.run_case
+                        else logging.WARNING)
+
+    if args.run_case:
+        run_case(args.run_case, args.size, args.folder)
+        return
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    cases = [case.strip() for case in args.cases.split(',')]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        logging.error("Unknown case(s): %s", ", ".join(sorted(unknown)))
+        exit(1)
+
+    folder = os.path.abspath(args.folder or
+                             tempfile.mkdtemp(prefix='agief-benchmark-'))
+    commit = git_commit()
+
+    results = []
+    try:
+        for size in sizes:
+            create_files(folder, size)
+            for case in cases:
+                runs = [measure(case, size, folder)
+                        for _ in range(args.repeats)]
+                runs.sort(key=lambda run: run['wall_seconds'])
+                result = runs[len(runs) // 2]
+                print("  %-26s %6s %8.3fs" % (case, format_size(size),
+                                              result['wall_seconds']))
+                results.append(result)
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    baseline = None
+    if args.compare_filepath:
+        with open(args.compare_filepath) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\nCompared to commit %s (%s)" % (baseline.get('commit'),
+                                               args.compare_filepath))
+    print_results(results, baseline)
+
+    json_filepath = args.json_filepath or 'benchmark-files-%s.json' % commit
+    with open(json_filepath, 'w') as json_file:
+        json.dump({'commit': commit,
+                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'machine': platform.platform(),
+                   'repeats': args.repeats,
+                   'results': results}, json_file, indent=2)
+    print("\nResults written to " + json_filepath)
+
+
+if __name__ == '__main__':
+    main()
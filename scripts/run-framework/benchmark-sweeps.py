@@ -0,0 +1,326 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+from agief_experiment.computeemulator import ComputeEmulator
+from agief_experiment.experiment import Experiment
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+HELP_GENERIC = """
+benchmark-sweeps.py measures the overhead of run-framework.py itself, per
+parameter set, apart from the time spent computing in Compute.
+
+A synthetic experiment (entity file, data file and experiments file with a
+sweep of --sets values) is created in a temporary folder, and run-framework.py
+is run against a local Compute emulator (see compute-emulator.py). For each
+run, the wall time, the emulated compute time, and the calls and bytes per
+endpoint of the Compute REST API are reported per parameter set.
+
+run-framework.py uploads the prefix history to S3 at the end of a sweep. If
+moto[server] is installed, it goes to a local moto S3 server, otherwise S3
+credentials (or AGI_S3_ENDPOINT_URL) must be set in the environment.
+
+Arguments after '--' are passed on to run-framework.py, e.g. to compare:
+  python benchmark-sweeps.py --sets 20 --latency 0.1
+  python benchmark-sweeps.py --sets 20 --latency 0.1 -- --fold_params
+"""
+
+DATASET_NAME = 'dataset'
+
+
+def setup_arg_parsing():
+    parser = argparse.ArgumentParser(
+        description=HELP_GENERIC,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--sets', dest='sets', type=int,
+                        help='Number of parameter sets in the sweep '
+                             '(default=%(default)s).')
+    parser.add_argument('--repeats', dest='repeats', type=int,
+                        help='Number of times to run the sweep, the median '
+                             'is reported (default=%(default)s).')
+    parser.add_argument('--entities', dest='entities', type=int,
+                        help='Number of entities under the experiment '
+                             'entity (default=%(default)s).')
+    parser.add_argument('--data_size', dest='data_size', type=int,
+                        help='Bytes of data in the data file, which is '
+                             'rendered for each parameter set '
+                             '(default=%(default)s).')
+    parser.add_argument('--dataset_size', dest='dataset_size', type=int,
+                        help='Bytes of data in a second data file without '
+                             'the template prefix, as a dataset shared by '
+                             'all the parameter sets (default=%(default)s).')
+    parser.add_argument('--termination_age', dest='termination_age',
+                        type=int,
+                        help='terminationAge of the experiment '
+                             '(default=%(default)s).')
+    parser.add_argument('--age_rate', dest='age_rate', type=float,
+                        help='Ages per second in the emulator '
+                             '(default=%(default)s).')
+    parser.add_argument('--latency', dest='latency', type=float,
+                        help='Seconds added by the emulator to every request '
+                             '(default=%(default)s).')
+    parser.add_argument('--export_size', dest='export_size', type=int,
+                        help='Bytes the emulator pads data exports to '
+                             '(default=%(default)s).')
+    parser.add_argument('--no_export', dest='export', action='store_false',
+                        help='Do not export the results of each set.')
+    parser.add_argument('--json', dest='json_filepath',
+                        help='Also write the results to this JSON file.')
+    parser.add_argument('--keep', dest='keep', action='store_true',
+                        help='Keep the temporary experiment folder.')
+    parser.add_argument('run_framework_args', nargs=argparse.REMAINDER,
+                        help='Arguments for run-framework.py, after --')
+
+    parser.set_defaults(sets=10)
+    parser.set_defaults(repeats=1)
+    parser.set_defaults(entities=10)
+    parser.set_defaults(data_size=100000)
+    parser.set_defaults(dataset_size=0)
+    parser.set_defaults(termination_age=100)
+    parser.set_defaults(age_rate=1000.0)
+    parser.set_defaults(latency=0.0)
+    parser.set_defaults(export_size=0)
+    parser.set_defaults(export=True)
+
+    return parser.parse_args()
+
+
+def create_experiment(folder, args):
+    """
+    Create the folders, variables file, input files and experiments file of
+    a synthetic experiment in 'folder', and return the variables filepath.
+    """
+    homes = {name: os.path.join(folder, name)
+             for name in ('agi', 'run', 'exp', 'data')}
+    for home in homes.values():
+        os.makedirs(home)
+    os.makedirs(os.path.join(homes['exp'], 'input'))
+
+    variables_filepath = os.path.join(folder, 'variables.sh')
+    with open(variables_filepath, 'w') as variables_file:
+        variables_file.write(
+            "export AGI_HOME=%s\n"
+            "export AGI_RUN_HOME=%s\n"
+            "export AGI_EXP_HOME=%s\n"
+            "export AGI_DATA_HOME=%s\n"
+            "export AGI_DATA_RUN_HOME=%s\n" % (
+                homes['agi'], homes['run'], homes['exp'], homes['data'],
+                homes['data']))
+
+    prefix = Experiment.TEMPLATE_PREFIX + Experiment.PREFIX_DELIMITER
+    experiment_name = prefix + 'experiment'
+
+    entities = [{'name': experiment_name, 'type': 'experiment',
+                 'node': 'node', 'parent': 'null',
+                 'config': json.dumps({'age': 0, 'terminated': False,
+                                       'terminationAge': args.termination_age,
+                                       'reportingEntityName': 'model-0',
+                                       'reportingEntityConfigPath':
+                                           'learningRate'})}]
+    for i in range(args.entities):
+        entities.append({'name': prefix + 'model-%d' % i, 'type': 'model',
+                         'node': 'node', 'parent': experiment_name,
+                         'config': json.dumps({'age': 0, 'learningRate': 0.1,
+                                               'dataPath': '',
+                                               'outputPath': ''})})
+    input_folder = os.path.join(homes['exp'], 'input')
+    with open(os.path.join(input_folder, 'entity.json'), 'w') as entity_file:
+        json.dump(entities, entity_file)
+
+    data_filenames = ['data.json']
+    write_data_file(os.path.join(input_folder, 'data.json'),
+                    prefix + 'model-0-weights', args.data_size)
+    if args.dataset_size > 0:
+        data_filenames.append('dataset.json')
+        write_data_file(os.path.join(input_folder, 'dataset.json'),
+                        DATASET_NAME, args.dataset_size)
+
+    series = [round(0.01 * (i + 1), 4) for i in range(args.sets)]
+    experiments = {'experiments': [{
+        'import-files': {'file-entities': 'entity.json',
+                         'file-data': data_filenames},
+        'entity-parameters': [
+            {'entity-name': 'model-1' if args.entities > 1 else 'model-0',
+             'parameter-path': 'outputPath',
+             'value': 'output-' + Experiment.TEMPLATE_OUTPUT_PREFIX}],
+        'dataset-parameters': [
+            {'entity-name': 'model-0', 'parameter-path': 'dataPath',
+             'value': 'training,testing'}],
+        'parameter-sweeps': [{'parameter-set': [
+            {'entity-name': 'model-0', 'parameter-path': 'learningRate',
+             'val-series': series}]}]
+    }]}
+    with open(os.path.join(homes['exp'], 'experiments.json'),
+              'w') as exps_file:
+        json.dump(experiments, exps_file, indent=2)
+
+    return variables_filepath
+
+
+def write_data_file(filepath, name, size):
+    with open(filepath, 'w') as data_file:
+        json.dump([{'name': name, 'sizes': '[%d]' % size,
+                    'elements': 'x' * size, 'refKeys': 'null'}], data_file)
+
+
+def start_s3_server():
+    """Start a local moto S3 server, return it (None if moto is missing)."""
+    if ThreadedMotoServer is None:
+        logging.warning("moto[server] is not installed, run-framework.py will "
+                        "upload the prefix history to the S3 of the "
+                        "environment")
+        return None
+
+    s3_server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    s3_server.start()
+    return s3_server
+
+
+def s3_environment(s3_server):
+    """The environment for run-framework.py to upload to 's3_server'."""
+    if s3_server is None:
+        return {}
+
+    host, port = s3_server.get_host_and_port()
+    return {'AGI_S3_ENDPOINT_URL': 'http://%s:%d' % (host, port),
+            'AWS_ACCESS_KEY_ID': 'benchmark',
+            'AWS_SECRET_ACCESS_KEY': 'benchmark',
+            'AWS_DEFAULT_REGION': 'us-east-1'}
+
+
+def run_sweep(folder, variables_filepath, emulator, args, index,
+              s3_server=None):
+    """Run run-framework.py once, and return its measurements."""
+    run_framework = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'run-framework.py')
+    cmd = [sys.executable, run_framework,
+           '--exps_file', 'experiments.json',
+           '--host', emulator.host, '--port', str(emulator.port)]
+    if args.export:
+        cmd.append('--step_export')
+    cmd += [arg for arg in args.run_framework_args if arg != '--']
+
+    env = dict(os.environ, VARIABLES_FILE=variables_filepath)
+    env.update(s3_environment(s3_server))
+    log_filepath = os.path.join(folder, 'run-framework-%d.log' % index)
+
+    before = emulator.stats()
+    start = time.time()
+    with open(log_filepath, 'w') as log_file:
+        returncode = subprocess.call(cmd, cwd=folder, env=env,
+                                     stdout=log_file,
+                                     stderr=subprocess.STDOUT)
+    wall = time.time() - start
+    after = emulator.stats()
+
+    if returncode != 0:
+        raise Exception("run-framework.py failed (exit code %d), see %s" %
+                        (returncode, log_filepath))
+
+    calls = subtract(after['calls'], before['calls'])
+    bytes_in = subtract(after['bytes_in'], before['bytes_in'])
+    bytes_out = subtract(after['bytes_out'], before['bytes_out'])
+    compute = after['compute_seconds'] - before['compute_seconds']
+    return {'wall_seconds': wall, 'compute_seconds': compute,
+            'overhead_seconds': wall - compute, 'calls': calls,
+            'bytes_in': bytes_in, 'bytes_out': bytes_out}
+
+
+def subtract(after, before):
+    return {key: value - before.get(key, 0)
+            for key, value in after.items()
+            if value - before.get(key, 0)}
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def report(runs, sets):
+    run = sorted(runs, key=lambda r: r['wall_seconds'])[len(runs) // 2]
+
+    print("\n========== Sweep throughput (%d parameter sets, median of %d) "
+          "==========" % (sets, len(runs)))
+    print("wall time           %8.2fs" % median(
+        [r['wall_seconds'] for r in runs]))
+    print("compute time        %8.2fs" % median(
+        [r['compute_seconds'] for r in runs]))
+    print("overhead per set    %8.3fs" % (median(
+        [r['overhead_seconds'] for r in runs]) / sets))
+    print("sets per minute     %8.1f" % (60.0 * sets / median(
+        [r['wall_seconds'] for r in runs])))
+
+    print("\n%-16s %12s %16s %16s" % ('endpoint', 'calls/set', 'bytes in/set',
+                                      'bytes out/set'))
+    for endpoint in sorted(run['calls']):
+        print("%-16s %12.1f %16.0f %16.0f" % (
+            endpoint, run['calls'][endpoint] / float(sets),
+            run['bytes_in'].get(endpoint, 0) / float(sets),
+            run['bytes_out'].get(endpoint, 0) / float(sets)))
+    print("%-16s %12.1f %16.0f %16.0f" % (
+        'total', sum(run['calls'].values()) / float(sets),
+        sum(run['bytes_in'].values()) / float(sets),
+        sum(run['bytes_out'].values()) / float(sets)))
+
+
+def main():
+    args = setup_arg_parsing()
+
+    logging.basicConfig(format="[%(levelname)s] %(message)s",
+                        level=logging.WARNING)
+
+    folder = tempfile.mkdtemp(prefix='agief-benchmark-')
+    emulator = ComputeEmulator(port=0, latency=args.latency,
+                               age_rate=args.age_rate,
+                               export_size=args.export_size).start()
+    s3_server = start_s3_server()
+    try:
+        variables_filepath = create_experiment(folder, args)
+
+        runs = []
+        for index in range(args.repeats):
+            run = run_sweep(folder, variables_filepath, emulator, args, index,
+                            s3_server)
+            print("Run %d: %.2fs wall, %.2fs compute, %d calls" % (
+                index, run['wall_seconds'], run['compute_seconds'],
+                sum(run['calls'].values())))
+            runs.append(run)
+
+        report(runs, args.sets)
+
+        if args.json_filepath:
+            results = {'args': {key: value for key, value
+                                in vars(args).items()},
+                       'runs': runs}
+            with open(args.json_filepath, 'w') as json_file:
+                json.dump(results, json_file, indent=2)
+            print("\nResults written to " + args.json_filepath)
+    finally:
+        emulator.stop()
+        if s3_server is not None:
+            s3_server.stop()
+        if args.keep:
+            print("Experiment folder: " + folder)
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
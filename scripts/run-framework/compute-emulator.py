@@ -0,0 +1,82 @@
+from __future__ import print_function
+
+import argparse
+import logging
+
+from agief_experiment.computeemulator import ComputeEmulator
+from agief_experiment import utils
+
+HELP_GENERIC = """
+compute-emulator.py serves a local stand-in for the REST API of an AGIEF
+Compute node (/version, /config, /import, /import-local, /update, /export,
+/stop), for machines where the Java framework is not available, e.g. to
+exercise run-framework.py on CI. Experiments age at a fixed rate until their
+terminationAge. Counts of calls and bytes per endpoint are served as JSON
+at /emulator/stats.
+
+e.g. python compute-emulator.py --port 8491 --age_rate 50 --latency 0.1
+and then run-framework.py, without --step_compute, with the same --port.
+"""
+
+
+def setup_arg_parsing():
+    parser = argparse.ArgumentParser(
+        description=HELP_GENERIC,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--host', dest='host',
+                        help='Address to listen on (default=%(default)s).')
+    parser.add_argument('--port', dest='port', type=int,
+                        help='Port to listen on (default=%(default)s).')
+    parser.add_argument('--latency', dest='latency', type=float,
+                        help='Seconds added to every request, e.g. to '
+                             'emulate a remote Compute node '
+                             '(default=%(default)s).')
+    parser.add_argument('--age_rate', dest='age_rate', type=float,
+                        help='Ages per second of a running experiment '
+                             '(default=%(default)s).')
+    parser.add_argument('--stall_age', dest='stall_age', type=int,
+                        help='If set, experiments stop ageing at this age, '
+                             'to emulate a hung run.')
+    parser.add_argument('--export_size', dest='export_size', type=int,
+                        help='Pad data exports to at least this many bytes '
+                             '(default=%(default)s).')
+    parser.add_argument('--no_gzip', dest='accept_gzip',
+                        action='store_false',
+                        help='Reject gzip compressed imports, as older '
+                             'Compute nodes do.')
+    parser.add_argument('--logging', dest='logging',
+                        help='Logging level (default=%(default)s). '
+                             'Options: debug, info, warning, error, '
+                             'critical')
+
+    parser.set_defaults(host='localhost')
+    parser.set_defaults(port=8491)
+    parser.set_defaults(latency=0.0)
+    parser.set_defaults(age_rate=100.0)
+    parser.set_defaults(export_size=0)
+    parser.set_defaults(accept_gzip=True)
+    parser.set_defaults(logging='info')
+
+    return parser.parse_args()
+
+
+def main():
+    args = setup_arg_parsing()
+
+    logging.basicConfig(format="[%(asctime)s - %(levelname)s] %(message)s",
+                        level=utils.logger_level(args.logging))
+
+    emulator = ComputeEmulator(port=args.port, host=args.host,
+                               latency=args.latency, age_rate=args.age_rate,
+                               stall_age=args.stall_age,
+                               export_size=args.export_size,
+                               accept_gzip=args.accept_gzip)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
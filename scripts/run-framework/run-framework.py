@@ -8,9 +8,20 @@ from datetime import datetime
 
 from agief_experiment.host_node import HostNode
 from agief_experiment.compute import Compute
+from agief_experiment.localfleet import LocalFleet
 from agief_experiment.cloud import Cloud
 from agief_experiment.experiment import Experiment
+from agief_experiment.resultspipeline import ResultsPipeline
 from agief_experiment.launchmode import LaunchMode
+from agief_experiment.envresolver import EnvResolver
+from agief_experiment.httpsession import HttpSession
+from agief_experiment.sshpool import SSHPool
+from agief_experiment.retry import RetryStats
+from agief_experiment.readiness import ReadinessProbe
+from agief_experiment.tracing import Tracer
+from agief_experiment.metrics import Metrics
+from agief_experiment.stall import StallPolicy, AgeRateHistory
+from agief_experiment.sweepjournal import SweepJournal
 from agief_experiment import utils
 
 HELP_GENERIC = """
@@ -83,10 +94,63 @@ def setup_arg_parsing():
     parser.add_argument('--step_shutdown', dest='shutdown',
                         action='store_true',
                         help='Shutdown instances and Compute '
-                             '(if --launch_per_session) after other stages.')
+                             '(if --launch_per_session or --launch_warm) '
+                             'after other stages.')
     parser.add_argument('--step_export', dest='export', action='store_true',
                         help='Export entity tree and data at the end of '
                              'each experiment.')
+    parser.add_argument('--export_gzip', dest='export_gzip',
+                        action='store_true',
+                        help='With --step_export, gzip the exported files '
+                             'as they are received (.json.gz). The output '
+                             'is then not compressed again before upload.')
+    parser.add_argument('--import_gzip', dest='import_gzip',
+                        action='store_true',
+                        help='Gzip compress the input files as they are '
+                             'uploaded to Compute. Falls back to '
+                             'uncompressed uploads if Compute rejects them.')
+    parser.add_argument('--fold_params', dest='fold_params',
+                        action='store_true',
+                        help='Write the entity-parameters and '
+                             'dataset-parameters of the experiments file '
+                             'into the entity file before it is imported, '
+                             'rather than setting each one afterwards with '
+                             'a request to Compute. Parameters that are not '
+                             'in the entity file are still set with '
+                             'requests, concurrently per entity.')
+    parser.add_argument('--trace', dest='trace',
+                        help='Write timing spans of each stage of the '
+                             'session (sync, launch, import, set params, '
+                             'run, export, compress, upload...) to this '
+                             'JSONL file, tagged with the prefix and the '
+                             'parameter set.')
+    parser.add_argument('--trace_chrome', dest='trace_chrome',
+                        help='At the end of the session, write the timing '
+                             'spans to this file in the Chrome trace format '
+                             '(open it in chrome://tracing or Perfetto).')
+    parser.add_argument('--metrics_textfile', dest='metrics_textfile',
+                        help='Publish the progress of the session (running '
+                             'prefix and set index, age and age rate, stage '
+                             'durations, bytes exported and uploaded, '
+                             'retries) as Prometheus metrics in this file, '
+                             'rewritten atomically, e.g. for the node '
+                             'exporter textfile collector (*.prom).')
+    parser.add_argument('--metrics_port', dest='metrics_port', type=int,
+                        help='Serve the same metrics at '
+                             'http://[metrics_host]:[metrics_port]/metrics '
+                             '(OpenMetrics if requested by the scraper).')
+    parser.add_argument('--metrics_host', dest='metrics_host',
+                        help='Address to serve the metrics on '
+                             '(default=%(default)s).')
+    parser.add_argument('--metrics_session', dest='metrics_session',
+                        help='Value of the label \'session\' of the '
+                             'metrics, to tell apart concurrent sessions '
+                             '(default=[hostname]-[pid]).')
+    parser.add_argument('--started_marker', dest='started_marker',
+                        help='For local launches (without Docker), also wait '
+                             'for a line matching this regular expression in '
+                             'run_stdout.log before probing Compute, '
+                             'e.g. "Started"')
     parser.add_argument('--step_export_compute', dest='export_compute',
                         action='store_true',
                         help='Compute should export entity tree and data at '
@@ -95,6 +159,15 @@ def setup_arg_parsing():
     parser.add_argument('--step_upload', dest='upload', action='store_true',
                         help='Upload exported entity tree and data at the end '
                              'of each experiment.')
+    parser.add_argument('--upload_workers', dest='upload_workers', type=int,
+                        help='Number of threads compressing and uploading '
+                             'results in the background, while the next '
+                             'experiment runs (0 to upload before the next '
+                             'experiment starts). Default 2.')
+    parser.add_argument('--upload_queue', dest='upload_queue', type=int,
+                        help='Maximum number of finished experiments waiting '
+                             'for upload. When the queue is full, the next '
+                             'experiment waits. Default 4.')
     parser.add_argument('--DEBUG-NO-RUN', dest='debug_no_run',
                         action='store_true',
                         help='Do everything except actually run experiment '
@@ -120,6 +193,14 @@ def setup_arg_parsing():
                         help='If remote, the path to the remote '
                              'VARIABLES_FILE to use on the remote '
                              'Compute node (default=%(default)s).')
+    parser.add_argument('--compute_nodes', dest='compute_nodes',
+                        required=False,
+                        help='Comma separated list of Compute nodes as '
+                             'host:port, to run parameter sets in parallel '
+                             'on whichever node is free. Remote nodes are '
+                             'reached with the same user, ssh key and '
+                             'variables file as --host. If not set, '
+                             'only --host and --port are used.')
 
     # launch mode
     parser.add_argument('--launch_per_session', dest='launch_per_session',
@@ -128,6 +209,82 @@ def setup_arg_parsing():
                              '(and shutdown at the end if you use '
                              '--step_shutdown. Otherwise, it is launched '
                              'and shut per experiment.')
+    parser.add_argument('--launch_warm', dest='launch_warm',
+                        action='store_true',
+                        help='Compute node is launched once at the start, '
+                             'as with --launch_per_session, and kept warm '
+                             'between experiments: before each one it is '
+                             'checked for a clean state (and relaunched if '
+                             'the previous experiment failed or left it '
+                             'running). Entities of previous experiments '
+                             'are only released when it is recycled (see '
+                             '--warm_recycle), and data files are imported '
+                             'again for every experiment, except those in '
+                             '--warm_read_only_data.')
+    parser.add_argument('--warm_recycle', dest='warm_recycle', type=int,
+                        help='With --launch_warm, relaunch Compute after '
+                             'this many experiments, to release the '
+                             'entities of previous experiments '
+                             '(0 = never). Default 20.')
+    parser.add_argument('--warm_read_only_data', dest='warm_read_only_data',
+                        help='With --launch_warm, comma separated patterns '
+                             '(e.g. "mnist*.json,cifar*.json") of the names '
+                             'of data files that experiments only read: '
+                             'once loaded, they are not imported again '
+                             'until Compute is relaunched. Data an '
+                             'experiment writes to must not be listed, or '
+                             'its writes are seen by the next experiments.')
+
+    parser.add_argument('--stall_fraction', dest='stall_fraction',
+                        type=float,
+                        help='Abort a run (with /stop, the prefix is marked '
+                             'failed) when its age rate over the last '
+                             '--stall_window seconds drops below this '
+                             'fraction of its own moving average, or of the '
+                             'age rate of previous runs of the same '
+                             'experiment, or when no poll of the run '
+                             'succeeds for --stall_window seconds, e.g. 0.1. '
+                             'Off by default.')
+    parser.add_argument('--stall_window', dest='stall_window', type=float,
+                        help='With --stall_fraction, the period (seconds) '
+                             'over which the age rate is measured '
+                             '(default=%(default)s).')
+    parser.add_argument('--stall_history', dest='stall_history',
+                        help='With --stall_fraction, the file that keeps the '
+                             'age rates of completed runs per experiment, as '
+                             'a baseline (default=age-rates.json in the '
+                             'experiment folder).')
+
+    parser.add_argument('--journal', dest='journal',
+                        help='Journal the progress of the sweep in this file '
+                             '(append-only, fsync\'d): each parameter set, '
+                             'its prefix, and the stages it has completed '
+                             '(imported, ran, exported, uploaded).')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Resume the sweep recorded in --journal, with '
+                             'the same experiments file: completed '
+                             'parameter sets are skipped, sets that were '
+                             'exported but not uploaded are only uploaded, '
+                             'and the other sets are run again.')
+
+    parser.add_argument('--local_fleet', dest='local_fleet', required=False,
+                        help='Run a fleet of local Compute nodes on '
+                             'consecutive free ports from --port, each with '
+                             'its own run folder (AGI_RUN_HOME/fleet/PORT) '
+                             'and log files, and spread the parameter sets '
+                             'across them. The value is the number of nodes, '
+                             'or "auto" to choose it from the free cores and '
+                             'memory. Applies to LOCAL usage only.')
+    parser.add_argument('--fleet_instance_ram', dest='fleet_instance_ram',
+                        required=False,
+                        help='With --local_fleet auto, the GB of RAM to '
+                             'allow for each Compute node '
+                             '(default=%(default)s).')
+    parser.add_argument('--fleet_instance_cores',
+                        dest='fleet_instance_cores', required=False,
+                        help='With --local_fleet auto, the number of cores '
+                             'to allow for each Compute node '
+                             '(default=%(default)s).')
 
     parser.add_argument('--no_docker', dest='no_docker', action='store_true',
                         help='If set, then DO NOT launch in a docker '
@@ -188,10 +345,21 @@ def setup_arg_parsing():
                     )
     )
     parser.set_defaults(ami_ram='6')
+    parser.set_defaults(fleet_instance_ram='4')
+    parser.set_defaults(fleet_instance_cores='2')
     parser.set_defaults(no_docker=False)
     parser.set_defaults(logging="warning")
     parser.set_defaults(no_compress=False)
+    parser.set_defaults(export_gzip=False)
+    parser.set_defaults(import_gzip=False)
+    parser.set_defaults(fold_params=False)
+    parser.set_defaults(upload_workers=2)
+    parser.set_defaults(upload_queue=4)
+    parser.set_defaults(warm_recycle=20)
+    parser.set_defaults(stall_window=60.0)
+    parser.set_defaults(resume=False)
     parser.set_defaults(csv_output=False)
+    parser.set_defaults(metrics_host='localhost')
 
     return parser.parse_args()
 
@@ -224,12 +392,91 @@ def check_args(args, compute_node):
                       "running on a remote machine (use param --step_remote)")
         exit(1)
 
+    if args.local_fleet and compute_node.remote():
+        logging.error("A local fleet of Compute nodes cannot be used when "
+                      "running on a remote machine (arg: step_remote).")
+        exit(1)
+
+    if args.warm_read_only_data and not args.launch_warm:
+        logging.warning("Read only data files have been set, but Compute is "
+                        "not kept warm (arg: launch_warm). It will have no "
+                        "effect.")
+
+    if args.launch_warm and args.launch_per_session:
+        logging.error("Use either --launch_warm or --launch_per_session, "
+                      "not both.")
+        exit(1)
+
+    if args.local_fleet and args.compute_nodes:
+        logging.error("Use either --local_fleet or --compute_nodes to "
+                      "specify the Compute nodes, not both.")
+        exit(1)
+
+    if args.resume and not (args.journal and args.exps_file):
+        logging.error("--resume needs the --journal of the sweep, and its "
+                      "--exps_file.")
+        exit(1)
+
     if args.exps_file and not args.launch_compute:
         logging.warning("You have elected to run experiment without launching "
                         "a Compute node. For success, you'll have to have one "
                         "running already, or use param --step_compute)")
 
 
+def create_compute_pool(args, compute_node):
+    """
+    Create the pool of Compute nodes that parameter sets are dispatched to,
+    from the host:port list in args.compute_nodes
+
+    :param args: The commandline arguments
+    :param compute_node: The main Compute node, used if there is no list
+    :return: list of Compute objects
+    """
+    if not args.compute_nodes:
+        return [compute_node]
+
+    compute_nodes = []
+    for endpoint in args.compute_nodes.split(','):
+        endpoint = endpoint.strip()
+        if not endpoint:
+            continue
+
+        host, _, port = endpoint.rpartition(':')
+        if not host:
+            host, port = endpoint, args.port
+
+        if host == compute_node.host_node.host and port == compute_node.port:
+            compute_nodes.append(compute_node)
+        elif compute_node.remote():
+            compute_nodes.append(Compute(
+                HostNode(host, args.user, args.ssh_keypath,
+                         args.remote_variables_file, args.ssh_port), port))
+        else:
+            compute_nodes.append(Compute(HostNode(host, args.user), port))
+
+    return compute_nodes
+
+
+def create_local_fleet(args, experiment):
+    """
+    Create a fleet of local Compute nodes, as specified by args.local_fleet
+
+    :param args: The commandline arguments
+    :param experiment: The Experiment, used to locate the run folder
+    :return: list of Compute objects
+    """
+    fleet = LocalFleet(experiment,
+                       cores_per_instance=float(args.fleet_instance_cores),
+                       ram_per_instance=float(args.fleet_instance_ram))
+
+    if args.local_fleet == "auto":
+        count = fleet.instance_count()
+    else:
+        count = int(args.local_fleet)
+
+    return fleet.compute_nodes(count, args.port)
+
+
 def main():
     """
     The main scope of the run-framework containing the high level code
@@ -253,9 +500,28 @@ def main():
     logging.debug("Python Version: " + sys.version)
     logging.debug("Arguments: %s", args)
 
+    if args.trace or args.trace_chrome:
+        Tracer.start(args.trace, args.trace_chrome)
+    if args.metrics_textfile or args.metrics_port:
+        Metrics.start(args.metrics_textfile, args.metrics_port,
+                      args.metrics_host, args.metrics_session)
+
     exps_file = args.exps_file if args.exps_file else ""
     experiment = Experiment(args.debug_no_run, LaunchMode.from_args(args),
-                            exps_file, args.no_compress, args.csv_output)
+                            exps_file, args.no_compress or args.export_gzip,
+                            args.csv_output)
+
+    if args.upload and args.upload_workers > 0:
+        experiment.results_pipeline = ResultsPipeline(args.upload_workers,
+                                                      args.upload_queue)
+
+    stall_policy = None
+    if args.stall_fraction:
+        stall_policy = StallPolicy(args.stall_fraction, args.stall_window)
+        if args.exps_file:
+            experiment.age_rate_history = AgeRateHistory(
+                args.stall_history or
+                experiment.experiment_utils.experiment_path('age-rates.json'))
 
     # 1) Generate input files
     if args.main_class:
@@ -268,6 +534,10 @@ def main():
 
     # *) all other use cases (non Generate input files)
 
+    # compile the experiments definition file once, for all stages
+    if args.exps_file:
+        experiment.experiment_utils.plan()
+
     cloud = Cloud()
 
     if args.upload and not (args.export or args.export_compute):
@@ -323,10 +593,25 @@ def main():
     # Try to run experiment, and if fails with exception,
     # still shut down infrastructure
     failed = False
+    compute_nodes = [compute_node]
     try:
         compute_node.host_node.host = ips['ip_public']
         compute_node.port = args.port
 
+        if args.local_fleet:
+            compute_nodes = create_local_fleet(args, experiment)
+        else:
+            compute_nodes = create_compute_pool(args, compute_node)
+
+        for node in compute_nodes:
+            node.import_gzip = args.import_gzip
+            node.started_marker = args.started_marker
+            node.stall_policy = stall_policy
+            if args.warm_read_only_data:
+                node.read_only_data = [
+                    pattern.strip()
+                    for pattern in args.warm_read_only_data.split(',')]
+
         # TEMPORARY HACK for ECS
         # Set the DB_HOST environment variable
         if args.pg_instance:
@@ -334,7 +619,11 @@ def main():
 
         # 3) Sync code and run-home
         if args.sync:
-            cloud.sync_experiment(compute_node.host_node)
+            synced_hosts = set()
+            for node in compute_nodes:
+                if node.remote() and node.host_node.host not in synced_hosts:
+                    cloud.sync_experiment(node.host_node)
+                    synced_hosts.add(node.host_node.host)
 
         # 3.5) Prepare data and sync from S3 if necessary
         # This is typically used to download output files from
@@ -345,16 +634,25 @@ def main():
 
         # 4) Launch Compute (remote or local)
         # *** IF Mode == 'Per Session' ***
-        if ((LaunchMode.from_args(args) is LaunchMode.per_session) and
+        # *** or 'Warm' ***
+        if (LaunchMode.from_args(args).launches_per_session() and
                 args.launch_compute):
-            compute_node.launch(experiment, cloud=cloud,
-                                main_class=args.main_class,
-                                no_local_docker=args.no_docker)
+            for node in compute_nodes:
+                node.launch(experiment, cloud=cloud,
+                            main_class=args.main_class,
+                            no_local_docker=args.no_docker)
 
         # 5) Run experiments
         # This includes per experiment 'export results' and 'upload results'
         if args.exps_file:
-            experiment.run_sweeps(compute_node, cloud, args)
+            if args.journal:
+                experiment.journal = SweepJournal(
+                    args.journal,
+                    experiment.experiment_utils.experiment_def_file(),
+                    args.resume)
+            with Tracer.span('sweeps'):
+                experiment.run_sweeps(compute_node, cloud, args,
+                                      compute_nodes)
             experiment.persist_prefix_history(cloud)
 
     except Exception as err:  # pylint: disable=W0703
@@ -372,16 +670,24 @@ def main():
 
         # Shutdown the Docker container
         print("Attempting to shutdown Docker container...")
-        if host_node.remote() and compute_node.container_id:
-            utils.remote_run(host_node,
-                             'docker stop ' + compute_node.container_id)
-        elif not host_node.remote() and not args.no_docker:
-            utils.docker_stop()
+        for node in compute_nodes:
+            if node.remote() and node.container_id:
+                utils.remote_run(node.host_node,
+                                 'docker stop ' + node.container_id)
+            elif not node.remote() and not args.no_docker:
+                utils.docker_stop(node.container_id or None)
+
+    # 5.5) Wait for the results of the last experiments to be uploaded
+    if experiment.results_pipeline:
+        with Tracer.span('drain-uploads'):
+            if not experiment.results_pipeline.drain():
+                failed = True
 
     # 6) Shutdown framework
     if args.shutdown:
-        if LaunchMode.from_args(args) is LaunchMode.per_session:
-            compute_node.terminate()
+        if LaunchMode.from_args(args).launches_per_session():
+            for node in compute_nodes:
+                node.terminate()
 
         # Shutdown infrastructure
         if args.remote_type == "aws":
@@ -398,6 +704,17 @@ def main():
     print("Experiment finished in %d days, %d hr, %d min, %d s" %
           tuple(exp_runtime))
 
+    EnvResolver.report()
+    RetryStats.report()
+    ReadinessProbe.report()
+    cloud.s3_uploader.report()
+    HttpSession.close_all()
+    SSHPool.close_all()
+    Tracer.close()
+    Metrics.close()
+    if experiment.journal is not None:
+        experiment.journal.close()
+
     if failed:
         exit(1)
 
@@ -16,6 +16,7 @@ import googleapiclient.discovery
 from agief_experiment import utils
 from agief_experiment.compute import Compute
 from agief_experiment.host_node import HostNode
+from agief_experiment.sshpool import SSHPool
 
 from tf_experiment.pagi_experiment import PAGIExperiment
 from tf_experiment.memory_experiment import MemoryExperiment
@@ -273,6 +274,8 @@ def main():
   exp_runtime = utils.format_timedelta(exp_end_time - exp_start_time)
   print('Experiment finished in %d days, %d hr, %d min, %d s' % tuple(exp_runtime))
 
+  SSHPool.close_all()
+
   if failed:
     exit(1)
 
@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from agief_experiment.envresolver import EnvResolver
+
+
+class EnvResolverTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.variables_file = os.path.join(self.folder, 'variables.sh')
+
+  def tearDown(self):
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def write_variables(self, text):
+    with open(self.variables_file, 'w') as variables_file:
+      variables_file.write(text)
+
+  def test_exported_and_unexported_variables(self):
+    self.write_variables("export AGI_HOME=/opt/agi\n"
+                         "AGI_RUN_HOME=$AGI_HOME/run\n")
+    resolver = EnvResolver(self.variables_file)
+
+    self.assertEqual(resolver.resolve('AGI_HOME/bin'), '/opt/agi/bin')
+    self.assertEqual(resolver.resolve('AGI_RUN_HOME'), '/opt/agi/run')
+
+  def test_failed_source_is_not_cached(self):
+    resolver = EnvResolver(self.variables_file)
+    self.assertEqual(resolver.resolve('AGI_HOME'), '')
+
+    self.write_variables("AGI_HOME=/opt/agi\n")
+    self.assertEqual(resolver.resolve('AGI_HOME'), '/opt/agi')
+    self.assertEqual(resolver.resolve('AGI_HOME'), '/opt/agi')
+    self.assertEqual(resolver.spawns, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
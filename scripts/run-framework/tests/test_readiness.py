@@ -0,0 +1,96 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from agief_experiment.compute import Compute
+from agief_experiment.computeemulator import ComputeEmulator
+from agief_experiment.host_node import HostNode
+from agief_experiment.readiness import ReadinessProbe
+
+
+def free_port():
+  sock = socket.socket()
+  sock.bind(('localhost', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+
+class ReadinessProbeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.emulator = None
+
+  def tearDown(self):
+    if self.emulator is not None:
+      self.emulator.stop()
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def compute(self, port):
+    return Compute(HostNode(host='localhost'), port=str(port))
+
+  def test_ready_when_version_answers(self):
+    self.emulator = ComputeEmulator(port=0).start()
+    probe = ReadinessProbe(self.compute(self.emulator.port), deadline=10)
+
+    self.assertIsNotNone(probe.wait())
+    url, _, steps = ReadinessProbe.launches[-1]
+    self.assertEqual(url, self.compute(self.emulator.port).base_url())
+    self.assertEqual(sorted(steps), ['connect', 'version'])
+
+  def test_waits_for_a_late_start(self):
+    port = free_port()
+    self.emulator = ComputeEmulator(port=port)
+    timer = threading.Timer(0.3, self.emulator.start)
+    timer.start()
+
+    start = time.time()
+    probe = ReadinessProbe(self.compute(port), deadline=10)
+    self.assertIsNotNone(probe.wait(start))
+    timer.join()
+    self.assertGreaterEqual(time.time() - start, 0.3)
+
+  def test_log_marker_written_after_launch(self):
+    self.emulator = ComputeEmulator(port=0).start()
+    log_filepath = os.path.join(self.folder, 'run_stdout.log')
+    with open(log_filepath, 'w') as log_file:
+      log_file.write("a previous launch\nStarted OK\n")
+    # the log of the previous launch is older than this one
+    os.utime(log_filepath, (time.time() - 60, time.time() - 60))
+
+    def write_log():
+      with open(log_filepath, 'w') as log_file:
+        log_file.write("Starting...\n")
+        log_file.flush()
+        time.sleep(0.2)
+        log_file.write("Started OK\n")
+
+    start = time.time()
+    writer = threading.Timer(0.1, write_log)
+    writer.start()
+    probe = ReadinessProbe(self.compute(self.emulator.port),
+                           log_filepath=log_filepath,
+                           started_marker=r'^Started', deadline=10)
+    self.assertIsNotNone(probe.wait(start))
+    writer.join()
+
+    _, _, steps = ReadinessProbe.launches[-1]
+    self.assertGreaterEqual(steps['log'], 0.3)
+
+  def test_deadline_when_nothing_listens(self):
+    probe = ReadinessProbe(self.compute(free_port()), deadline=0.5)
+
+    start = time.time()
+    with self.assertRaises(Exception) as context:
+      probe.wait()
+    self.assertIn("nothing listening", str(context.exception))
+    self.assertLess(time.time() - start, 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,71 @@
+import threading
+import unittest
+
+from agief_experiment.resultspipeline import ResultsPipeline
+
+
+class ResultsPipelineTest(unittest.TestCase):
+
+  def test_submit_blocks_while_queue_is_full(self):
+    pipeline = ResultsPipeline(workers=1, max_pending=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocked():
+      started.set()
+      release.wait(5)
+
+    pipeline.submit('p1', blocked)
+    started.wait(5)
+    # the worker is busy with p1, p2 fills the queue
+    pipeline.submit('p2', lambda: None)
+
+    submitted = threading.Event()
+
+    def submit_third():
+      pipeline.submit('p3', lambda: None)
+      submitted.set()
+
+    thread = threading.Thread(target=submit_third)
+    thread.start()
+    self.assertFalse(submitted.wait(0.2))
+
+    release.set()
+    self.assertTrue(submitted.wait(5))
+    thread.join()
+
+    self.assertTrue(pipeline.drain())
+    self.assertEqual(sorted(pipeline.completed), ['p1', 'p2', 'p3'])
+
+  def test_drain_reports_failures_per_prefix(self):
+    pipeline = ResultsPipeline(workers=2, max_pending=4)
+
+    def fail():
+      raise ValueError("upload failed")
+
+    pipeline.submit('ok-1', lambda: None)
+    pipeline.submit('bad', fail)
+    pipeline.submit('ok-2', lambda: None)
+
+    self.assertFalse(pipeline.drain())
+    self.assertEqual(sorted(pipeline.completed), ['ok-1', 'ok-2'])
+    self.assertEqual([prefix for prefix, _ in pipeline.failures], ['bad'])
+    self.assertIsInstance(pipeline.failures[0][1], ValueError)
+
+    summary = pipeline.summary()
+    self.assertIn("2 ok, 1 failed", summary)
+    self.assertIn("bad: FAILED (upload failed)", summary)
+
+  def test_drain_waits_for_queued_work(self):
+    pipeline = ResultsPipeline(workers=1, max_pending=8)
+    done = []
+    for i in range(5):
+      pipeline.submit('p%d' % i, lambda i=i: done.append(i))
+
+    self.assertTrue(pipeline.drain())
+    self.assertEqual(done, list(range(5)))
+    self.assertEqual(pipeline.workers, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
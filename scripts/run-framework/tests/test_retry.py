@@ -0,0 +1,37 @@
+import time
+import unittest
+
+from agief_experiment.retry import Retry, RetryPolicy, RetryStats
+
+
+class RetryIterTest(unittest.TestCase):
+
+  def test_attempt_counted_after_break(self):
+    policy = RetryPolicy(initial=0.01, maximum=0.01, jitter=0,
+                         max_attempts=5)
+    stats = RetryStats.for_name('test-iter-break')
+
+    for attempt in Retry(policy, 'test-iter-break'):
+      time.sleep(0.02)
+      if attempt == 2:
+        break
+
+    self.assertEqual(stats.attempts, 2)
+    self.assertEqual(stats.retries, 1)
+    self.assertEqual(stats.give_ups, 0)
+    self.assertGreaterEqual(stats.work_seconds, 0.04)
+
+  def test_attempts_counted_when_given_up(self):
+    policy = RetryPolicy(initial=0.01, maximum=0.01, jitter=0,
+                         max_attempts=3)
+    stats = RetryStats.for_name('test-iter-give-up')
+
+    for _ in Retry(policy, 'test-iter-give-up'):
+      pass
+
+    self.assertEqual(stats.attempts, 3)
+    self.assertEqual(stats.give_ups, 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+try:
+  import boto3
+  from moto import mock_aws
+except ImportError:
+  mock_aws = None
+
+from agief_experiment.s3uploader import S3Uploader, MB
+
+BUCKET = 'agief-test'
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class S3UploaderTest(unittest.TestCase):
+
+  def setUp(self):
+    environment = {'AWS_ACCESS_KEY_ID': 'test',
+                   'AWS_SECRET_ACCESS_KEY': 'test',
+                   'AWS_DEFAULT_REGION': 'us-east-1'}
+    self.environment = mock.patch.dict(os.environ, environment)
+    self.environment.start()
+    os.environ.pop('AGI_S3_ENDPOINT_URL', None)
+
+    self.mock = mock_aws()
+    self.mock.start()
+
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder, ignore_errors=True)
+    self.mock.stop()
+    self.environment.stop()
+
+  def write_file(self, name, size):
+    filepath = os.path.join(self.folder, name)
+    with open(filepath, 'wb') as data_file:
+      data_file.write(os.urandom(size))
+    return filepath
+
+  def test_bucket_created_once_under_concurrency(self):
+    uploader = S3Uploader()
+    client = uploader.client()
+    calls = {'head_bucket': 0, 'create_bucket': 0}
+    calls_lock = threading.Lock()
+
+    def counted(name, method):
+      def call(**kwargs):
+        with calls_lock:
+          calls[name] += 1
+        # widen the window in which the threads race to check the bucket
+        time.sleep(0.05)
+        return method(**kwargs)
+      return call
+
+    with mock.patch.object(client, 'head_bucket',
+                           counted('head_bucket', client.head_bucket)), \
+        mock.patch.object(client, 'create_bucket',
+                          counted('create_bucket', client.create_bucket)):
+      threads = [threading.Thread(target=uploader.ensure_bucket,
+                                  args=(BUCKET,)) for _ in range(8)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+    self.assertEqual(calls, {'head_bucket': 1, 'create_bucket': 1})
+    self.assertIn(BUCKET, uploader.checked_buckets)
+    boto3.client('s3').head_bucket(Bucket=BUCKET)
+
+  def test_bucket_check_retried_after_failure(self):
+    uploader = S3Uploader()
+    client = uploader.client()
+
+    with mock.patch.object(client, 'head_bucket',
+                           side_effect=RuntimeError('network down')):
+      with self.assertRaises(RuntimeError):
+        uploader.ensure_bucket(BUCKET)
+    self.assertNotIn(BUCKET, uploader.checked_buckets)
+
+    uploader.ensure_bucket(BUCKET)
+    self.assertIn(BUCKET, uploader.checked_buckets)
+
+  def test_multipart_upload(self):
+    uploader = S3Uploader(multipart_threshold=5 * MB,
+                          multipart_chunksize=5 * MB, part_concurrency=3)
+    filepath = self.write_file('large.bin', 12 * MB)
+
+    uploaded = uploader.upload_file(BUCKET, 'run/large.bin', filepath)
+
+    self.assertEqual(uploaded, 12 * MB)
+    head = boto3.client('s3').head_object(Bucket=BUCKET, Key='run/large.bin')
+    self.assertEqual(head['ContentLength'], 12 * MB)
+    # the ETag of a multipart upload ends with the number of parts
+    self.assertTrue(head['ETag'].strip('"').endswith('-3'), head['ETag'])
+
+    body = boto3.client('s3').get_object(Bucket=BUCKET,
+                                         Key='run/large.bin')['Body'].read()
+    with open(filepath, 'rb') as data_file:
+      self.assertEqual(body, data_file.read())
+
+  def test_upload_folder(self):
+    os.makedirs(os.path.join(self.folder, 'out', 'sub'))
+    for name in ('a.txt', os.path.join('sub', 'b.txt')):
+      with open(os.path.join(self.folder, 'out', name), 'w') as out_file:
+        out_file.write(name)
+
+    uploader = S3Uploader()
+    uploader.upload_folder(BUCKET, 'prefix/out',
+                           os.path.join(self.folder, 'out'))
+
+    listing = boto3.client('s3').list_objects_v2(Bucket=BUCKET)
+    self.assertEqual(sorted(item['Key'] for item in listing['Contents']),
+                     ['prefix/out/a.txt', 'prefix/out/sub/b.txt'])
+    self.assertEqual(uploader.files_uploaded, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from agief_experiment.stall import StallPolicy
+
+
+class StallWatchdogTest(unittest.TestCase):
+
+  def test_stalled_without_successful_poll(self):
+    watchdog = StallPolicy(window=10).watchdog()
+    start = watchdog.started
+
+    self.assertIsNone(watchdog.stalled(now=start + 9))
+    self.assertIn("no successful poll", watchdog.stalled(now=start + 10))
+
+  def test_stalled_when_polls_stop_succeeding(self):
+    watchdog = StallPolicy(window=10).watchdog()
+    start = watchdog.started
+
+    for t in range(0, 30, 2):
+      watchdog.update(t * 5, now=start + t)
+    self.assertIsNone(watchdog.stalled(now=start + 30))
+
+    # polls fail from here, e.g. Compute hangs and every request times out
+    self.assertIsNone(watchdog.stalled(now=start + 37))
+    self.assertIn("no successful poll", watchdog.stalled(now=start + 38))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from agief_experiment.sweepjournal import SweepJournal, open_for_append
+
+STAGES = ['imported', 'ran', 'exported', 'uploaded']
+
+
+class SweepJournalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.journal_filepath = os.path.join(self.folder, 'sweep.journal')
+    self.exps_filepath = os.path.join(self.folder, 'experiments.json')
+    with open(self.exps_filepath, 'w') as exps_file:
+      exps_file.write('{"experiments": []}')
+
+  def tearDown(self):
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+  def journal(self, resume=False):
+    return SweepJournal(self.journal_filepath, self.exps_filepath, resume)
+
+  def write_sweep(self):
+    """Set 0 complete, set 1 exported but not uploaded, set 2 started."""
+    journal = self.journal()
+    journal.start('0:1', 1, 'prefix-a', ['lr=0.1'])
+    for stage in STAGES:
+      journal.record('prefix-a', stage)
+    journal.start('0:2', 2, 'prefix-b', ['lr=0.2'])
+    for stage in STAGES[:3]:
+      journal.record('prefix-b', stage)
+    journal.start('0:3', 3, 'prefix-c', ['lr=0.3'])
+    journal.record('prefix-c', 'imported')
+    journal.close()
+
+  def test_resume_replays_the_state_of_each_set(self):
+    self.write_sweep()
+    journal = self.journal(resume=True)
+
+    self.assertTrue(journal.is_complete('0:1', STAGES))
+    self.assertFalse(journal.is_complete('0:2', STAGES))
+    self.assertEqual([state.key for state in journal.completed(STAGES)],
+                     ['0:1'])
+    self.assertEqual([state.key for state in
+                      journal.pending(STAGES, 'uploaded')], ['0:2'])
+    self.assertEqual(journal.state('0:3').stages, {'imported'})
+    self.assertEqual(journal.state('0:2').params, ['lr=0.2'])
+    self.assertEqual(journal.prefixes(),
+                     {'prefix-a', 'prefix-b', 'prefix-c'})
+    journal.close()
+
+  def test_resume_over_a_truncated_last_record(self):
+    self.write_sweep()
+    with open(self.journal_filepath, 'a') as journal_file:
+      # a crash in the middle of writing a record
+      journal_file.write('{"event": "stage", "prefix": "prefix-c", "sta')
+
+    journal = self.journal(resume=True)
+    self.assertEqual(journal.state('0:3').stages, {'imported'})
+
+    # the next record starts on a line of its own, and is read back
+    journal.record('prefix-c', 'ran')
+    journal.close()
+
+    journal = self.journal(resume=True)
+    self.assertEqual(journal.state('0:3').stages, {'imported', 'ran'})
+    journal.close()
+
+  def test_retried_set_replaces_the_previous_attempt(self):
+    self.write_sweep()
+    journal = self.journal(resume=True)
+    journal.start('0:3', 3, 'prefix-d', ['lr=0.3'])
+    # a late record of the previous attempt
+    journal.record('prefix-c', 'ran')
+    self.assertEqual(journal.state('0:3').stages, set())
+    journal.close()
+
+    journal = self.journal(resume=True)
+    state = journal.state('0:3')
+    self.assertEqual(state.prefix, 'prefix-d')
+    self.assertEqual(state.stages, set())
+    journal.close()
+
+  def test_new_session_starts_afresh(self):
+    self.write_sweep()
+    self.journal().close()
+
+    journal = self.journal(resume=True)
+    self.assertIsNone(journal.state('0:1'))
+    self.assertEqual(journal.completed(STAGES), [])
+    journal.close()
+
+  def test_changed_experiments_file_is_not_resumed(self):
+    self.write_sweep()
+    with open(self.exps_filepath, 'w') as exps_file:
+      exps_file.write('{"experiments": [{}]}')
+
+    with self.assertRaises(Exception):
+      self.journal(resume=True)
+
+  def test_resume_without_a_journal(self):
+    journal = self.journal(resume=True)
+    self.assertEqual(journal.completed(STAGES), [])
+    journal.close()
+    self.assertTrue(os.path.exists(self.journal_filepath))
+
+  def test_open_for_append_terminates_a_torn_line(self):
+    filepath = os.path.join(self.folder, 'torn.jsonl')
+    with open(filepath, 'w') as torn_file:
+      torn_file.write('{"a": 1}\n{"b": ')
+
+    with open_for_append(filepath) as appended_file:
+      appended_file.write('{"c": 3}\n')
+
+    with open(filepath) as torn_file:
+      self.assertEqual(torn_file.read().splitlines(),
+                       ['{"a": 1}', '{"b": ', '{"c": 3}'])
+
+
+if __name__ == '__main__':
+  unittest.main()
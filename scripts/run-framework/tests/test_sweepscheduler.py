@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+from agief_experiment.sweepscheduler import SweepScheduler
+
+
+class FakeNode:
+
+  def __init__(self, name):
+    self.name = name
+
+  def base_url(self):
+    return self.name
+
+
+class SweepSchedulerTest(unittest.TestCase):
+
+  def test_needs_a_node(self):
+    with self.assertRaises(ValueError):
+      SweepScheduler([])
+
+  def test_sets_run_on_free_nodes_in_parallel(self):
+    nodes = [FakeNode('a'), FakeNode('b')]
+    busy = set()
+    busy_lock = threading.Lock()
+    overlaps = []
+
+    def run_parameterset(compute_node, parameter_set):
+      with busy_lock:
+        if compute_node.name in busy:
+          overlaps.append(parameter_set['prefix'])
+        busy.add(compute_node.name)
+      time.sleep(0.05)
+      with busy_lock:
+        busy.discard(compute_node.name)
+      return True
+
+    parameter_sets = [{'prefix': 'p%d' % i} for i in range(6)]
+    start = time.time()
+    results = SweepScheduler(nodes).run(parameter_sets, run_parameterset)
+    elapsed = time.time() - start
+
+    self.assertEqual(overlaps, [])
+    self.assertEqual([result.prefix for result in results],
+                     ['p%d' % i for i in range(6)])
+    self.assertEqual([result.index for result in results], list(range(6)))
+    self.assertFalse(any(result.failed for result in results))
+    # 6 sets of 0.05s over 2 nodes
+    self.assertLess(elapsed, 0.25)
+
+  def test_next_set_is_pulled_when_a_node_is_free(self):
+    nodes = [FakeNode('a'), FakeNode('b')]
+    running = []
+    pulled_while_running = []
+    lock = threading.Lock()
+
+    def parameter_sets():
+      for i in range(5):
+        with lock:
+          pulled_while_running.append(len(running))
+        yield {'prefix': 'p%d' % i}
+
+    def run_parameterset(compute_node, parameter_set):
+      with lock:
+        running.append(parameter_set['prefix'])
+      time.sleep(0.05)
+      with lock:
+        running.remove(parameter_set['prefix'])
+      return True
+
+    SweepScheduler(nodes).run(parameter_sets(), run_parameterset)
+
+    # a set is never planned while every node is busy
+    self.assertTrue(all(count < len(nodes) for count in pulled_while_running),
+                    pulled_while_running)
+
+  def test_failures_are_reported_per_set(self):
+    def run_parameterset(compute_node, parameter_set):
+      if parameter_set['prefix'] == 'raises':
+        raise RuntimeError("Compute went away")
+      return parameter_set['prefix'] != 'fails'
+
+    parameter_sets = [{'prefix': prefix}
+                      for prefix in ('ok', 'fails', 'raises', 'ok-2')]
+    scheduler = SweepScheduler([FakeNode('a'), FakeNode('b')])
+    results = scheduler.run(parameter_sets, run_parameterset)
+
+    self.assertEqual([result.failed for result in results],
+                     [False, True, True, False])
+    self.assertIsNone(results[1].error)
+    self.assertIsInstance(results[2].error, RuntimeError)
+    # every node is free again
+    self.assertEqual(scheduler.free_nodes.qsize(), 2)
+
+    summary = SweepScheduler.summary(results)
+    self.assertIn("[2] raises on", summary)
+    self.assertIn("FAILED", summary)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -15,7 +15,10 @@
 
 """Experiment base class."""
 
-from agief_experiment import utils
+from agief_experiment import deltasync
+from agief_experiment.deltasync import DeltaSync
+from agief_experiment.envresolver import EnvResolver
+from agief_experiment.experimentutils import ExperimentUtils
 
 class Experiment:
   """Base class for TensorFlow-based experiments."""
@@ -32,9 +35,8 @@ class Experiment:
     """
     print('\n....... Sync Experiment')
 
-    cmd = '../remote/remote-sync-tf-experiment.sh ' + remote.host_key_user_variables()
-    print('sync cmd', cmd)
-    utils.run_bashscript_repeat(cmd, 15, 6)
+    env = EnvResolver.for_file(ExperimentUtils('').variables_filepath())
+    DeltaSync(remote).sync(deltasync.tf_experiment_trees(env))
 
   def run_sweeps(self, config, config_json, args, host_node):
     """Run the sweeps"""
@@ -23,6 +23,7 @@ import itertools
 import numpy as np
 
 from agief_experiment import utils
+from agief_experiment.remotecommand import RemoteCommand
 from tf_experiment.experiment import Experiment
 
 def parse_range(param_sweeps):
@@ -187,15 +188,17 @@ class MemoryExperiment(Experiment):
 
   def _exec_experiment(self, host_node, experiment_id, experiment_prefix,
                        config_json, param_sweeps=None):
-    utils.remote_run(
+    # the run can last hours, its output is streamed rather than collected
+    RemoteCommand(
         host_node,
         self._run_command(host_node, experiment_id, experiment_prefix,
-                          config_json, param_sweeps))
+                          config_json, param_sweeps)).run()
 
     if self.export:
-      utils.remote_run(
+      RemoteCommand(
           host_node,
-          self._upload_command(host_node, experiment_id, experiment_prefix))
+          self._upload_command(host_node, experiment_id,
+                               experiment_prefix)).run()
 
   def _launch_docker(self, host_node):
     """Launch the Docker container on the remote machine."""
@@ -260,10 +263,14 @@ class MemoryExperiment(Experiment):
           prefix=experiment_prefix
       )
 
-    remote_output = utils.remote_run(host_node, command)
-    command_output = [s for s in remote_output if 'Created experiment' in s]
-    command_output = command_output[0].strip().split(' ')
-    experiment_id = int(command_output[-1])
+    remote_command = RemoteCommand(host_node, command)
+    created = remote_command.match(r'Created experiment.*?(\d+)\s*$')
+    remote_command.run()
+
+    if created.match is None:
+      raise Exception('Could not create the MLFlow experiment, output: ' +
+                      '\n'.join(line.text for line in remote_command.tail()))
+    experiment_id = int(created.match.group(1))
 
     return experiment_id, experiment_prefix
 
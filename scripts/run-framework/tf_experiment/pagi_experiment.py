@@ -19,7 +19,7 @@ import os
 import logging
 import datetime
 
-from agief_experiment import utils
+from agief_experiment.remotecommand import RemoteCommand
 from tf_experiment.memory_experiment import MemoryExperiment
 
 class PAGIExperiment(MemoryExperiment):
@@ -71,10 +71,14 @@ class PAGIExperiment(MemoryExperiment):
           project=self.project
       )
 
-    remote_output = utils.remote_run(host_node, command)
-    command_output = [s for s in remote_output if 'Created experiment' in s]
-    command_output = command_output[0].strip().split(' ')
-    experiment_id = int(command_output[-1])
+    remote_command = RemoteCommand(host_node, command)
+    created = remote_command.match(r'Created experiment.*?(\d+)\s*$')
+    remote_command.run()
+
+    if created.match is None:
+      raise Exception('Could not create the MLFlow experiment, output: ' +
+                      '\n'.join(line.text for line in remote_command.tail()))
+    experiment_id = int(created.match.group(1))
 
     return experiment_id, experiment_prefix
 
@@ -18,7 +18,7 @@
 import logging
 import datetime
 
-from agief_experiment import utils
+from agief_experiment.remotecommand import RemoteCommand
 from tf_experiment.experiment import Experiment
 
 class SparseCapsExperiment(Experiment):
@@ -40,12 +40,12 @@ class SparseCapsExperiment(Experiment):
             run_prefix)
 
         # Start experiment
-        utils.remote_run(
+        RemoteCommand(
             host_node,
             self._train_op(host_node.remote_variables_file,
                            config['experiment-parameters'],
                            config['train-parameters'],
-                           summary_dir, hparams))
+                           summary_dir, hparams)).run()
 
       with open('prefixes.txt', 'w') as prefix_file:
         prefix_file.write(','.join(prefixes))
@@ -65,26 +65,28 @@ class SparseCapsExperiment(Experiment):
           # Export experiment for each prefix
           print('........ Evaluating: {0}\n'.format(prefix))
           for eval_sweep in config['eval-sweeps']:
-            utils.remote_run(
+            RemoteCommand(
                 host_node,
                 self._eval_op(host_node.remote_variables_file,
                               config['experiment-parameters'],
                               config['train-parameters'],
-                              summary_dir, eval_sweep, hparams_sweeps[i]))
+                              summary_dir, eval_sweep,
+                              hparams_sweeps[i])).run()
 
         if args.phase == 'classify':
           # Classification
           print('........ Classifying: {0}\n'.format(prefix))
           for classify_sweep in config['classify-sweeps']:
             for model in classify_sweep['model']:
-              utils.remote_run(
+              RemoteCommand(
                   host_node,
                   self._classify_op(host_node.remote_variables_file,
                                     summary_dir,
                                     classify_sweep['dataset'],
                                     model,
                                     config['train-parameters']['max_steps'],
-                                    config['experiment-parameters']['model']))
+                                    config['experiment-parameters']['model'])
+              ).run()
 
   def _parse_hparams_sweeps(self, sweeps):
     hparams_sweeps = []